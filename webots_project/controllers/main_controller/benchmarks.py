@@ -0,0 +1,933 @@
+# benchmarks.py
+# Offline micro-benchmarks for the controller modules, run without Webots:
+#   python benchmarks.py [name ...]
+
+import math
+import sys
+import time
+import numpy as np
+from tests.stand_ins import (SyntheticWorld, StandInCamera, StandInCameraMotor, StandInRobot,
+                              build_mapped_robot, map_pose, synthetic_frames)
+
+
+def time_call(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - start) / repeats * 1000.0, result
+
+
+def bench_scan_match(trials=20, seed=0):
+    world, robot, mapper = build_mapped_robot()
+    ranges = np.clip(np.array(robot.getDevice("LDS-01").getRangeImage(), dtype=np.float32),
+                     mapper.lidar_min, mapper.lidar_max)
+    matcher = mapper.correlative_matcher
+    rng = np.random.default_rng(seed)
+    rows = {"simple_scan_match": [], "correlative": [], "correlative+refine": []}
+    nodes = []
+    for _ in range(trials):
+        ex, ey = rng.uniform(-0.4, 0.4, 2)
+        eth = rng.uniform(-0.3, 0.3)
+        true_x, true_y, true_th = map_pose(world)
+        guess = (true_x + ex, true_y + ey, true_th + eth)
+
+        ms, pose = time_call(lambda: mapper.simple_scan_match(ranges, *guess), 5)
+        rows["simple_scan_match"].append((ms, math.hypot(pose[0] - true_x, pose[1] - true_y)))
+        ms, pose = time_call(lambda: matcher.match(ranges, *guess), 5)
+        rows["correlative"].append((ms, math.hypot(pose[0] - true_x, pose[1] - true_y)))
+        nodes.append(matcher.nodes_scored)
+        ms_refine, pose = time_call(lambda: mapper.refine_pose(ranges, *pose[:3]), 5)
+        rows["correlative+refine"].append((ms + ms_refine, math.hypot(pose[0] - true_x, pose[1] - true_y)))
+
+    n_rot = 2 * int(math.ceil(matcher.angular_window / matcher.angular_resolution)) + 1
+    n_xy = 2 * int(round(matcher.linear_window * mapper.RESOLUTION)) + 1
+    print(f"scan match, {trials} poses with up to 0.4 m / 0.3 rad error, timestep {mapper.TIME_STEP} ms")
+    for name, values in rows.items():
+        ms = np.array([v[0] for v in values])
+        err = np.array([v[1] for v in values])
+        print(f"  {name:18s} mean {ms.mean():7.3f} ms  max {ms.max():7.3f} ms  "
+              f"mean position error {err.mean():.3f} m")
+    print(f"  correlative scored {np.mean(nodes):.0f} of {n_rot * n_xy * n_xy} candidates on average")
+
+
+def bench_ray_templates(scans=200, tmp_dir=None):
+    import tempfile
+    import mapping
+    world = SyntheticWorld()
+    robot = StandInRobot(world)
+    mapper = mapping.Mapping(robot)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as cache_dir:
+        build_ms, templates = time_call(lambda: mapping.RayTemplates(mapper, cache_dir), 1)
+        load_ms, templates = time_call(lambda: mapping.RayTemplates(mapper, cache_dir), 1)
+    print(f"ray templates, radius {templates.radius} cells, {templates.rows} rays")
+    print(f"  table {templates.nbytes / 1024:.0f} KiB, built in {build_ms:.1f} ms, loaded from cache in {load_ms:.1f} ms")
+
+    ranges = np.clip(np.array(robot.getDevice("LDS-01").getRangeImage(), dtype=np.float32),
+                     mapper.lidar_min, mapper.lidar_max)
+    robot_mx, robot_my = mapper.world_to_map(mapper.x, mapper.y)
+    ms, cells = time_call(lambda: mapper.cast_rays(ranges, robot_mx, robot_my), scans)
+    print(f"  cast_rays {ms:.3f} ms per scan ({len(cells[2])} beams, {len(cells[0])} free cells)")
+
+    def trace_all():
+        points = []
+        for i in range(0, mapper.lidar_res, mapper.BEAM_STEP):
+            r = float(ranges[i])
+            if r < mapper.NO_HIT_THRESH:
+                a = mapper.th + mapper.beam_angles[i]
+                points += mapper.trace_ray(robot_mx, robot_my, *mapper.world_to_map(r * math.cos(a), r * math.sin(a)))
+        return points
+    ms, _ = time_call(trace_all, max(1, scans // 10))
+    print(f"  trace_ray per beam {ms:.3f} ms per scan")
+
+
+def bench_replay(frames=1500, tmp_dir=None):
+    # Record a synthetic run to a sensor log, then replay it through a fresh Mapping
+    import os
+    import tempfile
+    import sensor_log
+    import sensors
+    world = SyntheticWorld()
+    robot = StandInRobot(world)
+    snapshot = sensors.SensorSnapshot(robot, robot.timestep, camera=False)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as log_dir:
+        path = os.path.join(log_dir, "synthetic.slog")
+        recorder = sensor_log.SensorLogRecorder(snapshot, path)
+        for i in range(frames):
+            if i % 60 < 50:
+                robot.drive(0.01, 0.0)
+            else:
+                robot.drive(0.0, math.pi / 20)
+            snapshot.read()
+            recorder.record(snapshot)
+        recorder.close()
+        print(f"sensor log, {frames} frames, {os.path.getsize(path) / 1024:.0f} KiB "
+              f"({sensor_log.SensorLogReader(path).dtype.itemsize} bytes per frame)")
+        mapper, update_ms = sensor_log.replay(path, chunk_frames=256)
+    sensor_log.report(update_ms, mapper.TIME_STEP)
+    true_x, true_y, _ = map_pose(world)
+    print(f"  final pose error {math.hypot(mapper.x - true_x, mapper.y - true_y):.3f} m")
+
+
+def bench_checkpoint(repeats=5, tmp_dir=None):
+    # Resume from a checkpoint of the mapped room, with the distance field, planner
+    # and frontier tracker attached as in main_controller: the saved distance
+    # field and frontier loaded back, against rebuilding them from the restored
+    # map as checkpoints without them are
+    import os
+    import tempfile
+    import checkpoint
+    import distance_field
+    import frontier
+    import mapping
+    import planner
+    import scheduler
+    from survivor_registry import SurvivorRegistry
+
+    class StandInNav:
+        goal = None
+
+        def __init__(self, grid_planner):
+            self.planner = grid_planner
+
+    class StandInDetector:
+        visiting = False
+
+        def __init__(self, explorer):
+            self.registry = SurvivorRegistry()
+            self.scheduler = scheduler.VisitScheduler()
+            self.explorer = explorer
+
+    def modules(robot, mapper=None):
+        mapper = mapping.Mapping(robot) if mapper is None else mapper
+        grid_planner = planner.GridPlanner(distance_field.DistanceField(mapper))
+        explorer = frontier.FrontierTracker(mapper, grid_planner.path_costs)
+        return mapper, StandInDetector(explorer), StandInNav(grid_planner)
+
+    world, robot, mapper = build_mapped_robot()
+    mapper, detector, nav = modules(robot, mapper)
+    state, arrays = checkpoint.capture(mapper, detector, nav, mapper.estimator)
+    older = {name: a for name, a in arrays.items() if not name.startswith(("distance_field.", "frontier."))}
+    print(f"checkpoint of the mapped room, {mapper.grid.tile_count} map tiles, {len(detector.explorer.cells)} frontier cells")
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as ckpt_dir:
+        for label, saved in (("distance field and frontier saved", arrays), ("rebuilt from the map", older)):
+            path = os.path.join(ckpt_dir, "controller.ckpt")
+            checkpoint.write(path, state, dict(saved))
+            timing = []
+            for _ in range(repeats):
+                fresh = modules(StandInRobot(SyntheticWorld()))
+                start = time.perf_counter()
+                checkpoint.restore(*checkpoint.read(path), fresh[0], *fresh[1:], fresh[0].estimator)
+                timing.append((time.perf_counter() - start) * 1000.0)
+            print(f"  {label:34s} read and restore {np.median(timing):6.2f} ms "
+                  f"({os.path.getsize(path) / 1024:.0f} KiB)")
+
+
+def bench_estimator(frames=2400, encoder_scale=(1.03, 0.98)):
+    # Square loops with encoders that misreport wheel travel; compares dead reckoning
+    # on the encoders alone with the fused estimate Mapping corrects by scan matching
+    import mapping
+    world = SyntheticWorld()
+    robot = StandInRobot(world)
+    robot.encoder_scale = encoder_scale
+    mapper = mapping.Mapping(robot)
+    estimator = mapper.estimator
+    enc = [0.0, 0.0, 0.0]
+    enc_err = []
+    fused_err = []
+    step_ms = []
+    for i in range(frames):
+        if i % 60 < 50:
+            robot.drive(0.01, 0.0)
+        else:
+            robot.drive(0.0, math.pi / 20)
+        start = time.perf_counter()
+        mapper.update()
+        step_ms.append((time.perf_counter() - start) * 1000.0)
+        d, dth = estimator.d, estimator.dth
+        enc[0] += d * math.cos(enc[2] + 0.5 * dth)
+        enc[1] += d * math.sin(enc[2] + 0.5 * dth)
+        enc[2] += dth
+        enc_err.append(math.hypot(enc[0] - world.x, enc[1] - world.y))
+        fused_err.append(math.hypot(estimator.x - world.x, estimator.y - world.y))
+
+    P = estimator.covariance()
+    print(f"pose estimate, {frames} steps, encoders over-reporting by {encoder_scale}")
+    print(f"  encoders only   mean error {np.mean(enc_err):.3f} m  final {enc_err[-1]:.3f} m")
+    print(f"  fused estimator mean error {np.mean(fused_err):.3f} m  final {fused_err[-1]:.3f} m  "
+          f"(reported sigma {math.sqrt(P[0, 0] + P[1, 1]):.3f} m, {math.degrees(math.sqrt(P[2, 2])):.2f} deg)")
+    print(f"  Mapping.update including the estimator mean {np.mean(step_ms):.3f} ms")
+
+
+def bench_sweep(size=16.0, legs=5, seed=0):
+    # Lawnmower sweep of a large room: update cost per step, scan matching every
+    # step, as the explored area grows
+    import mapping
+    rng = np.random.default_rng(seed)
+    h = size / 2.0
+    boxes = [(bx + rng.uniform(-0.5, 0.5), by + rng.uniform(-0.5, 0.5), rng.uniform(0.3, 0.8))
+             for bx in np.arange(-h + 2.0, h - 1.0, 2.5) for by in np.arange(-h + 2.0, h - 1.0, 2.5)]
+    spacing = (size - 3.0) / (legs - 1)
+    world = SyntheticWorld(size, boxes)
+    world.x, world.y, world.th = -h + 1.5, -h + 1.5, math.pi / 2
+    robot = StandInRobot(world)
+    robot.encoder_scale = (1.02, 0.99)
+    mapper = mapping.Mapping(robot)
+    mapper.SCAN_MATCH_INTERVAL = 1
+    # Start the estimate at the true pose so errors can be read in world coordinates
+    mapper.estimator.set_pose(world.x, world.y, world.th)
+
+    def step(d, dth, timing):
+        robot.drive(d, dth)
+        start = time.perf_counter()
+        mapper.update()
+        timing.append((time.perf_counter() - start) * 1000.0)
+
+    print(f"sweep, {size:.0f} m room in {legs} legs, scan match every step")
+    for leg in range(legs):
+        timing = []
+        for _ in range(int((size - 3.0) / 0.01)):
+            step(0.01, 0.0, timing)
+        turn = -1 if leg % 2 == 0 else 1
+        for _ in range(10):
+            step(0.0, turn * math.pi / 20, timing)
+        for _ in range(int(spacing / 0.01)):
+            step(0.01, 0.0, timing)
+        for _ in range(10):
+            step(0.0, turn * math.pi / 20, timing)
+        true_x, true_y, _ = map_pose(world)
+        print(f"  explored {mapper.known_cells / mapper.RESOLUTION ** 2:6.1f} m^2  "
+              f"update mean {np.mean(timing):6.3f} ms  p95 {np.percentile(timing, 95):6.3f} ms  "
+              f"position error {math.hypot(mapper.x - true_x, mapper.y - true_y):.3f} m")
+
+
+def bench_planner(rounds=12, seed=0):
+    # Drive across the mapped room along the planned path while small obstacles
+    # appear just ahead of the robot, as they would when the lidar first sees
+    # them: incremental repair against planning again from scratch
+    import distance_field
+    import planner
+    world, robot, mapper = build_mapped_robot()
+    rng = np.random.default_rng(seed)
+    start, goal = (-2.3, -2.3), (2.3, 2.3)
+    field = distance_field.DistanceField(mapper)
+    grid_planner = planner.GridPlanner(field)
+    ms, path = time_call(lambda: grid_planner.plan(start, goal), 1)
+    print(f"planner, 6 m room, initial plan {ms:.2f} ms, {grid_planner.expanded} cells expanded")
+
+    def along(p, path, distance):
+        # Point distance metres further along the waypoints from p
+        for w in path:
+            seg = math.hypot(w[0] - p[0], w[1] - p[1])
+            if seg >= distance:
+                return p[0] + (w[0] - p[0]) * distance / seg, p[1] + (w[1] - p[1]) * distance / seg
+            distance -= seg
+            p = w
+        return p
+
+    repair_ms, repair_cells, full_ms, full_cells, mismatched = [], [], [], [], 0
+    for _ in range(rounds):
+        if math.hypot(goal[0] - start[0], goal[1] - start[1]) < 1.0:
+            break
+        start = along(start, path, 0.3)
+        ox, oy = along(start, path, rng.uniform(0.6, 1.0))
+        mx, my = grid_planner.to_cell(ox, oy)
+        cx, cy = np.meshgrid(np.arange(mx - 1, mx + 2), np.arange(my - 1, my + 2), indexing="ij")
+        mapper.set_cells(cx.ravel(), cy.ravel(), np.full(9, 5.0, dtype=np.float32))
+        for listener in mapper.flip_listeners:
+            listener(mapper.flipped_cells)
+        mapper.flipped_cells = []
+
+        ms, path = time_call(lambda: grid_planner.plan(start, goal), 1)
+        repair_ms.append(ms)
+        repair_cells.append(grid_planner.expanded)
+        fresh = planner.GridPlanner(field)
+        ms, _ = time_call(lambda: fresh.plan(start, goal), 1)
+        full_ms.append(ms)
+        full_cells.append(fresh.expanded)
+        if grid_planner.g[grid_planner.start] != fresh.g[fresh.start]:
+            mismatched += 1
+        field.listeners.remove(fresh.on_distance_changed)
+
+    n = len(repair_ms)
+    print(f"  3x3 obstacle 0.6-1.0 m ahead of the robot every 0.3 m ({n} rounds):")
+    print(f"    incremental repair mean {np.mean(repair_ms):6.2f} ms  max {np.max(repair_ms):6.2f} ms  "
+          f"{np.mean(repair_cells):5.0f} cells expanded")
+    print(f"    full replan        mean {np.mean(full_ms):6.2f} ms  max {np.max(full_ms):6.2f} ms  "
+          f"{np.mean(full_cells):5.0f} cells expanded")
+    print(f"    path cost differs from the full replan in {mismatched} of {n} rounds")
+
+
+def bench_distance_field(queries=20000, seed=0):
+    # Distance field kept up to date while the room is mapped, against building
+    # it from scratch, and the cost of clearance queries
+    import distance_field
+    import mapping
+    world = SyntheticWorld()
+    robot = StandInRobot(world)
+    mapper = mapping.Mapping(robot)
+    field = distance_field.DistanceField(mapper)
+    update_ms = []
+    visited = []
+
+    def timed(listener):
+        def call(flipped_cells):
+            start = time.perf_counter()
+            listener(flipped_cells)
+            if flipped_cells:
+                update_ms.append((time.perf_counter() - start) * 1000.0)
+                visited.append(field.cells_visited)
+        return call
+    mapper.flip_listeners[mapper.flip_listeners.index(field.on_cells_flipped)] = timed(field.on_cells_flipped)
+    for _ in range(8):
+        for _ in range(50):
+            robot.drive(0.01, 0.0)
+            mapper.update()
+        for _ in range(10):
+            robot.drive(0.0, math.pi / 20)
+            mapper.update()
+
+    ms, rebuilt = time_call(lambda: distance_field.DistanceField(mapper), 1)
+    mismatched = int(np.count_nonzero(rebuilt.distance.window(*mapper.grid.bounds()) !=
+                                      field.distance.window(*mapper.grid.bounds())))
+    print(f"distance field, 6 m room mapped in {len(update_ms)} updates with flipped cells, "
+          f"max distance {field.max_distance} m")
+    print(f"  incremental update mean {np.mean(update_ms):6.2f} ms  p95 {np.percentile(update_ms, 95):6.2f} ms  "
+          f"{np.mean(visited):6.0f} cells visited")
+    print(f"  from scratch             {ms:6.2f} ms, {mismatched} cells differ from the incremental field")
+
+    rng = np.random.default_rng(seed)
+    xs = rng.uniform(-3.0, 3.0, queries)
+    ys = rng.uniform(-3.0, 3.0, queries)
+    start = time.perf_counter()
+    for i in range(1000):
+        field.clearance(xs[i], ys[i])
+    single_us = (time.perf_counter() - start) * 1000.0
+    ms, _ = time_call(lambda: field.clearance_batch(xs, ys), 20)
+    print(f"  clearance {single_us:.2f} us per call, clearance_batch {ms * 1e6 / queries:.0f} ns per point "
+          f"({queries} points)")
+
+
+def bench_frontier(seed=0):
+    # Frontier cells kept up to date while the room is mapped, against finding
+    # them by scanning every mapped cell, and the cost of picking a goal
+    import distance_field
+    import frontier
+    import mapping
+    import planner
+    from tiled_grid import pack_cells
+    world = SyntheticWorld()
+    robot = StandInRobot(world)
+    mapper = mapping.Mapping(robot)
+    tracker = frontier.FrontierTracker(mapper)
+    update_ms = []
+    checked = []
+
+    def timed(listener):
+        def call(changed_cells):
+            start = time.perf_counter()
+            listener(changed_cells)
+            if changed_cells:
+                update_ms.append((time.perf_counter() - start) * 1000.0)
+                checked.append(tracker.cells_checked)
+        return call
+
+    def rescan():
+        cx, cy = mapper.grid.find(lambda v: v < -mapper.KNOWN_THRESH)
+        frontier_cells = tracker.is_frontier(cx, cy)
+        return set(pack_cells(cx[frontier_cells], cy[frontier_cells]).tolist())
+
+    mapper.change_listeners[mapper.change_listeners.index(tracker.on_cells_changed)] = timed(tracker.on_cells_changed)
+    rescan_ms = []
+    for _ in range(8):
+        for _ in range(50):
+            robot.drive(0.01, 0.0)
+            mapper.update()
+        for _ in range(10):
+            robot.drive(0.0, math.pi / 20)
+            mapper.update()
+        ms, cells = time_call(rescan, 1)
+        rescan_ms.append(ms)
+    mismatched = len(cells ^ tracker.cells)
+
+    print(f"frontier, 6 m room mapped in {len(update_ms)} updates with changed cells, "
+          f"{len(tracker.cells)} frontier cells at the end")
+    print(f"  incremental update mean {np.mean(update_ms):6.3f} ms  p95 {np.percentile(update_ms, 95):6.3f} ms  "
+          f"{np.mean(checked):6.0f} cells checked")
+    print(f"  full rescan        mean {np.mean(rescan_ms):6.3f} ms, {mismatched} cells differ from the incremental set")
+
+    grid_planner = planner.GridPlanner(distance_field.DistanceField(mapper))
+    tracker.path_cost = grid_planner.path_costs
+    ms, clusters = time_call(tracker.cluster, 1)
+    goal_ms, goal = time_call(lambda: tracker.next_goal((mapper.estimator.x, mapper.estimator.y)), 1)
+    print(f"  clustering {ms:.2f} ms ({len(clusters)} clusters), goal selection {goal_ms:.2f} ms "
+          f"including path lengths, goal {goal}")
+
+
+def bench_dwa(poses=200, seed=0):
+    # Dynamic window planning from random poses in the room: time per plan and
+    # candidate arcs scored per millisecond
+    import navigation
+    import sensors
+    world = SyntheticWorld()
+    robot = StandInRobot(world)
+    snapshot = sensors.SensorSnapshot(robot, robot.timestep, camera=False)
+    dwa = navigation.DynamicWindow(snapshot, 6.28, robot.timestep)
+    rng = np.random.default_rng(seed)
+    plan_ms, candidates, admissible = [], [], []
+    for _ in range(poses):
+        world.x, world.y = rng.uniform(-2.5, 2.5, 2)
+        world.th = rng.uniform(-math.pi, math.pi)
+        snapshot.read()
+        target = rng.uniform(-2.0, 2.0, 2)
+        v_now = rng.uniform(0.0, dwa.v_max)
+        w_now = rng.uniform(-1.0, 1.0)
+        ms, _ = time_call(lambda: dwa.plan(target[0], target[1], v_now, w_now), 5)
+        plan_ms.append(ms)
+        candidates.append(dwa.candidates)
+        admissible.append(dwa.admissible)
+    plan_ms = np.array(plan_ms)
+    print(f"dynamic window, {poses} poses in the 6 m room, {dwa.rollout_steps}-step arcs over {dwa.horizon} s")
+    print(f"  plan mean {plan_ms.mean():.3f} ms  p95 {np.percentile(plan_ms, 95):.3f} ms  "
+          f"({plan_ms.mean() / robot.timestep * 100:.1f}% of a {robot.timestep} ms timestep)")
+    print(f"  {np.mean(candidates):.0f} candidates per plan ({np.mean(admissible):.0f} collision-free), "
+          f"{np.sum(candidates) / plan_ms.sum():.0f} candidates per ms")
+
+
+def bench_scheduler(survivors=10, trials=5, seed=0):
+    # Visiting order of survivors scattered over the mapped room: nearest first
+    # (the old behaviour) against 2-opt/Or-opt, and survivors revealed a few at a
+    # time inserted incrementally against solving again from scratch
+    import distance_field
+    import planner
+    import scheduler
+    world, robot, mapper = build_mapped_robot()
+    rng = np.random.default_rng(seed)
+    field = distance_field.DistanceField(mapper)
+    grid_planner = planner.GridPlanner(field)
+    start = (0.0, 0.0)
+
+    greedy_m, tour_m, solve_ms, inc_m, inc_ms, scratch_m, scratch_ms, cost_ms = [], [], [], [], [], [], [], []
+    for _ in range(trials):
+        points = []
+        while len(points) < survivors:
+            p = tuple(rng.uniform(-2.6, 2.6, 2))
+            if field.clearance(*p) > 0.3 and all(math.hypot(p[0] - q[0], p[1] - q[1]) > 0.5 for q in points):
+                points.append(p)
+
+        # Nearest survivor first, by path length, from wherever the robot is
+        sched = scheduler.VisitScheduler(grid_planner.path_costs)
+        sched.set_robot(start)
+        ms, _ = time_call(lambda: sched.add(points), 1)
+        cost_ms.append(ms)
+        order = []
+        left = set(range(len(points)))
+        at = sched.robot_cost
+        while left:
+            nxt = min(left, key=lambda k: at[k])
+            order.append(nxt)
+            left.remove(nxt)
+            at = sched.cost[nxt]
+        greedy_m.append(sched.tour_cost(order))
+        ms, _ = time_call(sched.solve, 1)
+        solve_ms.append(ms)
+        tour_m.append(sched.tour_cost())
+
+        # Two survivors at a time: incremental insertion against a fresh solve,
+        # both from the costs already computed so only the ordering is timed
+        index = {p: k for k, p in enumerate(sched.points)}
+        index[start] = -1
+
+        def known_costs(source, targets):
+            row = sched.robot_cost if index[source] < 0 else sched.cost[index[source]]
+            return [row[index[t]] if index[t] >= 0 else sched.robot_cost[index[source]] for t in targets]
+
+        inc = scheduler.VisitScheduler(known_costs)
+        inc.set_robot(start)
+        total_inc = total_scratch = 0.0
+        for k in range(0, survivors, 2):
+            start_t = time.perf_counter()
+            inc.add(sched.points[k:k + 2])
+            total_inc += time.perf_counter() - start_t
+            fresh = scheduler.VisitScheduler()
+            fresh.points = list(inc.points)
+            fresh.cost = inc.cost.copy()
+            fresh.robot_cost = inc.robot_cost.copy()
+            ms, _ = time_call(fresh.solve, 1)
+            total_scratch += ms / 1000.0
+        inc_m.append(inc.tour_cost())
+        inc_ms.append(total_inc * 1000.0)
+        scratch_m.append(fresh.tour_cost())
+        scratch_ms.append(total_scratch * 1000.0)
+
+    print(f"scheduler, {survivors} survivors in the 6 m room, {trials} trials (path lengths through the map):")
+    print(f"  cost matrix {np.mean(cost_ms):7.2f} ms ({survivors} path searches)")
+    print(f"  nearest first      tour {np.mean(greedy_m):6.2f} m")
+    print(f"  2-opt/Or-opt       tour {np.mean(tour_m):6.2f} m  ({np.mean(solve_ms):.2f} ms)")
+    print(f"  revealed two at a time:")
+    print(f"    incremental      tour {np.mean(inc_m):6.2f} m  ({np.mean(inc_ms):.2f} ms in total)")
+    print(f"    solved each time tour {np.mean(scratch_m):6.2f} m  ({np.mean(scratch_ms):.2f} ms in total)")
+
+
+def bench_telemetry(records=20000, tmp_dir=None):
+    # Cost of one log call on the control loop: the per-step pose line as a
+    # synchronous print against a telemetry record, accepted and rate-limited
+    import contextlib
+    import os
+    import tempfile
+    import telemetry
+    x, y, theta = 1.234567, -0.5, 0.25
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as log_dir:
+        # A line-buffered file stands in for the console pipe: one write per print
+        with open(os.path.join(log_dir, "console.txt"), "w", buffering=1) as console:
+            with contextlib.redirect_stdout(console):
+                ms, _ = time_call(lambda: [print(f"[GO_TO_GOAL] x={x:.3f}, y={y:.3f}, theta={theta:.3f}")
+                                           for _ in range(records)], 1)
+        print_us = ms * 1000.0 / records
+
+        path = os.path.join(log_dir, "telemetry.ndjson")
+        logger = telemetry.TelemetryLogger(capacity=4096, flush_interval=0.01,
+                                           rate_limits={"nav.limited": 2.0})
+        logger.start(path)
+        elapsed = 0.0
+        for _ in range(records // 1000):
+            start = time.perf_counter()
+            for _ in range(1000):
+                logger.log(telemetry.DEBUG, "nav.pose", "GO_TO_GOAL", {"x": x, "y": y, "theta": theta})
+            elapsed += time.perf_counter() - start
+            time.sleep(0.02)          # The simulator step, during which the writer catches up
+        record_us = elapsed * 1e6 / records
+        start = time.perf_counter()
+        for _ in range(records):
+            logger.log(telemetry.DEBUG, "nav.limited", "GO_TO_GOAL", {"x": x, "y": y, "theta": theta})
+        limited_us = (time.perf_counter() - start) * 1e6 / records
+        logger.stop()
+        size = os.path.getsize(path)
+    print(f"telemetry, {records} pose records:")
+    print(f"  print, line-buffered {print_us:6.2f} us per call")
+    print(f"  telemetry record     {record_us:6.2f} us per call, {logger.written} written "
+          f"({size / 1024:.0f} KiB NDJSON), {logger.lost} lost to a full ring")
+    print(f"  rate-limited record  {limited_us:6.2f} us per call")
+
+
+def bench_segmentation(frames=60, repeats=5):
+    # Warm-colour masks per second: the previous BGRA->BGR->HSV + inRange
+    # pipeline against the lookup-table segmenter, full frame, ROI and stride
+    import cv2
+    import segmentation
+    width, height = 640, 480
+    images = synthetic_frames(frames, width, height)
+
+    def hsv_mask(image):
+        arr = np.frombuffer(image, np.uint8).reshape((height, width, 4))
+        hsv = cv2.cvtColor(cv2.cvtColor(arr, cv2.COLOR_BGRA2BGR), cv2.COLOR_BGR2HSV)
+        return (cv2.inRange(hsv, np.array([0, 160, 120]), np.array([20, 255, 255]))
+                | cv2.inRange(hsv, np.array([170, 120, 70]), np.array([180, 255, 255])))
+
+    def fps(segment):
+        segment(images[0])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for image in images:
+                segment(image)
+        return repeats * len(images) / (time.perf_counter() - start)
+
+    reference = [hsv_mask(image) for image in images]
+    print(f"segmentation, {frames} synthetic {width}x{height} frames, "
+          f"{np.mean([np.count_nonzero(m) for m in reference]) / (width * height):.1%} warm pixels on average")
+    print(f"  HSV + inRange              {fps(hsv_mask):7.0f} fps")
+    for roi, stride, label in ((None, 1, "full frame"), ((0, height // 4, width, height), 1, "lower 3/4"),
+                               (None, 2, "stride 2")):
+        segmenter = segmentation.WarmSegmenter(width, height, roi=roi, stride=stride)
+        rate = fps(segmenter.segment)
+        x0, y0, x1, y1 = segmenter.roi
+        differ = np.mean([np.count_nonzero(segmenter.segment(image) != ref[y0:y1:stride, x0:x1:stride]) /
+                          segmenter.mask.size for image, ref in zip(images, reference)])
+        print(f"  LUT {label:<11}            {rate:7.0f} fps  {differ:.3%} of pixels differ")
+    start = time.perf_counter()
+    segmentation.build_warm_table()
+    print(f"  table {segmenter.table.nbytes / 1024 / 1024:.0f} MiB, built in {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"(cached next to segmentation.py)")
+
+
+def read_frame_ring(name, seconds, delay):
+    # Slow viewer stand-in for bench_debug_viewer, run as its own process like
+    # the real viewer: reads the newest frame every delay seconds and checks
+    # the mask and box against the frame they came with
+    import debug_viewer
+    ring = debug_viewer.FrameRing(name=name)
+    seq = -1
+    shown = inconsistent = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        latest = ring.latest(seq)
+        if latest is not None:
+            seq, frame, mask, boxes = latest
+            shown += 1
+            inconsistent += int(mask[0, 0] != frame[0, 0, 0] or boxes[0, 0] != frame[0, 0, 0])
+        time.sleep(delay)
+    ring.close()
+    print(shown, inconsistent)
+
+
+def bench_debug_viewer(frames=300, width=640, height=480):
+    # Frames published into the viewer's shared-memory ring at the control
+    # loop's pace while a slow reader process shows one every 100 ms
+    import os
+    import subprocess
+    import debug_viewer
+    ring = debug_viewer.FrameRing(width, height)
+    reader = subprocess.Popen([sys.executable, "-c",
+                               f"import benchmarks; benchmarks.read_frame_ring({ring.name!r}, {frames * 0.032 + 0.5}, 0.1)"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, text=True)
+    time.sleep(0.3)
+    publish_ms = []
+    for i in range(frames):
+        # Frame, mask and box all carry the frame number so torn reads show up
+        image = np.full((height, width, 4), i % 256, dtype=np.uint8).tobytes()
+        mask = np.full((height // 2, width // 2), i % 256, dtype=np.uint8)
+        start = time.perf_counter()
+        ring.publish(image, mask, [(i % 256, 0, 10, 10)])
+        publish_ms.append((time.perf_counter() - start) * 1000.0)
+        time.sleep(0.032)
+    shown, inconsistent = (int(v) for v in reader.communicate()[0].split())
+    ring.close()
+    print(f"debug viewer ring, {frames} {width}x{height} frames at 32 ms, reader every 100 ms:")
+    print(f"  publish mean {np.mean(publish_ms):.3f} ms  max {np.max(publish_ms):.3f} ms")
+    print(f"  reader showed {shown} frames, {frames - shown} dropped, {inconsistent} torn")
+
+
+def bench_tracker(targets=(4, 12, 36), scans=5, seed=0):
+    # One 360 degree camera scan over survivors at random bearings, some close
+    # together, with missed detections and clutter: the previous 60-pixel
+    # nearest-x matching against the gated Hungarian tracker. Survivors count
+    # as found when they pair one-to-one with a report within 0.05 rad
+    import tracker
+    width, h_fov, rate, dt = 640, 1.047, 0.5, 0.032
+    pixel_angle = h_fov / width
+    rng = np.random.default_rng(seed)
+
+    def frames(bearings):
+        # Left-positive offsets of the detections in view, per frame
+        for step in range(int(2 * math.pi / rate / dt) + 1):
+            camera = (step * rate * dt + math.pi) % (2 * math.pi) - math.pi
+            off = (bearings - camera + math.pi) % (2 * math.pi) - math.pi
+            seen = (np.abs(off) < 0.5 * h_fov - 0.03) & (rng.random(len(bearings)) < 0.9)
+            offsets = off[seen] + rng.normal(0.0, 2 * pixel_angle, int(seen.sum()))
+            if rng.random() < 0.1:
+                offsets = np.append(offsets, rng.uniform(-0.5, 0.5) * h_fov)
+            yield step * dt, camera, offsets, np.full(len(offsets), 1.5)
+
+    def previous(bearings):
+        humans, reports = [], []
+        for _, camera, offsets, distances in frames(bearings):
+            for off in offsets:
+                cx = width / 2 - off / pixel_angle
+                matched = None
+                for human in humans:
+                    if abs(cx - human["last_x"]) < 60:
+                        matched = human
+                if matched is None:
+                    matched = {"last_x": cx, "samples": [], "saved": False}
+                    humans.append(matched)
+                matched["last_x"] = cx
+                if not matched["saved"] and abs(cx - width / 2) <= 40:
+                    matched["samples"].append(camera + off)
+                    if len(matched["samples"]) >= 6:
+                        reports.append(math.atan2(np.sin(matched["samples"]).sum(), np.cos(matched["samples"]).sum()))
+                        matched["saved"] = True
+        return reports
+
+    def gated(bearings, timing):
+        track = tracker.BearingTracker(h_fov, width)
+        reports = []
+        for t, camera, offsets, distances in frames(bearings):
+            start = time.perf_counter()
+            reports += [angle for angle, _ in track.update(t, camera, offsets, distances)]
+            timing.append((time.perf_counter() - start) * 1000.0)
+        return reports
+
+    def score(bearings, reports):
+        # Survivors paired one-to-one with a report within 0.05 rad
+        reports = np.array(reports)
+        error = np.abs((reports[None, :] - bearings[:, None] + math.pi) % (2 * math.pi) - math.pi)
+        return len(tracker.assign(error.reshape(len(bearings), len(reports)), 0.05)[0]), len(reports)
+
+    print(f"tracker, one 360 degree scan at {rate} rad/s, 90% detection, clutter in 10% of frames, {scans} scans each:")
+    for n in targets:
+        results = {"previous": [0, 0], "tracker": [0, 0]}
+        timing = []
+        for _ in range(scans):
+            bearings = rng.uniform(-math.pi, math.pi, n)
+            bearings[: n // 4] = bearings[n // 4: 2 * (n // 4)] + rng.uniform(0.1, 0.2, n // 4)
+            for name, reports in (("previous", previous(bearings)), ("tracker", gated(bearings, timing))):
+                found, reported = score(bearings, reports)
+                results[name][0] += found
+                results[name][1] += reported
+        total = n * scans
+        print(f"  {n:3d} survivors: previous found {results['previous'][0]:4d}/{total} ({results['previous'][1]} reports), "
+              f"tracker found {results['tracker'][0]:4d}/{total} ({results['tracker'][1]} reports), "
+              f"{np.mean(timing):.3f} ms per frame")
+
+
+def bench_camera_schedule(drive_seconds=20.0, frames=30, repeats=5):
+    # Frame processing per simulated second over a scan, a drive to a survivor
+    # and an exploration leg: the camera at every step, as before, against the
+    # camera schedule. The CPU figures vary a lot from run to run, so both are
+    # run repeats times, interleaved, and the medians and the range of the
+    # saving are shown; the frame counts are the same in every run
+    import detection
+    import sensors
+
+    class StandInNav:
+        x = y = theta = 0.0
+        goalreached = False
+
+        def pause(self):
+            pass
+
+        def resume(self):
+            pass
+
+        def reset(self, new_goal=None):
+            pass
+
+    def run(scheduled):
+        world = SyntheticWorld()
+        robot = StandInRobot(world)
+        camera = StandInCamera(synthetic_frames(frames))
+        motor = StandInCameraMotor()
+        robot.devices.update({"rgb_camera": camera, "camera_motor": motor})
+        snapshot = sensors.SensorSnapshot(robot, robot.timestep)
+        detector = detection.Detection(robot, snapshot, threaded=False)
+        detector.nav = StandInNav()
+        if not scheduled:
+            # Every step at the base timestep, whatever the detector is doing
+            schedule = detector.camera_schedule
+            schedule.idle_period = robot.timestep
+            schedule.set_mode = lambda mode, camera_speed=0.0: type(schedule).set_mode(schedule, "idle")
+        phases = {}
+        for phase, steps in (("scan", None), ("drive to survivor", drive_seconds), ("explore", drive_seconds)):
+            busy, reads, t0 = detector.camera_schedule.busy_ms, camera.reads, robot.time
+            if phase == "scan":
+                detector.reset_scan()
+            else:
+                detector.visiting = phase == "drive to survivor"
+            n = 0
+            while (steps is None and not detector.scan_done) or (steps is not None and n * robot.timestep < steps * 1000):
+                robot.time += robot.timestep / 1000.0
+                motor.step(robot.timestep / 1000.0)
+                snapshot.read()
+                detector.detect()
+                n += 1
+            seconds = robot.time - t0
+            phases[phase] = ((detector.camera_schedule.busy_ms - busy) / seconds, camera.reads - reads, seconds)
+        return phases, detector.camera_schedule.cpu_per_second(), len(detector.detected_angles)
+
+    runs = [(run(False), run(True)) for _ in range(repeats)]
+    before, after = runs[0][0][0], runs[0][1][0]
+    saved = [1 - a[1] / b[1] for b, a in runs]
+
+    def median(i, phase=None):
+        return np.median([r[i][1] if phase is None else r[i][0][phase][0] for r in runs])
+
+    print(f"camera schedule, frame processing in ms of CPU per simulated second ({frames} synthetic frames), "
+          f"median of {repeats} runs:")
+    for phase in before:
+        print(f"  {phase:<18} ({after[phase][2]:4.1f} s)  every step {median(0, phase):6.1f} ms/s ({before[phase][1]:4d} frames)"
+              f"  scheduled {median(1, phase):6.1f} ms/s ({after[phase][1]:4d} frames)")
+    frames_before = sum(p[1] for p in before.values())
+    frames_after = sum(p[1] for p in after.values())
+    print(f"  whole run          every step {median(0):6.1f} ms/s  scheduled {median(1):6.1f} ms/s  "
+          f"({np.median(saved):.0%} saved, {min(saved):.0%}-{max(saved):.0%} over the runs; "
+          f"{1 - frames_after / frames_before:.0%} fewer frames)")
+
+
+def bench_detection_worker(survivors=(-2.5, -1.2, 0.3, 1.4, 2.6), distance=1.5, step_wait=0.010, slow_ms=15.0):
+    # One 360 degree scan with the robot paused and survivors at known
+    # bearings: frame analysis inline in detect(), as before, against the
+    # worker thread, and the worker slowed down so that it falls behind.
+    # robot.step is stood in for by a sleep, the time Webots takes to simulate
+    # a step while the controller waits
+    import detection
+    import sensors
+
+    class StandInNav:
+        x = y = theta = 0.0
+        goalreached = False
+
+        def pause(self):
+            pass
+
+        def resume(self):
+            pass
+
+        def reset(self, new_goal=None):
+            pass
+
+    class ScanCamera(StandInCamera):
+        # Renders the survivors where they would appear at the camera's current angle
+        def render(self, camera_angle, pitch=0.15, rise=0.26):
+            image = np.empty((self.height, self.width, 4), dtype=np.uint8)
+            image[:] = (110, 120, 130, 255)
+            pixel = self.fov / self.width
+            v_pixel = 2.0 * math.atan(math.tan(self.fov / 2) * self.height / self.width) / self.height
+            cy = int(self.height / 2 + (math.atan(rise / distance) - pitch) / v_pixel)
+            for bearing in survivors:
+                offset = (bearing - camera_angle + math.pi) % (2 * math.pi) - math.pi
+                cx = int(self.width / 2 - offset / pixel)
+                if -20 <= cx < self.width + 20:
+                    image[max(cy - 25, 0):cy + 25, max(cx - 15, 0):max(cx + 15, 0), :3] = (30, 30, 220)
+            self.frames = [image.tobytes()]
+            self.reads = -1
+
+    def run(threaded, slow=0.0):
+        world = SyntheticWorld()
+        robot = StandInRobot(world)
+        camera = ScanCamera([None])
+        motor = StandInCameraMotor()
+        robot.devices.update({"rgb_camera": camera, "camera_motor": motor})
+        snapshot = sensors.SensorSnapshot(robot, robot.timestep)
+        detector = detection.Detection(robot, snapshot, threaded=threaded)
+        detector.nav = StandInNav()
+        if slow:
+            analyse = detector.worker.analyse
+            detector.worker.analyse = lambda image: (time.sleep(slow / 1000.0), analyse(image))[1]
+        latency = []
+        while not detector.scan_done:
+            time.sleep(step_wait)
+            robot.time += robot.timestep / 1000.0
+            motor.step(robot.timestep / 1000.0)
+            snapshot.read()
+            camera.render(snapshot.camera_angle)
+            start = time.perf_counter()
+            detector.detect()
+            latency.append((time.perf_counter() - start) * 1000.0)
+        detector.worker.close()
+        found = np.array(detector.detected_angles)
+        truth = np.array(survivors)
+        error = np.abs((found[None, :] - truth[:, None] + math.pi) % (2 * math.pi) - math.pi).reshape(len(truth), len(found))
+        worst = error.min(axis=1).max() if len(found) else float("nan")
+        return latency, detector.worker, len(found), worst
+
+    print(f"detection worker, one 360 degree scan, {len(survivors)} survivors, {step_wait * 1000:.0f} ms robot.step stand-in:")
+    for label, threaded, slow in (("inline", False, 0.0), ("worker thread", True, 0.0),
+                                  (f"worker + {slow_ms:.0f} ms", True, slow_ms)):
+        latency, worker, found, worst = run(threaded, slow)
+        print(f"  {label:<16} detect() mean {np.mean(latency):6.3f} ms  p99 {np.percentile(latency, 99):6.3f} ms  "
+              f"max {np.max(latency):6.3f} ms  analysed {worker.analysed:3d}/{worker.submitted:3d} "
+              f"dropped {worker.dropped:3d}  found {found}/{len(survivors)}, worst bearing error {worst:.4f} rad")
+
+
+def bench_survivor_registry(known=(10, 100, 1000), sightings=200, updates=1000, rescans=3, seed=0):
+    # Sightings checked against the known survivors: the previous linear 0.5 m
+    # loop against the registry's grid hash, and one map update's survivor
+    # markers: the previous rescan of every coordinate against every marker
+    # (0.3 m) against reading the registry's change feed. The registry also
+    # merges sightings with each other, so it keeps fewer of them as new
+    import survivor_registry
+    rng = np.random.default_rng(seed)
+    print(f"survivor registry, {sightings} sightings per scan, survivors spread over 20 m x 20 m:")
+    for n in known:
+        points = [tuple(p) for p in rng.uniform(-10.0, 10.0, (n, 2))]
+        seen = [tuple(p) for p in rng.uniform(-10.0, 10.0, (sightings, 2))]
+
+        start = time.perf_counter()
+        kept = [p for p in seen if not any(math.hypot(p[0] - q[0], p[1] - q[1]) < 0.5 for q in points)]
+        linear_ms = (time.perf_counter() - start) * 1000.0
+
+        registry = survivor_registry.SurvivorRegistry()
+        for x, y in points:
+            registry.observe(x, y)
+        before = len(registry)
+        start = time.perf_counter()
+        for x, y in seen:
+            registry.observe(x, y)
+        grid_ms = (time.perf_counter() - start) * 1000.0
+
+        # Markers already hold every survivor, as after the first update. The
+        # previous code compared against the mirrored markers, so its list grew
+        # on every update; compared unmirrored here, as was intended
+        markers = list(points)
+        start = time.perf_counter()
+        for _ in range(rescans):
+            for x, z in points:
+                if not any(math.hypot(x - sx, z - sz) < 0.3 for sx, sz in markers):
+                    markers.append((x, z))
+        rescan_ms = (time.perf_counter() - start) * 1000.0 / rescans
+
+        cursor = registry.changes(None)[0]
+        start = time.perf_counter()
+        for _ in range(updates):
+            cursor, changes = registry.changes(cursor)
+        feed_ms = (time.perf_counter() - start) * 1000.0 / updates
+
+        print(f"  {n:5d} known: dedup linear {linear_ms:8.3f} ms ({len(kept)} new)  grid hash {grid_ms:6.3f} ms "
+              f"({len(registry) - before} new)   map update rescan {rescan_ms:8.3f} ms  change feed {feed_ms:.4f} ms")
+
+
+BENCHMARKS = {
+    "scan_match": bench_scan_match,
+    "ray_templates": bench_ray_templates,
+    "replay": bench_replay,
+    "checkpoint": bench_checkpoint,
+    "estimator": bench_estimator,
+    "sweep": bench_sweep,
+    "planner": bench_planner,
+    "distance_field": bench_distance_field,
+    "dwa": bench_dwa,
+    "scheduler": bench_scheduler,
+    "frontier": bench_frontier,
+    "telemetry": bench_telemetry,
+    "segmentation": bench_segmentation,
+    "debug_viewer": bench_debug_viewer,
+    "tracker": bench_tracker,
+    "camera_schedule": bench_camera_schedule,
+    "detection_worker": bench_detection_worker,
+    "survivor_registry": bench_survivor_registry,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,82 @@
+# camera_schedule.py
+# Camera sampling period chosen by what Detection is doing
+#
+# During a scan a survivor has to be seen `samples` times while it is within
+# centre_pixels of the image centre. At a camera motor speed of w rad/s it
+# crosses that band in 2 * centre_pixels * (h_fov / width) / w seconds, so the
+# longest period still giving samples + spare frames in the band is that time
+# divided by samples + spare, rounded down to whole timesteps (Webots samples
+# sensors in whole steps). Outside scans frames only serve the "close to the
+# survivor" coverage check while driving, and a slow idle period is enough;
+# "off" disables the camera altogether.
+#
+# frame_due() tells Detection whether a new frame has arrived this step, so
+# steps between frames do no image work. busy() collects the time Detection
+# spends on frames for the CPU-per-simulated-second figure.
+
+import math
+
+
+class CameraSchedule:
+    def __init__(self, camera, timestep, h_fov, image_width, centre_pixels=40, samples=6, spare=1,
+                 idle_period=256):
+        self.camera = camera
+        self.timestep = timestep                        # ms
+        self.centre_band = 2 * centre_pixels * h_fov / image_width
+        self.samples = samples
+        self.spare = spare                              # Extra frames in the band beyond samples
+        self.idle_period = idle_period                  # ms, between scans
+
+        self.mode = None
+        self.period = None                              # ms, None while disabled
+        self.last_frame = None                          # Simulated time of the last frame, ms
+
+        # Totals for the CPU report
+        self.frames = 0
+        self.busy_ms = 0.0
+        self.start_time = None
+        self.sim_time = 0.0
+
+    def scan_period(self, camera_speed):
+        # Longest whole-timestep period that keeps samples + spare frames in the centre band
+        if camera_speed == 0:
+            return self.idle_period
+        crossing = self.centre_band / abs(camera_speed) * 1000.0
+        steps = math.floor(crossing / (self.samples + self.spare) / self.timestep)
+        return max(1, steps) * self.timestep
+
+    def set_mode(self, mode, camera_speed=0.0):
+        # "scan", "idle" or "off"; the camera is only touched when its period changes
+        period = {"scan": lambda: self.scan_period(camera_speed),
+                  "idle": lambda: self.idle_period,
+                  "off": lambda: None}[mode]()
+        self.mode = mode
+        if period == self.period:
+            return
+        if period is None:
+            self.camera.disable()
+        else:
+            self.camera.enable(period)
+        self.period = period
+        self.last_frame = None
+
+    def frame_due(self, time_s):
+        # True on the steps where the camera has a new frame
+        now = time_s * 1000.0
+        if self.start_time is None:
+            self.start_time = now
+        self.sim_time = now - self.start_time
+        if self.period is None:
+            return False
+        if self.last_frame is not None and now - self.last_frame < self.period - 0.5 * self.timestep:
+            return False
+        self.last_frame = now
+        self.frames += 1
+        return True
+
+    def busy(self, ms):
+        self.busy_ms += ms
+
+    def cpu_per_second(self):
+        # Milliseconds of frame processing per simulated second so far
+        return self.busy_ms / max(self.sim_time / 1000.0, 1e-9)
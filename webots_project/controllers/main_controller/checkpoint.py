@@ -0,0 +1,221 @@
+# checkpoint.py
+# Snapshots of the controller state (map layers, distance field, frontier, poses,
+# survivors, goals) for fast warm starts
+#
+# File layout: 8-byte magic, 8-byte little-endian header length, JSON header,
+# then every array as raw bytes at a 64-byte aligned offset listed in the
+# header, so the map layers can be np.memmap-ed back without copying.
+
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+import telemetry
+from tiled_grid import TiledGrid
+
+MAGIC = b"G47CKPT2"
+ALIGN = 64
+
+# TiledGrid layers saved from Mapping, by attribute path
+MAP_LAYERS = ["grid", "occ_hits", "prob", "likelihood.dist", "likelihood.field"]
+# TiledGrid layers saved from the planner's distance field, so a restore does
+# not run the brushfire over the whole map again
+FIELD_LAYERS = ["distance", "nearest_x", "nearest_y", "occupied"]
+
+
+def get_layer(mapping, name):
+    owner = mapping
+    for part in name.split(".")[:-1]:
+        owner = getattr(owner, part)
+    return owner, name.split(".")[-1]
+
+
+def saved_layers(mapping, nav):
+    # (name, owner, attribute) of every TiledGrid layer in a checkpoint
+    layers = [(name,) + get_layer(mapping, name) for name in MAP_LAYERS]
+    field = getattr(nav.planner, "field", None)
+    if field is not None:
+        layers += [("distance_field." + name, field, name) for name in FIELD_LAYERS]
+    return layers
+
+
+def capture(mapping, detector, nav, estimator, sim_time=0.0):
+    # Copy everything a checkpoint needs; cheap enough to run inside the control loop
+    arrays = {}
+    defaults = {}
+    for name, owner, attr in saved_layers(mapping, nav):
+        layer = getattr(owner, attr)
+        arrays[name + ".pool"], arrays[name + ".tiles"] = layer.snapshot()
+        defaults[name] = layer.default.item() if hasattr(layer.default, "item") else layer.default
+    candidates = mapping.decay_candidates
+    arrays["decay_candidates"] = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+    if detector.explorer is not None:
+        cells = detector.explorer.cells
+        arrays["frontier.cells"] = np.fromiter(cells, dtype=np.int64, count=len(cells))
+
+    state = {
+        "sim_time": sim_time,
+        "wall_time": time.time(),
+        "layer_defaults": defaults,
+        "estimator": {
+            "pose": list(estimator.pose()),
+            "covariance": estimator.covariance().tolist(),
+            "stuck_counter": estimator.stuck_counter,
+        },
+        "mapping": {
+            "known_cells": mapping.known_cells,
+            "scan_match_counter": mapping.scan_match_counter,
+        },
+        "detection": {
+            "survivors": detector.registry.state(),
+            "pending": [list(c) for c in detector.scheduler.positions()],
+            "frontier_goals": [list(c) for c in detector.explorer.goals] if detector.explorer is not None else [],
+            "visiting": detector.visiting,
+        },
+        "navigation": {
+            "goal": list(nav.goal) if nav.goal is not None else None,
+        },
+    }
+    return state, arrays
+
+
+def write(path, state, arrays):
+    # Write to a temporary file and swap it in, so a crash never leaves a torn checkpoint
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        entries[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({"state": state, "arrays": entries}).encode("utf-8")
+    data_start = -(-(16 + len(header)) // ALIGN) * ALIGN
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]["offset"])
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read(path):
+    # Returns (state, arrays); arrays are copy-on-write memmaps of the file
+    with open(path, "rb") as f:
+        if f.read(8) != MAGIC:
+            raise ValueError("not a controller checkpoint: " + path)
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    data_start = -(-(16 + header_len) // ALIGN) * ALIGN
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        shape = tuple(entry["shape"])
+        if 0 in shape:
+            arrays[name] = np.zeros(shape, dtype=entry["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=entry["dtype"], mode="c",
+                                     offset=data_start + entry["offset"], shape=shape)
+    return header["state"], arrays
+
+
+def restore(state, arrays, mapping, detector, nav, estimator):
+    # Load a checkpoint returned by read() into freshly constructed modules
+    loaded = set()
+    for name, owner, attr in saved_layers(mapping, nav):
+        if name + ".pool" in arrays:
+            setattr(owner, attr, TiledGrid.from_arrays(arrays[name + ".pool"], arrays[name + ".tiles"],
+                                                       state["layer_defaults"][name]))
+            loaded.add(name)
+    mapping.map_data = mapping.grid
+    mapping.decay_candidates = [np.asarray(arrays["decay_candidates"])]
+    mapping.flipped_cells = []
+    mapping.changed_cells = []
+    mapping.known_cells = state["mapping"]["known_cells"]
+    mapping.scan_match_counter = state["mapping"]["scan_match_counter"]
+    mapping.renderer.dirty[:] = True
+    # The distance field and the frontier come back as saved. Other listeners,
+    # and those two for checkpoints without them, are given every restored
+    # obstacle and known cell instead, which takes far longer on a large map
+    skip = []
+    field = getattr(nav.planner, "field", None)
+    if field is not None and all("distance_field." + name in loaded for name in FIELD_LAYERS):
+        skip.append(field.on_cells_flipped)
+    if detector.explorer is not None and "frontier.cells" in arrays:
+        detector.explorer.cells = set(np.asarray(arrays["frontier.cells"]).tolist())
+        detector.explorer.dirty = True
+        skip.append(detector.explorer.on_cells_changed)
+    flip_listeners = [listener for listener in mapping.flip_listeners if listener not in skip]
+    if flip_listeners:
+        restored = [mapping.grid.find(lambda v: v > mapping.OCC_THRESH)]
+        for listener in flip_listeners:
+            listener(restored)
+    change_listeners = [listener for listener in mapping.change_listeners if listener not in skip]
+    if change_listeners:
+        known = [mapping.grid.find(lambda v: np.abs(v) > mapping.KNOWN_THRESH)]
+        for listener in change_listeners:
+            listener(known)
+
+    # Mapping and Communication replay the restored survivors from the registry's
+    # feed; the visiting order is restored as it was instead
+    detector.registry.load(state["detection"].get("survivors", []))
+    detector.registry_cursor = detector.registry.cursor()
+    detector.scheduler.clear()
+    detector.scheduler.add(state["detection"].get("pending", []))
+    if detector.explorer is not None:
+        detector.explorer.goals = [tuple(c) for c in state["detection"].get("frontier_goals", [])]
+
+    # Odometry continues from the encoders' current readings, not from zero
+    estimator.set_pose(*state["estimator"]["pose"], covariance=state["estimator"]["covariance"])
+    estimator.stuck_counter = state["estimator"]["stuck_counter"]
+    estimator.prev_ranges = None
+    mapping.x, mapping.y, mapping.th = estimator.map_pose()
+    if state["navigation"]["goal"] is not None:
+        nav.goal = tuple(state["navigation"]["goal"])
+        nav.compute_m_line()
+    # Whether the goal is a human or a frontier is saved as it was: later sightings
+    # move a survivor away from the goal it was visited at
+    visiting = state["detection"].get("visiting")
+    if visiting is None:
+        # Older checkpoints: a goal at a visited survivor is a human
+        visiting = nav.goal is not None and any(s.visited for s in detector.registry.near(*nav.goal, 0.05))
+    detector.visiting = bool(visiting) and nav.goal is not None
+    return state
+
+
+class CheckpointWriter:
+    # Writes checkpoints on a background thread. save() only captures copies of
+    # the state; at most one capture waits behind the file being written, and
+    # further saves are dropped rather than blocking the control loop.
+    def __init__(self, path):
+        self.path = path
+        self.pending = queue.Queue(maxsize=1)
+        self.last_write_ms = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, mapping, detector, nav, estimator, sim_time=0.0):
+        if self.pending.full():
+            return False
+        try:
+            self.pending.put_nowait(capture(mapping, detector, nav, estimator, sim_time))
+        except queue.Full:
+            return False
+        return True
+
+    def run(self):
+        while True:
+            state, arrays = self.pending.get()
+            start = time.perf_counter()
+            try:
+                write(self.path, state, arrays)
+            except Exception as e:
+                telemetry.error("checkpoint", "checkpoint write error", error=e)
+            self.last_write_ms = (time.perf_counter() - start) * 1000.0
@@ -2,6 +2,7 @@ import json
 import time
 import math
 import os
+import telemetry
 
 class Communication:
     def __init__(self, robot_instance=None):
@@ -9,30 +10,40 @@ class Communication:
         self.robot = robot_instance
         self.start_time = time.time()
         self.update_count = 0
+        # Survivors as sent, by id, updated from the change feed of a
+        # survivor_registry.SurvivorRegistry set by main_controller
+        self.registry = None
+        self.registry_cursor = None
+        self.survivors = {}
 
-    def send(self, robot_data, survivors, map_data, past_coordinates=None):
+    def send(self, robot_data, map_data):
         self.update_count += 1
+        self._take_survivor_changes()
         complete_data = {
             "timestamp": time.time(),
             "update_count": self.update_count,
             "robot": self._format_robot_data(robot_data),
-            "survivors": self._format_survivor_data(survivors),
+            "survivors": list(self.survivors.values()),
             "mapping": {
                 "status": "active",
                 "map_size": f"{map_data.shape[0] if hasattr(map_data,'shape') else 200}x{map_data.shape[1] if hasattr(map_data,'shape') else 200}"
             },
-            "past_coordinates": past_coordinates or []
+            "past_coordinates": [[s["x"], s["y"]] for s in self.survivors.values() if s["visited"]]
         }
         self._save_to_file(complete_data)
 
     def _format_robot_data(self, robot_data):
         pos = robot_data.get("position", {"x":0,"y":0,"theta":0})
+        cov = pos.get("covariance", [[0,0,0],[0,0,0],[0,0,0]])
         return {
             "position": {
                 "x": round(pos["x"],3),
                 "y": round(pos["y"],3),
                 "theta": round(pos["theta"],3),
-                "theta_degrees": round(pos.get("theta",0)*180/math.pi,1)
+                "theta_degrees": round(pos.get("theta",0)*180/math.pi,1),
+                "covariance": [[round(v,6) for v in row] for row in cov],
+                "sigma_xy": round(math.sqrt(max(cov[0][0],0) + max(cov[1][1],0)),3),
+                "sigma_theta_degrees": round(math.sqrt(max(cov[2][2],0))*180/math.pi,1)
             },
             "battery": robot_data.get("battery",85),
             "status": robot_data.get("navigation_state", robot_data.get("status","active")),
@@ -41,15 +52,23 @@ class Communication:
             "right_speed": robot_data.get("right_speed",0)
         }
 
-    def _format_survivor_data(self, survivors):
-        return [
-            {"id": idx, "x": s.get("x",0), "y": s.get("y",0), "confidence": s.get("confidence",0.8)}
-            for idx,s in enumerate(survivors or [])
-        ]
+    def _take_survivor_changes(self):
+        if self.registry is None:
+            return
+        self.registry_cursor, changes = self.registry.changes(self.registry_cursor)
+        for kind, s in changes:
+            if kind == "reset":
+                self.survivors = {}
+            else:
+                self.survivors[s.id] = self._format_survivor(s)
+
+    def _format_survivor(self, s):
+        return {"id": s.id, "x": round(s.x,3), "y": round(s.y,3), "confidence": round(s.confidence,3),
+                "observations": s.observations, "visited": s.visited}
 
     def _save_to_file(self, data):
         try:
             with open(self.data_file,"w",encoding="utf-8") as f:
                 json.dump(data,f,indent=2,ensure_ascii=False)
         except Exception as e:
-            print("Error writing JSON:", e)
+            telemetry.error("comm", "Error writing JSON", error=e)
@@ -0,0 +1,173 @@
+# debug_viewer.py
+# Optional out-of-process viewer for Detection's camera frames and warm masks:
+#   python debug_viewer.py SHARED_MEMORY_NAME
+# normally started by DebugViewer from the controller.
+#
+# Frames go through a ring of slots in shared memory. The controller writes
+# the next slot whatever the viewer is doing, overwriting the oldest frame, so
+# a slow or frozen viewer never holds up robot.step; the viewer shows the
+# newest complete frame. Each slot has a sequence number that is -1 while the
+# slot is written, and a copy is kept only if the number is the same before
+# and after reading it.
+#
+# Shared memory layout: a header of int64 (magic, slots, width, height,
+# frames published, closed), one int64 sequence number per slot, then the
+# slots. A slot holds the raw BGRA frame, the mask (its height and width
+# first, as the segmenter may look at an ROI or every other pixel), and up to
+# MAX_BOXES contour bounding boxes in full-image pixels.
+
+import os
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = 0x47345649455731        # Marks the shared memory as a frame ring
+HEADER = 6
+MAX_BOXES = 32
+
+
+class FrameRing:
+    def __init__(self, width=None, height=None, slots=4, name=None):
+        # Creates the shared memory, or attaches to it when name is given
+        if name is None:
+            self.slot_bytes = self.slot_size(width, height)
+            size = (HEADER + slots) * 8 + slots * self.slot_bytes
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+            header = np.ndarray(HEADER, dtype=np.int64, buffer=self.shm.buf)
+            header[:] = (MAGIC, slots, width, height, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+            # Only the controller removes the memory; keep this process's
+            # resource tracker from unlinking it when the viewer exits
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            except Exception:
+                pass
+            header = np.ndarray(HEADER, dtype=np.int64, buffer=self.shm.buf)
+            if header[0] != MAGIC:
+                raise ValueError("not a frame ring: " + name)
+            slots, width, height = int(header[1]), int(header[2]), int(header[3])
+            self.slot_bytes = self.slot_size(width, height)
+        self.name = self.shm.name
+        self.width = width
+        self.height = height
+        self.slots = slots
+        self.header = header
+        self.sequence = np.ndarray(slots, dtype=np.int64, buffer=self.shm.buf, offset=HEADER * 8)
+        if self.owner:
+            self.sequence[:] = -1
+
+        # Views of every slot's fields
+        start = (HEADER + slots) * 8
+        self.frames, self.masks, self.mask_shapes, self.boxes = [], [], [], []
+        for k in range(slots):
+            offset = start + k * self.slot_bytes
+            self.frames.append(np.ndarray((height, width, 4), np.uint8, self.shm.buf, offset))
+            offset += height * width * 4
+            self.mask_shapes.append(np.ndarray(3, np.int32, self.shm.buf, offset))
+            offset += 3 * 4
+            self.masks.append(np.ndarray(height * width, np.uint8, self.shm.buf, offset))
+            offset += height * width
+            self.boxes.append(np.ndarray((MAX_BOXES, 4), np.int32, self.shm.buf, offset))
+
+    @staticmethod
+    def slot_size(width, height):
+        size = height * width * 4 + 3 * 4 + height * width + MAX_BOXES * 4 * 4
+        return -(-size // 64) * 64
+
+    def publish(self, image, mask, boxes):
+        # Write a frame into the oldest slot; never waits for the reader
+        seq = int(self.header[4])
+        k = seq % self.slots
+        self.sequence[k] = -1
+        np.copyto(self.frames[k].reshape(-1), np.frombuffer(image, np.uint8))
+        h, w = mask.shape
+        boxes = boxes[:MAX_BOXES]
+        self.mask_shapes[k][:] = (h, w, len(boxes))
+        self.masks[k][:h * w] = mask.ravel()
+        if boxes:
+            self.boxes[k][:len(boxes)] = boxes
+        self.sequence[k] = seq
+        self.header[4] = seq + 1
+
+    def latest(self, after=-1):
+        # (seq, BGRA frame, mask, boxes) copies of the newest complete frame
+        # published after seq `after`, or None when there is none
+        newest = int(self.header[4]) - 1
+        for seq in range(newest, max(after, newest - self.slots), -1):
+            k = seq % self.slots
+            if self.sequence[k] != seq:
+                continue
+            frame = self.frames[k].copy()
+            h, w, n = (int(v) for v in self.mask_shapes[k])
+            mask = self.masks[k][:h * w].reshape(h, w).copy()
+            boxes = self.boxes[k][:n].copy()
+            if self.sequence[k] == seq:
+                return seq, frame, mask, boxes
+        return None
+
+    @property
+    def closed(self):
+        return bool(self.header[5])
+
+    def close(self):
+        if self.owner:
+            self.header[5] = 1
+        # Views into the buffer must go before it can be closed
+        self.header = self.sequence = None
+        self.frames = self.masks = self.mask_shapes = self.boxes = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class DebugViewer:
+    # Controller side: owns the ring and the viewer process
+    def __init__(self, width, height, slots=4):
+        self.ring = FrameRing(width, height, slots)
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), self.ring.name])
+        self.published = 0
+
+    def publish(self, image, mask, contours):
+        self.ring.publish(image, mask, [cv2.boundingRect(c) for c in contours])
+        self.published += 1
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+def main(name):
+    ring = FrameRing(name=name)
+    parent = os.getppid()
+    seq = -1
+    # Runs until the controller closes the ring or exits without closing it
+    while not ring.closed and os.getppid() == parent:
+        latest = ring.latest(seq)
+        if latest is None:
+            time.sleep(0.01)
+        else:
+            seq, frame, mask, boxes = latest
+            annotated = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+            for x, y, w, h in boxes:
+                cv2.rectangle(annotated, (int(x), int(y)), (int(x + w), int(y + h)), (0, 255, 0), 2)
+            cv2.imshow("Camera", annotated)
+            cv2.imshow("Warm Colors", mask)
+        if cv2.waitKey(30) == 27:
+            break
+    cv2.destroyAllWindows()
+    ring.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python debug_viewer.py SHARED_MEMORY_NAME")
+        sys.exit(1)
+    main(sys.argv[1])
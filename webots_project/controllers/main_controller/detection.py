@@ -1,35 +1,44 @@
 # detection.py
 # Handles survivor detection using thermal / vision sensors
 
-from controller import Camera
-import numpy as np
 import cv2
 import math
-
-coords = []
+from sensors import SensorSnapshot
+from scheduler import VisitScheduler
+from segmentation import WarmSegmenter
+from tracker import BearingTracker
+from camera_schedule import CameraSchedule
+from detection_worker import DetectionWorker
+from survivor_registry import SurvivorRegistry
+import telemetry
 
 
 class Detection:
-    def __init__(self, robot):
+    def __init__(self, robot, sensors=None, threaded=True):
         self.nav = None                         
         self.robot = robot                      
 
-        self.camera = self.robot.getDevice("rgb_camera")     # RGB camera device
-        self.camera_motor = self.robot.getDevice("camera_motor")  # Camera rotation motor
-        self.camera_sensor = self.camera_motor.getPositionSensor()  # Tracks camera angle
-
+        # Camera image and angle come from the shared sensor snapshot; without
+        # one, Detection reads its own at the start of every detect
         timestep = int(self.robot.getBasicTimeStep())        
-        self.camera_sensor.enable(timestep)                  
-        self.camera.enable(timestep)                         
+        self.own_sensors = sensors is None
+        self.sensors = SensorSnapshot(robot, timestep) if sensors is None else sensors
+
+        self.camera = self.sensors.camera                    # RGB camera device
+        self.camera_motor = self.robot.getDevice("camera_motor")  # Camera rotation motor
 
         self.start_angle = None              # The angle when scan starts
         self.scan_done = False               # Checks whether a full rotation is completed
         self.detected_angles = []            # Stored final angles of humans
         self.final_distances = []            # Stored final distances of humans
+        self.detected_poses = []             # Robot pose when each of them was seen
 
-        self.humans = {}                     # Tracked humans + sample data
-        self.next_human_id = 0              
-        self.past_coordinates = []           # Previously visited human coords
+        # Every human found so far; new ones reach the visiting order through its change feed
+        self.registry = SurvivorRegistry()
+        self.registry_cursor = self.registry.cursor()
+        self.observation_confidence = 0.8    # Confidence of one scan's sighting of a human
+        self.scheduler = VisitScheduler()    # Visiting order of the known, unvisited humans
+        self.explorer = None                 # frontier.FrontierTracker, set by main_controller
 
         self.camera_height = 0.36            # The height of the camera
         self.target_height = 0.1             # Estimated height of warm object put as the center of the object
@@ -49,61 +58,70 @@ class Detection:
         self.pixel_angle_horizontal = self.h_fov / self.image_width   
         self.pixel_angle_vertical = self.v_fov / self.image_height    
 
+        # Warm colour mask straight from the camera buffer; set_region() narrows it to an ROI or stride
+        self.segmenter = WarmSegmenter(self.image_width, self.image_height)
+        self.min_contour_area = 200          # In full-image pixels
+        # Humans tracked across frames while the camera turns
+        self.tracker = BearingTracker(self.h_fov, self.image_width)
+        # Headless unless main_controller attaches a debug_viewer.DebugViewer
+        self.viewer = None
+
+        # Camera motor speed while scanning, and the camera sampling period that goes with it
+        self.scan_speed = 0.5
+        self.camera_schedule = CameraSchedule(self.camera, timestep, self.h_fov, self.image_width)
+        self.visiting = False                # Driving to a human rather than to a frontier
+
+        # Frames are analysed on a worker thread; results older than the current scan are ignored
+        self.worker = DetectionWorker(self.analyse_frame, threaded)
+        self.scan_seq = 0
+
         self.all_human_reached = False     
 
-        print("Detection module initialized")
+        telemetry.info("detection", "Detection module initialized")
 
     def reset_scan(self):
         # Restarts the detections reinitalises all the variable
         self.scan_done = False
         self.start_angle = None
-        self.humans = {}
-        self.next_human_id = 0
+        self.tracker.clear()
         self.detected_angles = []
         self.final_distances = []
+        self.detected_poses = []
+        self.scan_seq = self.worker.submitted
 
     def capture_frame(self):
-        # Reads the camera frame and converts it into an OpenCV BGR image
-        image = self.camera.getImage()
+        # Raw BGRA camera buffer of this step; the segmenter reads it in place
+        image = self.sensors.image
         if image is None:
-            print("No camera image yet")
+            telemetry.warning("detection", "No camera image yet")
             return None
-
-        # Coverts the webots buffer and puts it as a NumPy Image
-        arr = np.frombuffer(image, np.uint8).reshape(
-            (self.image_height, self.image_width, 4)
-        )
-        frame = cv2.cvtColor(arr, cv2.COLOR_BGRA2BGR)
-        return frame
+        return image
 
     def detect_warm_targets(self, frame):
-        # Converts the frame to HSV then extracts the contour which is the red colored regions
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-
-        # Warm Color Threshold -> Between light red to dark red
-        lower_warm1 = np.array([0, 160, 120])
-        upper_warm1 = np.array([20, 255, 255])
-        lower_warm2 = np.array([170, 120, 70])
-        upper_warm2 = np.array([180, 255, 255])
-
-        mask = (
-            cv2.inRange(hsv, lower_warm1, upper_warm1)
-            | cv2.inRange(hsv, lower_warm2, upper_warm2)
-        )
+        # Extracts the contours of the red coloured regions (segmentation.WARM_BANDS)
+        mask = self.segmenter.segment(frame)
 
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        # Filters out noise
-        valid_contours = [c for c in contours if cv2.contourArea(c) > 200]
+        # Filters out noise; a contour on a strided mask covers stride^2 image pixels
+        min_area = self.min_contour_area / (self.segmenter.stride ** 2)
+        valid_contours = self.segmenter.to_image([c for c in contours if cv2.contourArea(c) > min_area])
 
-        cv2.imshow("Warm Colors", mask)
-        cv2.waitKey(1)
+        if self.viewer is not None:
+            self.viewer.publish(frame, mask, valid_contours)
 
         return valid_contours, mask
 
-    def process_contours(self, contours):
-        # Takes contours calculates angles, distances and sample captures when the target is in the center
-        camera_angle = self.camera_motor.getPositionSensor().getValue()
+    def analyse_frame(self, frame):
+        # Worker side: contour angles, distances and warm coverage of one frame
+        contours, mask = self.detect_warm_targets(frame)
+        offsets, distances = self.contour_geometry(contours)
+        return offsets, distances, self.segmenter.coverage()
+
+    def contour_geometry(self, contours):
+        # Angles of the contours to the left of the image centre, and their ground distances
+        offsets = []
+        distances = []
 
         for c in contours:
             x, y, w, h = cv2.boundingRect(c)
@@ -112,7 +130,6 @@ class Detection:
 
             pixel_offset_x = cx - self.image_center_x
             object_angle = pixel_offset_x * self.pixel_angle_horizontal
-            true_angle = (camera_angle + object_angle + math.pi) % (2 * math.pi) - math.pi
 
             pixel_offset_y = cy - self.image_center_y
             vertical_angle_pixel = pixel_offset_y * self.pixel_angle_vertical
@@ -129,119 +146,149 @@ class Detection:
             if distance <= 0:
                 continue
 
-            matched_id = None
-            for hid, data in self.humans.items():
-                if abs(cx - data["last_x"]) < 60:
-                    matched_id = hid
-
-            if matched_id is None and distance > 0.25:
-                matched_id = self.next_human_id
-                self.humans[matched_id] = {
-                    "last_x": cx,
-                    "angle_samples": [],
-                    "distance_samples": [],
-                    "angle_saved": False,
-                }
-                self.next_human_id += 1
-
-            human = self.humans[matched_id]
-            human["last_x"] = cx
-
-            # Only stores humans once they are in the center
-            if not human["angle_saved"] and abs(cx - self.image_center_x) <= 40:
-                human["angle_samples"].append(true_angle)
-                human["distance_samples"].append(distance)
-
-                if len(human["angle_samples"]) >= 6:
-                    avg_angle = sum(human["angle_samples"]) / len(
-                        human["angle_samples"]
-                    )
-                    avg_dist = sum(human["distance_samples"]) / len(
-                        human["distance_samples"]
-                    )
-
-                    self.detected_angles.append(avg_angle)
-                    self.final_distances.append(avg_dist)
-                    human["angle_saved"] = True
+            # Image x grows to the right while bearings grow counter-clockwise, like the camera motor
+            offsets.append(-object_angle)
+            distances.append(distance)
+
+        return offsets, distances
+
+    def process_contours(self, capture):
+        # Feeds an analysed frame to the tracker at its capture time and camera angle;
+        # the tracker reports a human once it has sampled it in the centre of the image
+        for angle, distance in self.tracker.update(capture.time, capture.camera_angle,
+                                                   capture.offsets, capture.distances):
+            self.detected_angles.append(angle)
+            self.final_distances.append(distance)
+            self.detected_poses.append(capture.pose)
+
+    def scan_turned(self):
+        return self.start_angle is not None and abs(self.sensors.camera_angle - self.start_angle) >= 2 * math.pi
 
     def handle_scan_completion(self):
         # Checks whether the camera has gone 360 and if it does it stops the scan continues navigation and works out the goal coordinates
         if not self.scan_done:
             self.nav.pause()
 
-            current_angle = self.camera_sensor.getValue()
+            current_angle = self.sensors.camera_angle
             if self.start_angle is None:
                 self.start_angle = current_angle
 
-            if abs(current_angle - self.start_angle) >= 2 * math.pi:
+            if self.scan_turned():
                 self.camera_motor.setVelocity(0)
+                # Frames of the scan still with the worker, or analysed since this step's
+                # results(), are waited for and processed first
+                if not self.worker.idle():
+                    return
                 self.scan_done = True
 
-                print("Scan finished.")
-                print("distance:", self.final_distances, "angle:", self.detected_angles)
-
-                global coords
-                coords = self.calculate_coordinates(
-                    self.detected_angles, self.final_distances
-                )
-                print(coords)
-
-                if coords:
-                    closest_x, closest_z = coords[0]
-                    self.past_coordinates.append((closest_x, closest_z))
-                    self.nav.reset(new_goal=(closest_x, closest_z))
-                else:
+                telemetry.info("detection.scan", "Scan finished.",
+                               distances=self.final_distances, angles=self.detected_angles)
+
+                # Sightings near a known human are that human seen again
+                for x, y in self.calculate_coordinates(self.detected_angles, self.final_distances,
+                                                       self.detected_poses):
+                    self.registry.observe(x, y, self.observation_confidence)
+
+                # New humans join the humans still waiting; the next goal is the first one in the visiting order
+                self.scheduler.set_robot((self.nav.x, self.nav.y))
+                found = self.take_new_humans()
+                telemetry.info("detection.scan", "Humans found", positions=found)
+                goal = self.scheduler.pop_next()
+                human = self.registry.nearest(*goal) if goal is not None else None
+                if human is not None:
+                    # Drive to where the human's sightings put it now
+                    goal = self.registry.mark_visited(human.id).position
+
+                telemetry.info("detection.camera", "Frame processing per simulated second",
+                               cpu_ms=self.camera_schedule.cpu_per_second(), frames=self.camera_schedule.frames,
+                               dropped=self.worker.dropped)
+
+                self.visiting = goal is not None
+                if goal is not None:
+                    self.nav.reset(new_goal=goal)
+                elif not self.explore():
                     self.all_human_reached = True
-                    print("All humans reached")
+                    telemetry.info("detection", "All humans reached")
 
         else:
             self.nav.resume()
 
-    def calculate_coordinates(self, anglelist, distancelist):
+    def take_new_humans(self):
+        # Adds the humans the registry gained since the last call to the visiting order
+        self.registry_cursor, changes = self.registry.changes(self.registry_cursor)
+        found = []
+        for kind, human in changes:
+            if kind == "reset":
+                self.scheduler.clear()
+                found = []
+            elif kind == "added" and not human.visited:
+                found.append(human.position)
+        self.scheduler.add(found)
+        return found
+
+    def explore(self):
+        # With no human left to visit, drive to the best frontier of the map and scan there
+        if self.explorer is None:
+            return False
+        target = self.explorer.next_goal((self.nav.x, self.nav.y))
+        if target is None:
+            return False
+        telemetry.info("detection", "Exploring frontier", target=target)
+        self.nav.reset(new_goal=target)
+        return True
+
+    def calculate_coordinates(self, anglelist, distancelist, poselist=None):
+        # Angles are relative to the robot pose each human was seen from, the current pose by default.
+        # Nearest first, as near sightings are the more accurate
         coords = []
-        paired = list(zip(anglelist, distancelist))
+        if poselist is None:
+            poselist = [(self.nav.x, self.nav.y, self.nav.theta)] * len(anglelist)
+        paired = list(zip(anglelist, distancelist, poselist))
         paired.sort(key=lambda x: x[1])
 
-        for angle, distance in paired:
-            x = self.nav.x + distance * math.cos(self.nav.theta + angle)
-            z = self.nav.y + distance * math.sin(self.nav.theta + angle)
-
-            too_close = False
-            for px, pz in self.past_coordinates:
-                if math.hypot(x - px, z - pz) < 0.5:
-                    too_close = True
-                    break
-
-            if not too_close:
-                coords.append((x, z))
+        for angle, distance, (rx, ry, rth) in paired:
+            x = rx + distance * math.cos(rth + angle)
+            z = ry + distance * math.sin(rth + angle)
+            coords.append((x, z))
 
         return coords
 
     def detect(self):
+        if self.own_sensors:
+            self.sensors.read()
         if self.start_angle is None:
-            self.start_angle = self.camera_sensor.getValue()
+            self.start_angle = self.sensors.camera_angle
     
         if not self.scan_done:
-            self.camera_motor.setVelocity(0.5)
+            self.camera_motor.setVelocity(self.scan_speed)
             self.camera_motor.setPosition(float('inf'))
-    
-        frame = self.capture_frame()
-        if frame is None:
-            return []
-
-        contours, mask = self.detect_warm_targets(frame)
-        self.process_contours(contours)
-        self.handle_scan_completion()
-        if self.scan_done:
-            coverage = np.sum(mask > 0) / (self.image_width * self.image_height)
-            if coverage >= 0.15:
-                self.nav.goalreached = True
 
-        return []
+        # Frames at the rate the scan needs, slowly while driving to a human
+        # (for the coverage check), none while exploring
+        if not self.scan_done:
+            self.camera_schedule.set_mode("scan", self.scan_speed)
+        else:
+            self.camera_schedule.set_mode("idle" if self.visiting else "off")
+        close = False
+        for capture in self.worker.results():
+            self.camera_schedule.busy(capture.ms)
+            if capture.seq < self.scan_seq:
+                continue
+            self.process_contours(capture)
+            close = close or capture.coverage >= 0.15
 
-        if self.scan_done:
-            coverage = np.sum(mask > 0) / (self.image_width * self.image_height)
-            if coverage >= 0.15:
-                self.nav.goalreached = True
+        self.handle_scan_completion()
+        if close and self.scan_done:
+            self.nav.goalreached = True
+
+        # This step's frame goes to the worker last, so it is analysed while robot.step
+        # runs; it is tagged with where the camera and robot were. No frames once the
+        # camera has gone round, so the scan's last frames can drain
+        draining = not self.scan_done and self.scan_turned()
+        if self.camera_schedule.frame_due(self.robot.getTime()) and not draining:
+            frame = self.capture_frame()
+            if frame is not None:
+                self.worker.submit(frame, self.robot.getTime(), self.sensors.camera_angle,
+                                   (self.nav.x, self.nav.y, self.nav.theta))
 
         return []
@@ -0,0 +1,137 @@
+# detection_worker.py
+# Camera frames analysed on a worker thread, off the control loop
+#
+# submit() hands over the raw BGRA buffer Webots returned for this step with
+# the simulated time, camera angle and robot pose at capture, and returns at
+# once. The buffer is an immutable bytes object, so it is passed by reference
+# and the segmenter reads it in place through np.frombuffer; the worker shares
+# the controller's memory, and nothing is copied into a queue or another
+# process. Segmentation (numpy) and contour extraction (OpenCV) release the
+# GIL for most of their time, so they run alongside the control loop.
+#
+# There is one pending slot. A frame submitted while the previous one is still
+# waiting replaces it and the older frame is counted as dropped, so a worker
+# that falls behind always moves on to the newest frame. results() returns the
+# analysed frames in capture order, each still carrying its capture tags, so
+# bearings use the camera angle the frame was taken at and positions the pose
+# the robot had then, however late the result arrives.
+#
+# With threaded=False (offline tools, benchmarks) submit() analyses the frame
+# straight away on the caller's thread.
+
+import threading
+import time
+import numpy as np
+import telemetry
+
+
+class FrameCapture:
+    # One submitted frame, its capture tags and, once analysed, the results
+    def __init__(self, seq, image, time, camera_angle, pose):
+        self.seq = seq
+        self.image = image                  # Raw BGRA buffer; released once analysed
+        self.time = time                    # Simulated seconds at capture
+        self.camera_angle = camera_angle    # Camera pan angle at capture
+        self.pose = pose                    # Robot (x, y, theta) at capture
+        self.offsets = None                 # Contour angles left of the image centre
+        self.distances = None               # Contour ground distances, metres
+        self.coverage = 0.0                 # Warm fraction of the image
+        self.ms = 0.0                       # Analysis time
+
+
+class DetectionWorker:
+    def __init__(self, analyse, threaded=True):
+        # analyse(image) -> (offsets, distances, coverage)
+        self.analyse = analyse
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.pending = None                 # Newest frame not yet picked up
+        self.active = False                 # A frame is being analysed
+        self.done = []                      # Analysed frames not yet collected
+        self.stopping = False
+
+        self.submitted = 0
+        self.dropped = 0
+        self.analysed = 0
+
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def submit(self, image, time_s, camera_angle, pose):
+        # Returns the frame's sequence number
+        capture = FrameCapture(self.submitted, image, time_s, camera_angle, pose)
+        self.submitted += 1
+        if self.thread is None:
+            self.finish(capture)
+            return capture.seq
+        with self.changed:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = capture
+            self.changed.notify_all()
+        return capture.seq
+
+    def run(self):
+        while True:
+            with self.changed:
+                while self.pending is None and not self.stopping:
+                    self.changed.wait()
+                if self.stopping:
+                    return
+                capture, self.pending = self.pending, None
+                self.active = True
+            self.finish(capture)
+
+    def finish(self, capture):
+        start = time.perf_counter()
+        try:
+            offsets, distances, capture.coverage = self.analyse(capture.image)
+            capture.offsets = np.asarray(offsets, dtype=np.float64)
+            capture.distances = np.asarray(distances, dtype=np.float64)
+        except Exception as e:
+            telemetry.error("detection.error", "frame analysis error", error=e)
+            capture = None
+        with self.changed:
+            if capture is not None:
+                capture.image = None
+                capture.ms = (time.perf_counter() - start) * 1000.0
+                self.done.append(capture)
+                self.analysed += 1
+            self.active = False
+            self.changed.notify_all()
+
+    def results(self):
+        # Frames analysed since the last call, oldest first
+        with self.lock:
+            done, self.done = self.done, []
+        return done
+
+    def drained(self):
+        # Nothing waiting or being analysed; call with the lock held
+        return self.pending is None and not self.active
+
+    def idle(self):
+        # Nothing waiting, being analysed or analysed but not yet collected.
+        # A frame finishing after the caller's results() is still in done, so
+        # this stays False until the next results() picks it up.
+        with self.lock:
+            return self.drained() and not self.done
+
+    def wait(self, timeout=None):
+        # Blocks until every submitted frame is analysed and returns results(),
+        # collected under the same lock; None on timeout
+        with self.changed:
+            if not self.changed.wait_for(self.drained, timeout):
+                return None
+            done, self.done = self.done, []
+        return done
+
+    def close(self):
+        if self.thread is None:
+            return
+        with self.changed:
+            self.stopping = True
+            self.changed.notify_all()
+        self.thread.join(timeout=1.0)
@@ -0,0 +1,164 @@
+# distance_field.py
+# Distance from every map cell to the nearest obstacle, kept up to date from
+# the cells Mapping reports as flipped
+#
+# A dynamic brushfire (Lau, Sprunk and Burgard, "Improved updating of Euclidean
+# distance maps and Voronoi diagrams"): a new obstacle lowers the distances
+# around it, a removed obstacle first raises (clears) the cells it was nearest
+# to and the surviving obstacles then lower them again. Every cell remembers its
+# nearest obstacle, so distances are Euclidean rather than accumulated steps.
+# Distances stop growing at max_distance, which bounds every update to a window
+# around the flipped cells. Queries take navigation-frame coordinates in metres.
+
+import heapq
+import math
+import numpy as np
+from tiled_grid import TiledGrid, pack_cells, unpack_cells
+
+NO_OBSTACLE = -(1 << 30)
+
+
+class DistanceField:
+    def __init__(self, mapping, max_distance=1.0):
+        self.mapping = mapping
+        self.resolution = mapping.RESOLUTION
+        self.max_distance = max_distance
+        self.max_cells = max_distance * self.resolution
+
+        # Distance in cells (max_cells where nothing is closer), and the nearest obstacle
+        self.distance = TiledGrid(np.float32, self.max_cells)
+        self.nearest_x = TiledGrid(np.int32, NO_OBSTACLE)
+        self.nearest_y = TiledGrid(np.int32, NO_OBSTACLE)
+        self.occupied = TiledGrid(np.uint8, 0)
+
+        # Called with (cx, cy, old, new) distances in cells of every cell an update changed
+        self.listeners = []
+        self.cells_visited = 0                   # Cells taken off the queue by the last update
+
+        mapping.flip_listeners.append(self.on_cells_flipped)
+        self.on_cells_flipped([mapping.grid.find(lambda v: v > mapping.OCC_THRESH)])
+
+    # --- Queries ---------------------------------------------------------------------
+
+    def to_cell(self, x, y):
+        return self.mapping.world_to_map(x, -y)
+
+    def clearance(self, x, y):
+        # Distance in metres from (x, y) to the nearest obstacle, at most max_distance
+        mx, my = self.to_cell(x, y)
+        return float(self.distance.value(mx, my)) / self.resolution
+
+    def clearance_batch(self, xs, ys):
+        # clearance() for arrays of points
+        m = self.mapping
+        mx = np.rint(np.asarray(xs) * self.resolution).astype(np.int64) + m.MAP_W // 2
+        my = np.rint(-np.asarray(ys) * self.resolution).astype(np.int64) + m.MAP_H // 2
+        return self.distance[mx, my].astype(np.float64) / self.resolution
+
+    # --- Updates ---------------------------------------------------------------------
+
+    def on_cells_flipped(self, flipped_cells):
+        self.cells_visited = 0
+        if not flipped_cells:
+            return
+        m = self.mapping
+        keys = np.unique(np.concatenate([pack_cells(cx, cy) for cx, cy in flipped_cells]))
+        cx, cy = unpack_cells(keys)
+        occupied = m.grid[cx, cy] > m.OCC_THRESH
+        before = self.occupied[cx, cy] > 0
+        added = occupied & ~before
+        removed = before & ~occupied
+        if not (added.any() or removed.any()):
+            return
+        changed = added | removed
+        self.occupied[cx[changed], cy[changed]] = occupied[changed]
+        self.update(cx[added], cy[added], cx[removed], cy[removed])
+
+    def update(self, add_x, add_y, remove_x, remove_y):
+        # Brushfire over a dense window holding every cell the change can reach:
+        # cells within max_distance of a changed cell, and their neighbours
+        margin = int(math.ceil(self.max_cells)) + 3
+        all_x = np.concatenate((add_x, remove_x))
+        all_y = np.concatenate((add_y, remove_y))
+        x0 = int(all_x.min()) - margin
+        y0 = int(all_y.min()) - margin
+        x1 = int(all_x.max()) + margin + 1
+        y1 = int(all_y.max()) + margin + 1
+        h = y1 - y0
+        old = self.distance.window(x0, y0, x1, y1)
+        dist = old.ravel().tolist()
+        old_nx = self.nearest_x.window(x0, y0, x1, y1)
+        nx = old_nx.ravel().tolist()
+        ny = self.nearest_y.window(x0, y0, x1, y1).ravel().tolist()
+        # 1 for cells being cleared; the window's border is marked 2 so no wave leaves it
+        raising = bytearray(len(dist))
+        w = x1 - x0
+        raising[:h] = raising[-h:] = b"\x02" * h
+        raising[::h] = raising[h - 1::h] = b"\x02" * w
+        steps = (h, -h, 1, -1, h + 1, h - 1, -h + 1, -h - 1)
+        cap = self.max_cells
+        removed = set(zip(remove_x.tolist(), remove_y.tolist()))
+        queue = []
+
+        for x, y in zip(add_x.tolist(), add_y.tolist()):
+            s = (x - x0) * h + (y - y0)
+            dist[s] = 0.0
+            nx[s] = x
+            ny[s] = y
+            queue.append((0.0, s))
+        for x, y in removed:
+            s = (x - x0) * h + (y - y0)
+            dist[s] = cap
+            nx[s] = NO_OBSTACLE
+            raising[s] = 1
+            queue.append((0.0, s))
+        heapq.heapify(queue)
+
+        visited = 0
+        while queue:
+            d, s = heapq.heappop(queue)
+            visited += 1
+            if raising[s]:
+                # Clear the neighbours whose nearest obstacle is gone, and queue the
+                # others so their obstacles spread into the cleared cells
+                for step in steps:
+                    n = s + step
+                    if nx[n] != NO_OBSTACLE and not raising[n]:
+                        heapq.heappush(queue, (dist[n], n))
+                        if (nx[n], ny[n]) in removed:
+                            dist[n] = cap
+                            nx[n] = NO_OBSTACLE
+                            raising[n] = 1
+                raising[s] = 0
+            elif nx[s] != NO_OBSTACLE and d <= dist[s]:
+                ox = nx[s]
+                oy = ny[s]
+                for step in steps:
+                    n = s + step
+                    if raising[n]:
+                        continue
+                    i, j = divmod(n, h)
+                    dx = x0 + i - ox
+                    dy = y0 + j - oy
+                    dn = math.sqrt(dx * dx + dy * dy)
+                    if dn < dist[n] and dn < cap:
+                        dist[n] = dn
+                        nx[n] = ox
+                        ny[n] = oy
+                        heapq.heappush(queue, (dn, n))
+        self.cells_visited = visited
+
+        # Write back only the cells that changed
+        new = np.array(dist, dtype=np.float32).reshape(old.shape)
+        near_x = np.array(nx, dtype=np.int32).reshape(old.shape)
+        near_y = np.array(ny, dtype=np.int32).reshape(old.shape)
+        i, j = np.nonzero((new != old) | (near_x != old_nx))
+        if len(i) == 0:
+            return
+        wx = i + x0
+        wy = j + y0
+        self.distance[wx, wy] = new[i, j]
+        self.nearest_x[wx, wy] = near_x[i, j]
+        self.nearest_y[wx, wy] = near_y[i, j]
+        for listener in self.listeners:
+            listener(wx, wy, old[i, j], new[i, j])
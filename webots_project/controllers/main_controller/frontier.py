@@ -0,0 +1,128 @@
+# frontier.py
+# Frontiers of the explored area: known-free cells next to unknown ones
+#
+# The frontier set is kept up to date from the cells Mapping reports as having
+# changed between unknown, free and occupied (Mapping.cell_state, the same
+# classification used here), so an update only looks at those cells and their
+# neighbours rather than the whole grid. Frontier cells are
+# grouped into 8-connected clusters when a goal is needed, and the goal is the
+# cluster with the most frontier per metre of travel. Goals are in the
+# navigation frame.
+
+import math
+import numpy as np
+from tiled_grid import pack_cells, unpack_cells
+
+# A cell is a frontier when one of its 4-neighbours is unknown
+NEIGHBOURS_4 = ((1, 0), (-1, 0), (0, 1), (0, -1))
+NEIGHBOURS_8 = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+class FrontierTracker:
+    def __init__(self, mapping, path_cost=None, min_cluster=6, visited_radius=0.5):
+        self.mapping = mapping
+        self.resolution = mapping.RESOLUTION
+        self.path_cost = path_cost          # path_cost(source, targets) -> metres to each target
+        self.min_cluster = min_cluster      # Smaller clusters are usually sensor noise
+        self.visited_radius = visited_radius
+
+        self.cells = set()                  # Packed keys of the frontier cells
+        self.clusters = []                  # Cached clusters, rebuilt when the frontier changed
+        self.dirty = False
+        self.goals = []                     # Frontier goals already given out
+        self.cells_checked = 0              # Cells re-classified by the last update
+
+        mapping.change_listeners.append(self.on_cells_changed)
+        self.on_cells_changed([mapping.grid.find(lambda v: np.abs(v) > mapping.KNOWN_THRESH)])
+
+    def to_world(self, mx, my):
+        m = self.mapping
+        return (mx - m.MAP_W // 2) / m.RESOLUTION, -(my - m.MAP_H // 2) / m.RESOLUTION
+
+    # --- Updates ---------------------------------------------------------------------
+
+    def is_frontier(self, cx, cy):
+        m = self.mapping
+        frontier = m.cell_state(m.grid[cx, cy]) == -1
+        unknown = np.zeros(len(cx), dtype=bool)
+        for dx, dy in NEIGHBOURS_4:
+            unknown |= m.cell_state(m.grid[cx + dx, cy + dy]) == 0
+        return frontier & unknown
+
+    def on_cells_changed(self, changed_cells):
+        # A change can only affect the frontier status of the cell and its 4-neighbours
+        self.cells_checked = 0
+        if not changed_cells or not any(len(c[0]) for c in changed_cells):
+            return
+        cx = np.concatenate([c[0] for c in changed_cells])
+        cy = np.concatenate([c[1] for c in changed_cells])
+        keys = np.unique(np.concatenate([pack_cells(cx, cy)] +
+                                        [pack_cells(cx + dx, cy + dy) for dx, dy in NEIGHBOURS_4]))
+        cx, cy = unpack_cells(keys)
+        frontier = self.is_frontier(cx, cy)
+        self.cells.update(keys[frontier].tolist())
+        self.cells.difference_update(keys[~frontier].tolist())
+        self.cells_checked = len(keys)
+        self.dirty = True
+
+    # --- Goals -----------------------------------------------------------------------
+
+    def cluster(self):
+        # 8-connected clusters of frontier cells: size, centroid, and the member
+        # nearest the centroid as the cell to drive to
+        if not self.dirty:
+            return self.clusters
+        cx, cy = unpack_cells(np.fromiter(self.cells, dtype=np.int64, count=len(self.cells)))
+        members = set(zip(cx.tolist(), cy.tolist()))
+        self.clusters = []
+        while members:
+            seed = members.pop()
+            group = [seed]
+            stack = [seed]
+            while stack:
+                x, y = stack.pop()
+                for dx, dy in NEIGHBOURS_8:
+                    n = (x + dx, y + dy)
+                    if n in members:
+                        members.remove(n)
+                        group.append(n)
+                        stack.append(n)
+            if len(group) < self.min_cluster:
+                continue
+            gx = np.array([g[0] for g in group])
+            gy = np.array([g[1] for g in group])
+            mx, my = gx.mean(), gy.mean()
+            k = int(np.argmin((gx - mx) ** 2 + (gy - my) ** 2))
+            self.clusters.append({
+                "size": len(group),
+                "centroid": self.to_world(mx, my),
+                "target": self.to_world(int(gx[k]), int(gy[k])),
+            })
+        self.dirty = False
+        return self.clusters
+
+    def next_goal(self, robot):
+        # The reachable cluster with the most frontier cells per metre of travel,
+        # skipping places already given out as goals; None when nothing is left
+        candidates = [c for c in self.cluster()
+                      if all(math.hypot(c["target"][0] - g[0], c["target"][1] - g[1]) > self.visited_radius
+                             for g in self.goals)]
+        if not candidates:
+            return None
+        targets = [c["target"] for c in candidates]
+        if self.path_cost is None:
+            costs = [math.hypot(t[0] - robot[0], t[1] - robot[1]) for t in targets]
+        else:
+            costs = self.path_cost(robot, targets)
+        best = None
+        best_score = 0.0
+        for c, cost in zip(candidates, costs):
+            if not math.isfinite(cost):
+                continue
+            score = c["size"] / (self.resolution * (cost + 1.0))
+            if score > best_score:
+                best = c["target"]
+                best_score = score
+        if best is not None:
+            self.goals.append(best)
+        return best
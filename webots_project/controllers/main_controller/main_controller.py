@@ -1,8 +1,17 @@
 from controller import Robot
 import navigation
+import planner
 import mapping
 import detection
 import communication
+import checkpoint
+import debug_viewer
+import distance_field
+import frontier
+import sensor_log
+import sensors
+import state_estimator
+import telemetry
 import subprocess
 import sys
 import os
@@ -11,37 +20,92 @@ import time
 robot = Robot()
 timestep = int(robot.getBasicTimeStep())
 
+# Log records are written to an NDJSON file from a background thread, with rate
+# limits in simulated time; INFO and above are also echoed to the console
+TELEMETRY_PATH = os.path.join(os.path.dirname(__file__), "telemetry.ndjson")
+telemetry.logger.clock = robot.getTime
+telemetry.logger.start(TELEMETRY_PATH)
+
 try:
     gui_path = os.path.join(os.path.dirname(__file__), "robot_gui.py")
     if os.path.exists(gui_path):
         subprocess.Popen([sys.executable, gui_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 except Exception as e:
-    print("Could not start GUI:", e)
+    telemetry.error("controller", "Could not start GUI", error=e)
 
-nav = navigation.Navigation(robot, timestep)
-map_module = mapping.Mapping(robot)
-detector = detection.Detection(robot)
+# Every device is read once per step into this snapshot, which all modules share
+sensor_snapshot = sensors.SensorSnapshot(robot, timestep)
+# One pose estimate per step, which navigation, mapping, detection and the GUI all use
+estimator = state_estimator.PoseEstimator(sensor_snapshot)
+nav = navigation.Navigation(robot, timestep, sensor_snapshot, estimator)
+map_module = mapping.Mapping(robot, sensor_snapshot, estimator)
+detector = detection.Detection(robot, sensor_snapshot)
 comm = communication.Communication(robot)
 
 nav.detect = detector
 detector.nav = nav
+# Obstacle distances and shortest paths on the occupancy grid, both repaired as the map changes
+obstacle_distance = distance_field.DistanceField(map_module)
+nav.planner = planner.GridPlanner(obstacle_distance)
+# Survivors are visited in an order based on path lengths through the map
+detector.scheduler.path_cost = nav.planner.path_costs
+# Unexplored parts of the map are searched once no known survivor is left to visit
+detector.explorer = frontier.FrontierTracker(map_module, nav.planner.path_costs)
+# The map markers and the GUI's survivor list follow the detector's survivor registry
+map_module.registry = detector.registry
+comm.registry = detector.registry
+
+# Camera frames and warm masks in a separate viewer process; detection runs headless without it
+DEBUG_VIEWER = False
+if DEBUG_VIEWER:
+    try:
+        detector.viewer = debug_viewer.DebugViewer(detector.image_width, detector.image_height)
+    except Exception as e:
+        telemetry.error("controller", "Could not start the debug viewer", error=e)
+
+# Resume from the last checkpoint when the controller restarts mid-simulation
+CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), "controller_state.ckpt")
+CHECKPOINT_PERIOD = 5.0
+if os.path.exists(CHECKPOINT_PATH) and robot.getTime() > 0:
+    try:
+        start = time.perf_counter()
+        state, arrays = checkpoint.read(CHECKPOINT_PATH)
+        # A checkpoint from later than now belongs to an earlier run of the world
+        if state["sim_time"] <= robot.getTime():
+            checkpoint.restore(state, arrays, map_module, detector, nav, estimator)
+            telemetry.info("controller", "Resumed from checkpoint", ms=(time.perf_counter() - start) * 1000)
+    except Exception as e:
+        telemetry.error("controller", "Could not resume from checkpoint", error=e)
+checkpoint_writer = checkpoint.CheckpointWriter(CHECKPOINT_PATH)
+
+# Log the sensors Mapping reads, for offline replay with sensor_log.py
+RECORD_SENSOR_LOG = False
+SENSOR_LOG_PATH = os.path.join(os.path.dirname(__file__), "sensors.slog")
+recorder = sensor_log.SensorLogRecorder(sensor_snapshot, SENSOR_LOG_PATH) if RECORD_SENSOR_LOG else None
 
 last_send = time.time()
+last_checkpoint = time.time()
 
 while robot.step(timestep) != -1 and detector.all_human_reached == False:
+    sensor_snapshot.read()
+    if recorder is not None:
+        try:
+            recorder.record(sensor_snapshot)
+        except Exception as e:
+            telemetry.error("controller.error.sensor_log", "sensor log error", error=e)
+    estimator.step()
     try:
         map_module.update()
     except Exception as e:
-        print("map update error:", e)
+        telemetry.error("controller.error.mapping", "map update error", error=e)
     try:
-        survivors = detector.detect()
+        detector.detect()
     except Exception as e:
-        print("detection error:", e)
-        survivors = []
+        telemetry.error("controller.error.detection", "detection error", error=e)
     try:
         nav.move()
     except Exception as e:
-        print("nav move error:", e)
+        telemetry.error("controller.error.navigation", "nav move error", error=e)
     try:
         left_speed = nav.left_motor.getVelocity() if hasattr(nav, "left_motor") else 0
         right_speed = nav.right_motor.getVelocity() if hasattr(nav, "right_motor") else 0
@@ -49,7 +113,8 @@ while robot.step(timestep) != -1 and detector.all_human_reached == False:
         left_speed = 0
         right_speed = 0
     robot_data = {
-        "position": {"x": nav.x, "y": nav.y, "theta": nav.theta},
+        "position": {"x": estimator.x, "y": estimator.y, "theta": estimator.theta,
+                     "covariance": estimator.covariance().tolist()},
        "navigation_state": nav.state,
        "goal_position": nav.goal,
        "obstacle_detected": nav.obstacle_detected() if hasattr(nav, "obstacle_detected") else False,
@@ -60,9 +125,20 @@ while robot.step(timestep) != -1 and detector.all_human_reached == False:
        "lidar_data": getattr(map_module, "lidar_raw", [])
     }
     try:
-        past_coords = getattr(detector, "past_coordinates", []) if hasattr(detector, "past_coordinates") else []
         if time.time() - last_send > 0.2:
-            comm.send(robot_data, survivors, getattr(map_module, "map_data", []), past_coords)
+            comm.send(robot_data, getattr(map_module, "map_data", []))
             last_send = time.time()
     except Exception as e:
-        print("comm send error:", e)
+        telemetry.error("controller.error.comm", "comm send error", error=e)
+    if time.time() - last_checkpoint > CHECKPOINT_PERIOD:
+        try:
+            checkpoint_writer.save(map_module, detector, nav, estimator, robot.getTime())
+        except Exception as e:
+            telemetry.error("controller.error.checkpoint", "checkpoint error", error=e)
+        last_checkpoint = time.time()
+
+if recorder is not None:
+    recorder.close()
+detector.worker.close()
+if detector.viewer is not None:
+    detector.viewer.close()
@@ -1,17 +1,23 @@
-from controller import Display, Lidar, InertialUnit, PositionSensor
 import math
+import os
 import numpy as np
-import detection
+import cv2
+import telemetry
+from tiled_grid import TiledGrid, pack_cells, unpack_cells
+from sensors import SensorSnapshot
+from state_estimator import PoseEstimator
 
 class Mapping:
-    def __init__(self, robot):
+    # sensors and estimator are the SensorSnapshot and PoseEstimator shared with
+    # the other modules; without them, Mapping reads its own snapshot and steps
+    # its own estimator at the start of every update
+    def __init__(self, robot, sensors=None, estimator=None):
         self.robot = robot
         self.TIME_STEP = int(robot.getBasicTimeStep())
 
-        self.WHEEL_RADIUS = 0.033
-        self.WHEEL_BASE = 0.160
-
         # map 
+        # The grid is unbounded; MAP_SIZE_M is the square shown on the display,
+        # and its centre cell is where world (0, 0) maps to
         self.MAP_SIZE_M = 20.0
         self.RESOLUTION = 10  
         self.MAP_W = int(self.MAP_SIZE_M * self.RESOLUTION)
@@ -27,43 +33,64 @@ class Mapping:
 
         # devices
         self.display = robot.getDevice("display")
-        self.lidar = robot.getDevice("LDS-01")
-        self.imu = robot.getDevice("inertial unit")
-        self.left_enc = robot.getDevice("left wheel sensor")
-        self.right_enc = robot.getDevice("right wheel sensor")
-
-        self.lidar.enable(self.TIME_STEP)
-        self.imu.enable(self.TIME_STEP)
-        self.left_enc.enable(self.TIME_STEP)
-        self.right_enc.enable(self.TIME_STEP)
-
-        self.lidar_res = self.lidar.getHorizontalResolution()
-        self.lidar_fov = self.lidar.getFov()
-        self.lidar_min = self.lidar.getMinRange()
-        self.lidar_max = self.lidar.getMaxRange()
+        self.own_sensors = sensors is None
+        self.sensors = SensorSnapshot(robot, self.TIME_STEP, camera=False) if sensors is None else sensors
+
+        self.lidar_res = self.sensors.lidar_res
+        self.lidar_fov = self.sensors.lidar_fov
+        self.lidar_min = self.sensors.lidar_min
+        self.lidar_max = self.sensors.lidar_max
+        self.own_estimator = estimator is None
+        self.estimator = PoseEstimator(self.sensors) if estimator is None else estimator
         self.NO_HIT_THRESH = 0.98 * self.lidar_max
 
-        self.grid = np.zeros((self.MAP_W, self.MAP_H), dtype=np.float32)
+        # Map layers are sparse tiles allocated as the robot observes new area
+        self.grid = TiledGrid(np.float32, 0.0)
         self.map_data = self.grid
-        self.occ_hits = np.zeros((self.MAP_W, self.MAP_H), dtype=np.uint16)
-
-        # robot intial pose 
-        self.x = 0.0
-        self.y = 0.0
-        self.th = 0.0
-        self.last_l = self.left_enc.getValue()
-        self.last_r = self.right_enc.getValue()
-        self.survivors = [] 
+        self.occ_hits = TiledGrid(np.uint16, 0)
+        # Occupancy probability of every cell, kept in step with grid by set_cells
+        self.prob = TiledGrid(np.float32, 0.5)
+        # Cells within +-KNOWN_THRESH are unknown, below it free (see cell_state);
+        # known_cells counts the ones outside it
+        self.KNOWN_THRESH = 0.3
+        self.known_cells = 0
+        # Cells above OCC_THRESH are obstacles; cells that crossed it this update
+        self.OCC_THRESH = 0.4
+        self.flipped_cells = []
+        # Called with flipped_cells at the end of every update, e.g. by the path planner
+        self.flip_listeners = []
+        # Cells that changed between unknown, free and occupied this update, and
+        # the callbacks that get them at the end of every update (e.g. frontiers)
+        self.changed_cells = []
+        self.change_listeners = []
+        # Packed keys of cells written with a value inside the decay band (0.1, 4.0)
+        self.decay_candidates = []
+
+        # robot pose in the map frame, taken from the estimator every update
+        self.x, self.y, self.th = self.estimator.map_pose()
+        # Survivor markers in the map frame by id, kept up to date from the change
+        # feed of a survivor_registry.SurvivorRegistry set by main_controller
+        self.registry = None
+        self.registry_cursor = None
+        self.survivors = {}
         
         # Scan matching parameters
         self.USE_SCAN_MATCHING = True
         self.scan_match_counter = 0
         self.SCAN_MATCH_INTERVAL = 10  
-        self.prev_ranges = None
-        
-        # Stuck detection parameters
-        self.stuck_counter = 0
-        self.STUCK_THRESHOLD = 5
+        # Scan-match poses are passed to the estimator with this uncertainty
+        self.SCAN_SIGMA_XY = 0.05
+        self.SCAN_SIGMA_TH = math.radians(3.0)
+        # Wide-window branch-and-bound matcher, used instead of simple_scan_match when enabled
+        self.USE_CORRELATIVE_MATCHING = False
+        # Gauss-Newton refinement of the matched pose on the likelihood field
+        self.USE_POSE_REFINEMENT = True
+
+        # Ray integration parameters
+        # Every third beam is integrated. In the synthetic room every beam
+        # doubles the update time (1.9 to 3.9 ms) and maps the walls and
+        # tracks the pose no better, so 3 is kept
+        self.BEAM_STEP = 3
         
         # Precompute beam angles 
         self.beam_angles = np.linspace(
@@ -72,6 +99,13 @@ class Mapping:
             self.lidar_res,
             dtype=np.float32
         )
+        # Cells crossed by rays to every endpoint within lidar range, used by cast_rays
+        self.ray_templates = RayTemplates(self)
+        telemetry.info("mapping", f"Ray templates: {self.ray_templates.rows} rays, "
+                                  f"{self.ray_templates.nbytes / 1024:.0f} KiB ({self.ray_templates.source})")
+        self.likelihood = LikelihoodField(self)
+        self.renderer = MapRenderer(self)
+        self.correlative_matcher = CorrelativeScanMatcher(self)
 
     def range(self, v, lo, hi):
         return lo if v < lo else hi if v > hi else v
@@ -100,220 +134,282 @@ class Mapping:
             y += dy
         return points
 
+    def cast_rays(self, ranges, robot_mx, robot_my):
+        # Trace all beams of a scan at once with the precomputed ray templates; same
+        # cells as trace_ray per beam, up to how exact half-cell ties are rounded
+        # Returns map indices of traversed (free) cells and endpoint (hit) cells, and
+        # the beam each free cell belongs to (hits are one per beam, in beam order)
+        idx = np.arange(0, self.lidar_res, self.BEAM_STEP)
+        r_val = ranges[idx].astype(np.float64)
+        hit = np.isfinite(r_val) & (r_val > 0.05) & (r_val < self.NO_HIT_THRESH)
+        idx = idx[hit]
+        r_val = r_val[hit]
+
+        beam_angle = (idx / (self.lidar_res - 1)) * self.lidar_fov - (self.lidar_fov / 2.0)
+        world_angle = self.th + beam_angle
+        cx, cy = self.MAP_W // 2, self.MAP_H // 2
+        mx = np.rint((self.x + r_val * np.cos(world_angle)) * self.RESOLUTION).astype(np.int64) + cx
+        my = np.rint((self.y + r_val * np.sin(world_angle)) * self.RESOLUTION).astype(np.int64) + cy
+
+        empty = np.zeros(0, dtype=np.int64)
+        if len(mx) == 0:
+            return empty, empty, empty, empty, empty
+
+        # Cells of every ray are the robot cell plus its template's offsets
+        off_x, off_y, steps = self.ray_templates.lookup(mx - robot_mx, my - robot_my)
+        cells_x = off_x.astype(np.int64) + robot_mx
+        cells_y = off_y.astype(np.int64) + robot_my
+
+        k = np.arange(off_x.shape[1])
+        free = k[None, :] < (steps - 1)[:, None]
+        end = k[None, :] == (steps - 1)[:, None]
+
+        free_ray = np.broadcast_to(np.arange(len(mx))[:, None], free.shape)[free]
+        return cells_x[free], cells_y[free], cells_x[end], cells_y[end], free_ray
+
+    def integrate_rays(self, free_x, free_y, hit_x, hit_y, free_ray):
+        # Apply one scan's log-odds updates in beam order, as tracing beam by beam
+        # would: each cell's updates are sorted by beam (a beam's free cells before
+        # its hit), and runs of the same kind on a cell are applied in one step.
+        # Pass p applies the p-th run of every cell, so a scan takes as many
+        # gather/scatter passes as the most often alternating cell has runs.
+        if len(free_x) == 0 and len(hit_x) == 0:
+            return
+        keys = np.concatenate((pack_cells(free_x, free_y), pack_cells(hit_x, hit_y)))
+        beams = np.concatenate((free_ray, np.arange(len(hit_x))))
+        kinds = np.concatenate((np.zeros(len(free_x), dtype=np.int8), np.ones(len(hit_x), dtype=np.int8)))
+        order = np.lexsort((kinds, beams, keys))
+        keys = keys[order]
+        kinds = kinds[order]
+
+        starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (kinds[1:] != kinds[:-1])])
+        lengths = np.diff(np.r_[starts, len(keys)])
+        run_keys = keys[starts]
+        run_kinds = kinds[starts]
+        # Index of every run among its cell's runs
+        first = np.r_[True, run_keys[1:] != run_keys[:-1]]
+        cell_start = np.maximum.accumulate(np.where(first, np.arange(len(starts)), 0))
+        run_pass = np.arange(len(starts)) - cell_start
+
+        for p in range(int(run_pass.max()) + 1):
+            now = run_pass == p
+            free_run = now & (run_kinds == 0)
+            if free_run.any():
+                cx, cy = unpack_cells(run_keys[free_run])
+                values = self.grid[cx, cy]
+                # Confident obstacles (>= 4.0) are never cleared by passing rays
+                open_cells = values < 4.0
+                self.set_cells(cx[open_cells], cy[open_cells], np.clip(
+                    values[open_cells] + lengths[free_run][open_cells] * self.L_FREE,
+                    self.LOG_ODDS_MIN,
+                    self.LOG_ODDS_MAX
+                ))
+            hit_run = now & (run_kinds == 1)
+            if hit_run.any():
+                cx, cy = unpack_cells(run_keys[hit_run])
+                counts = lengths[hit_run]
+                hits_before = self.occ_hits[cx, cy].astype(np.int64)
+                self.occ_hits[cx, cy] = np.minimum(hits_before + counts, 65535)
+
+                # Number of these hits that landed at or above OCC_CONFIRM
+                confirmed = np.clip(hits_before + counts - self.OCC_CONFIRM + 1, 0, counts)
+                occ = confirmed > 0
+                self.set_cells(cx[occ], cy[occ], np.clip(
+                    self.grid[cx[occ], cy[occ]] + confirmed[occ] * self.L_OCC,
+                    self.LOG_ODDS_MIN,
+                    self.LOG_ODDS_MAX
+                ))
+
     def logodds_to_prob(self, value):
         return 1.0 / (1.0 + math.exp(-value))
 
+    def cell_state(self, values):
+        # -1 free, 0 unknown, 1 occupied evidence; changed_cells reports every change of it
+        return np.where(values < -self.KNOWN_THRESH, -1, np.where(values > self.KNOWN_THRESH, 1, 0))
+
+    def set_cells(self, cx, cy, values):
+        # Write log-odds values (unique cells) and keep prob and known_cells in step
+        old = self.grid[cx, cy]
+        self.grid[cx, cy] = values
+        new = self.grid[cx, cy]
+        self.known_cells += int(np.count_nonzero(np.abs(new) > self.KNOWN_THRESH)) - \
+                            int(np.count_nonzero(np.abs(old) > self.KNOWN_THRESH))
+        self.prob[cx, cy] = 1.0 / (1.0 + np.exp(-new))
+        flipped = (old > self.OCC_THRESH) != (new > self.OCC_THRESH)
+        if flipped.any():
+            self.flipped_cells.append((cx[flipped], cy[flipped]))
+        changed = self.cell_state(old) != self.cell_state(new)
+        if changed.any():
+            self.changed_cells.append((cx[changed], cy[changed]))
+        decaying = (new > 0.1) & (new < 4.0)
+        if decaying.any():
+            self.decay_candidates.append(pack_cells(cx[decaying], cy[decaying]))
+
+    def decay(self):
+        # Fade weak (0.1..2.0) and medium (2.0..4.0) evidence once per update.
+        # Values outside that band never change, so only cells written into it
+        # are visited; set_cells re-queues the ones still inside it afterwards.
+        if not self.decay_candidates:
+            return
+        cx, cy = unpack_cells(np.unique(np.concatenate(self.decay_candidates)))
+        self.decay_candidates = []
+        values = self.grid[cx, cy]
+        weak_noise = (values > 0.1) & (values < 2.0)
+        medium_uncertain = (values >= 2.0) & (values < 4.0)
+        values[weak_noise] *= 0.98
+        values[medium_uncertain] *= 0.995
+        changed = weak_noise | medium_uncertain
+        self.set_cells(cx[changed], cy[changed], values[changed])
+
     def get_scan_points(self, ranges, x, y, th):
-        points = []
         step = max(1, self.lidar_res // 40)  
-        
-        for i in range(0, self.lidar_res, step):
-            r = float(ranges[i])
-            if r > 0.05 and r < self.lidar_max * 0.95:
-                angle = th + self.beam_angles[i]
-                px = x + r * math.cos(angle)
-                py = y + r * math.sin(angle)
-                points.append((px, py))
-        
-        return np.array(points) if points else np.array([])
+        r = ranges[::step].astype(np.float64)
+        valid = (r > 0.05) & (r < self.lidar_max * 0.95)
+        angle = th + self.beam_angles[::step][valid].astype(np.float64)
+        r = r[valid]
+        if len(r) == 0:
+            return np.array([])
+        return np.column_stack((x + r * np.cos(angle), y + r * np.sin(angle)))
 
     def simple_scan_match(self, ranges, x_odom, y_odom, th_odom):
-        known_cells = np.sum(np.abs(self.grid) > 0.3)
-        if known_cells < 200:
+        if self.known_cells < 200:
             return x_odom, y_odom, th_odom
         
         scan_points = self.get_scan_points(ranges, x_odom, y_odom, th_odom)
         if len(scan_points) < 15:
             return x_odom, y_odom, th_odom
         
-        best_score = -1.0
-        best_dx, best_dy, best_dth = 0.0, 0.0, 0.0
+        # All 27 (dx, dy, dth) candidates in the same order as the old nested loops
+        offsets = np.array([-0.05, 0.0, 0.05])
+        dx, dy, dth = [o.ravel() for o in np.meshgrid(offsets, offsets, offsets, indexing="ij")]
+        cos_dth = np.cos(dth)[:, None]
+        sin_dth = np.sin(dth)[:, None]
+
+        # Rotate the scan about the odometry pose and shift it, one row per candidate
+        px_rel = scan_points[:, 0][None, :] - x_odom
+        py_rel = scan_points[:, 1][None, :] - y_odom
+        px_rot = px_rel * cos_dth - py_rel * sin_dth + (x_odom + dx)[:, None]
+        py_rot = px_rel * sin_dth + py_rel * cos_dth + (y_odom + dy)[:, None]
+
+        mx = np.rint(px_rot * self.RESOLUTION).astype(np.int64) + self.MAP_W // 2
+        my = np.rint(py_rot * self.RESOLUTION).astype(np.int64) + self.MAP_H // 2
+        score = self.likelihood.field[mx, my].mean(axis=1)
+        best = int(np.argmax(score))
         
-        for dx in [-0.05, 0.0, 0.05]:
-            for dy in [-0.05, 0.0, 0.05]:
-                for dth in [-0.05, 0.0, 0.05]:  
-                    x_test = x_odom + dx
-                    y_test = y_odom + dy
-                    th_test = th_odom + dth
-                    
-                    score = 0.0
-                    valid = 0
-                    
-                    for px, py in scan_points:
-                        px_rel = px - x_odom
-                        py_rel = py - y_odom
-                        cos_dth = math.cos(dth)
-                        sin_dth = math.sin(dth)
-                        px_rot = px_rel * cos_dth - py_rel * sin_dth + x_test
-                        py_rot = px_rel * sin_dth + py_rel * cos_dth + y_test
-                        
-                        mx, my = self.world_to_map(px_rot, py_rot)
-                        if 0 <= mx < self.MAP_W and 0 <= my < self.MAP_H:
-                            occ = self.logodds_to_prob(self.grid[mx, my])
-                            score += occ
-                            valid += 1
-                    
-                    if valid > 0:
-                        score /= valid
-                        if score > best_score:
-                            best_score = score
-                            best_dx, best_dy, best_dth = dx, dy, dth
-        
-        if best_score > 0.5:
-            return x_odom + best_dx, y_odom + best_dy, th_odom + best_dth
+        if score[best] > 0.5:
+            return x_odom + float(dx[best]), y_odom + float(dy[best]), th_odom + float(dth[best])
         
         return x_odom, y_odom, th_odom
 
-    def detect_stuck(self, ranges, d, dth):
-        if ranges is None or abs(d) < 0.001:
-            return False
-        
-        very_close = np.sum((ranges > 0.05) & (ranges < 0.12))
-        
-        if very_close > self.lidar_res * 0.15:
-            if self.prev_ranges is not None and abs(d) > 0.003:
-                valid_mask = (ranges > 0.05) & (ranges < self.lidar_max * 0.9) & \
-                            (self.prev_ranges > 0.05) & (self.prev_ranges < self.lidar_max * 0.9)
-                
-                if np.sum(valid_mask) > 20:
-                    range_change = np.mean(np.abs(ranges[valid_mask] - self.prev_ranges[valid_mask]))
-                    
-                    if range_change < 0.015:
-                        return True
-        
-        return False
-    
-    def plot_survivors(self):
-        
-        coords = detection.coords
-    
-        if not coords:
-            return
-
-        # For each coordinate from detection.coords
-        for x, z in coords:
-            is_duplicate = False
-            for sx, sz in self.survivors:
-                distance = math.sqrt((x - sx)**2 + (z - sz)**2)
-                if distance < 0.3:
-                    is_duplicate = True
+    def refine_pose(self, ranges, x, y, th, iterations=10):
+        # Gauss-Newton on sum (1 - likelihood)^2 over the scan points, from (x, y, th)
+        # Returns the refined pose and its mean likelihood, or the input pose if it got worse
+        if self.known_cells < 200:
+            return x, y, th, 0.0
+        points = self.get_scan_points(ranges, x, y, th)
+        if len(points) < 15:
+            return x, y, th, 0.0
+
+        qx = points[:, 0] - x
+        qy = points[:, 1] - y
+        pose = np.zeros(3)
+        damping = 1e-3
+
+        def residuals(p):
+            c, s = math.cos(p[2]), math.sin(p[2])
+            rx = c * qx - s * qy
+            ry = s * qx + c * qy
+            value, gx, gy = self.likelihood.lookup(x + p[0] + rx, y + p[1] + ry)
+            jac = np.column_stack((gx, gy, -gx * ry + gy * rx))
+            return 1.0 - value, -jac
+
+        res, jac = residuals(pose)
+        start_cost = cost = float(res @ res)
+        for _ in range(iterations):
+            hessian = jac.T @ jac
+            step = np.linalg.solve(hessian + damping * (np.diag(np.diag(hessian)) + np.eye(3) * 1e-6),
+                                   -jac.T @ res)
+            new_res, new_jac = residuals(pose + step)
+            new_cost = float(new_res @ new_res)
+            if new_cost < cost:
+                pose = pose + step
+                res, jac, cost = new_res, new_jac, new_cost
+                damping *= 0.1
+                if abs(step[0]) + abs(step[1]) < 1e-4 and abs(step[2]) < 1e-4:
                     break
+            else:
+                damping *= 10.0
 
-            if not is_duplicate:
-                self.survivors.append((x, -z))
+        if cost >= start_cost:
+            return x, y, th, 1.0 - math.sqrt(start_cost / len(res))
+        return (x + float(pose[0]), y + float(pose[1]), self.wrap_angle(th + float(pose[2])),
+                float(np.mean(1.0 - res)))
+
+    def plot_survivors(self):
+        # Only the survivors added or moved since the last update; the map mirrors the navigation frame
+        if self.registry is None:
+            return
+        self.registry_cursor, changes = self.registry.changes(self.registry_cursor)
+        for kind, survivor in changes:
+            if kind == "reset":
+                self.survivors = {}
+            else:
+                self.survivors[survivor.id] = (survivor.x, -survivor.y)
 
     def update_pose(self, ranges=None):
-        xz, xc, xv = self.imu.getRollPitchYaw()
-        if math.isnan(xv):
+        # The estimator has predicted this step's pose from the encoders and IMU;
+        # every SCAN_MATCH_INTERVAL steps a scan match is added as a correction
+        if self.own_estimator:
+            self.estimator.step()
+        if math.isnan(self.sensors.yaw):
             return False
 
-        yaw = -xv
-
-        l = self.left_enc.getValue()
-        r = self.right_enc.getValue()
-        dl = (l - self.last_l) * self.WHEEL_RADIUS
-        dr = (r - self.last_r) * self.WHEEL_RADIUS
-        self.last_l, self.last_r = l, r
+        x_odom, y_odom, th_odom = self.estimator.map_pose()
 
-        d = 0.5 * (dl + dr)
-        dth = (dr - dl) / self.WHEEL_BASE
-
-        is_stuck = self.detect_stuck(ranges, d, dth)
-        
-        if is_stuck:
-            self.stuck_counter += 1
-        else:
-            self.stuck_counter = max(0, self.stuck_counter - 1)
-        
-        if self.stuck_counter > self.STUCK_THRESHOLD:
-            d = 0.0
-            dth = 0.0
-
-        self.th = yaw
-        x_odom = self.x + d * math.cos(self.th + 0.5 * dth)
-        y_odom = self.y + d * math.sin(self.th + 0.5 * dth)
-        th_odom = self.th
-        
         if self.USE_SCAN_MATCHING and ranges is not None:
             self.scan_match_counter += 1
             
             if self.scan_match_counter >= self.SCAN_MATCH_INTERVAL:
-                x_corrected, y_corrected, th_corrected = self.simple_scan_match(
-                    ranges, x_odom, y_odom, th_odom
-                )
+                if self.USE_CORRELATIVE_MATCHING:
+                    x_corrected, y_corrected, th_corrected, _ = self.correlative_matcher.match(
+                        ranges, x_odom, y_odom, th_odom
+                    )
+                    max_correction = self.correlative_matcher.linear_window * math.sqrt(2.0) + 1e-6
+                else:
+                    x_corrected, y_corrected, th_corrected = self.simple_scan_match(
+                        ranges, x_odom, y_odom, th_odom
+                    )
+                    max_correction = 0.10
+
+                if self.USE_POSE_REFINEMENT:
+                    x_corrected, y_corrected, th_corrected, _ = self.refine_pose(
+                        ranges, x_corrected, y_corrected, th_corrected
+                    )
                 
                 dx = x_corrected - x_odom
                 dy = y_corrected - y_odom
-                dth_corr = self.wrap_angle(th_corrected - th_odom)
                 correction_dist = math.sqrt(dx**2 + dy**2)
                 
-                if correction_dist < 0.10:  
-                    blend = 0.85  
-                    self.x = x_odom + (1 - blend) * dx
-                    self.y = y_odom + (1 - blend) * dy
-                    self.th = self.wrap_angle(th_odom + (1 - blend) * dth_corr)
-                else:
-                    self.x = x_odom
-                    self.y = y_odom
-                    self.th = th_odom
+                if correction_dist < max_correction:  
+                    self.estimator.correct_map_pose(x_corrected, y_corrected, th_corrected,
+                                                    self.SCAN_SIGMA_XY, self.SCAN_SIGMA_TH)
                 
                 self.scan_match_counter = 0
-            else:
-                self.x = x_odom
-                self.y = y_odom
-                self.th = th_odom
-        else:
-            self.x = x_odom
-            self.y = y_odom
-            self.th = th_odom
-
-        if ranges is not None:
-            self.prev_ranges = ranges.copy()
-
-        if not (math.isfinite(self.x) and math.isfinite(self.y) and math.isfinite(self.th)):
-            self.x = self.y = 0.0
-            self.th = yaw
-            self.stuck_counter = 0
-            return False
 
+        self.x, self.y, self.th = self.estimator.map_pose()
         return True
 
     def get_pose(self):
         return self.x, self.y, self.th
 
     def draw_map(self):
-        self.display.setColor(0x000000)
-        self.display.fillRectangle(0, 0, self.MAP_W, self.MAP_H)
- 
-        # Draw obstacles (blue)
-        self.display.setColor(0x0000FF)
-        for x in range(0, self.MAP_W):
-            for y in range(0, self.MAP_H):
-                if self.grid[x, y] > 0.4:
-                    self.display.drawPixel(x, y)
-
-        # Draw robot (red/yellow if stuck)
-        rx, ry = self.world_to_map(self.x, self.y)
-        if 0 <= rx < self.MAP_W and 0 <= ry < self.MAP_H:
-            if self.stuck_counter > self.STUCK_THRESHOLD:
-                self.display.setColor(0xFFFF00)
-            else:
-                self.display.setColor(0xFF0000)
-            self.display.fillRectangle(rx - 1, ry - 1, 2, 2)
-        
-        # Draw survivors (green)
-        self.display.setColor(0x00FF00) 
-        for sx, sz in self.survivors:
-            mx, my = self.world_to_map(sx, sz)
-            
-            if 0 <= mx < self.MAP_W and 0 <= my < self.MAP_H:
-                self.display.fillRectangle(mx - 1, my - 1, 3, 3)
-            else:
-                print("Survivor out of bounds")
+        # Pushes changed map tiles and redraws the markers at the renderer's own rate
+        self.renderer.render()
        
     def update(self):
-        ranges = np.array(self.lidar.getRangeImage(), dtype=np.float32)
-        ranges = np.clip(ranges, self.lidar_min, self.lidar_max)
+        if self.own_sensors:
+            self.sensors.read()
+        ranges = self.sensors.clipped
         
         if not self.update_pose(ranges):
             return
@@ -322,60 +418,364 @@ class Mapping:
         robot_mx, robot_my = self.world_to_map(self.x, self.y)
         
         # Clear robot footprint 
-        for dx in range(-1, 2):
-            for dy in range(-1, 2):
-                clear_x = robot_mx + dx
-                clear_y = robot_my + dy
-                if 0 <= clear_x < self.MAP_W and 0 <= clear_y < self.MAP_H:
-                    if self.grid[clear_x, clear_y] < 4.0: 
-                        self.grid[clear_x, clear_y] = min(self.grid[clear_x, clear_y], -2.0)  
-                        self.occ_hits[clear_x, clear_y] = 0
+        clear_x, clear_y = np.meshgrid(np.arange(robot_mx - 1, robot_mx + 2),
+                                       np.arange(robot_my - 1, robot_my + 2), indexing="ij")
+        clear_x = clear_x.ravel()
+        clear_y = clear_y.ravel()
+        clear = self.grid[clear_x, clear_y] < 4.0
+        clear_x = clear_x[clear]
+        clear_y = clear_y[clear]
+        self.set_cells(clear_x, clear_y, np.minimum(self.grid[clear_x, clear_y], -2.0))
+        self.occ_hits[clear_x, clear_y] = 0
 
         # Process lidar rays
-        beam_step = 3  
-        for i in range(0, self.lidar_res, beam_step):
-            r_val = float(ranges[i])
-            if not np.isfinite(r_val) or r_val <= 0.05:
-                continue
+        free_x, free_y, hit_x, hit_y, free_ray = self.cast_rays(ranges, robot_mx, robot_my)
+        self.integrate_rays(free_x, free_y, hit_x, hit_y, free_ray)
 
-            beam_angle = (i / (self.lidar_res - 1)) * self.lidar_fov - (self.lidar_fov / 2.0)
-            world_angle = self.th + beam_angle
-            hit = (r_val < self.NO_HIT_THRESH)
-
-            if hit:
-                wx = self.x + r_val * math.cos(world_angle)
-                wy = self.y + r_val * math.sin(world_angle)
-                mx, my = self.world_to_map(wx, wy)
-                
-                if mx < 0 or my < 0 or mx >= self.MAP_W or my >= self.MAP_H:
-                    continue
-                
-                ray_cells = self.trace_ray(robot_mx, robot_my, mx, my)
-                for j, (cell_x, cell_y) in enumerate(ray_cells):
-                    if 0 <= cell_x < self.MAP_W and 0 <= cell_y < self.MAP_H:
-                        if j < len(ray_cells) - 1:
-                            if self.grid[cell_x, cell_y] < 4.0:  
-                                self.grid[cell_x, cell_y] = self.range(
-                                    self.grid[cell_x, cell_y] + self.L_FREE,
-                                    self.LOG_ODDS_MIN,
-                                    self.LOG_ODDS_MAX
-                                )
-                        else:
-                            if self.occ_hits[cell_x, cell_y] < 65535:
-                                self.occ_hits[cell_x, cell_y] += 1
-                            
-                            if self.occ_hits[cell_x, cell_y] >= self.OCC_CONFIRM:
-                                self.grid[cell_x, cell_y] = self.range(
-                                    self.grid[cell_x, cell_y] + self.L_OCC,
-                                    self.LOG_ODDS_MIN,
-                                    self.LOG_ODDS_MAX
-                                )
-
-        weak_noise = (self.grid > 0.1) & (self.grid < 2.0)  
-        self.grid[weak_noise] *= 0.98  
-        
-        medium_uncertain = (self.grid >= 2.0) & (self.grid < 4.0)  
-        self.grid[medium_uncertain] *= 0.995  
+        self.decay()
         
+        self.likelihood.update(self.flipped_cells)
+        self.renderer.mark_cells(self.flipped_cells)
+        for listener in self.flip_listeners:
+            listener(self.flipped_cells)
+        self.flipped_cells = []
+        for listener in self.change_listeners:
+            listener(self.changed_cells)
+        self.changed_cells = []
+
         self.draw_map()
         self.map_data = self.grid
+
+
+class RayTemplates:
+    # Relative cells crossed by trace_ray from a robot cell to each endpoint cell
+    # within lidar range. Both ends of a ray are whole cells, so its cells only
+    # depend on the endpoint's offset (dx, dy) and one table serves every beam,
+    # range, heading and robot position. Row (dx + radius) * width + dy + radius
+    # holds the offsets of the max(|dx|, |dy|) + 1 points trace_ray visits,
+    # padded to radius + 1. Offsets are int8 while the radius fits, int16 beyond.
+    # The cache file keeps the parameters it was built with and is rebuilt when
+    # any of them differs; bump VERSION when build() changes.
+    VERSION = 1
+
+    def __init__(self, mapping, cache_dir=None):
+        self.radius = int(math.ceil(mapping.lidar_max * mapping.RESOLUTION)) + 1
+        self.width = 2 * self.radius + 1
+        self.rows = self.width * self.width
+        self.dtype = np.int8 if self.radius <= np.iinfo(np.int8).max else np.int16
+        if self.radius > np.iinfo(self.dtype).max:
+            raise ValueError(f"ray template radius {self.radius} does not fit int16 offsets")
+        params = np.array([self.VERSION, self.radius, mapping.RESOLUTION, mapping.lidar_max], dtype=np.float64)
+        self.source = "cache"
+
+        if cache_dir is None:
+            cache_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(cache_dir, f"ray_templates_r{self.radius}.npz")
+        self.offsets_x = self.offsets_y = None
+        try:
+            with np.load(path) as cached:
+                if (np.array_equal(cached["params"], params)
+                        and cached["offsets_x"].shape == (self.rows, self.radius + 1)
+                        and cached["offsets_x"].dtype == self.dtype):
+                    self.offsets_x = cached["offsets_x"]
+                    self.offsets_y = cached["offsets_y"]
+        except (OSError, KeyError, ValueError):
+            pass
+        if self.offsets_x is None:
+            self.build()
+            try:
+                np.savez(path, params=params, offsets_x=self.offsets_x, offsets_y=self.offsets_y)
+            except OSError as e:
+                telemetry.warning("mapping", "could not cache ray templates", error=e)
+
+    @property
+    def nbytes(self):
+        return self.offsets_x.nbytes + self.offsets_y.nbytes
+
+    def build(self):
+        # Point k of a ray lies k * d / steps cells from the robot. It is rounded
+        # with exact integer arithmetic; points exactly half-way between two cells
+        # go to the one nearer the robot, where trace_ray's float steps land on
+        # either side depending on rounding noise.
+        self.source = "built"
+        r = self.radius
+        dx, dy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1), indexing="ij")
+        steps = (np.maximum(np.abs(dx), np.abs(dy)) + 1).reshape(-1, 1)
+        k = np.arange(r + 1)
+
+        def offsets(d):
+            num = k * np.abs(d).reshape(-1, 1)
+            q = num // steps
+            q += 2 * (num - q * steps) > steps
+            return (np.sign(d).reshape(-1, 1) * q).astype(self.dtype)
+
+        self.offsets_x = offsets(dx)
+        self.offsets_y = offsets(dy)
+
+    def lookup(self, dx, dy):
+        # Offsets (n, max_steps) of the rays to endpoint offsets dx, dy and their step counts
+        row = (dx + self.radius) * self.width + dy + self.radius
+        steps = np.maximum(np.abs(dx), np.abs(dy)) + 1
+        max_steps = int(steps.max())
+        return self.offsets_x[row, :max_steps], self.offsets_y[row, :max_steps], steps
+
+
+class CorrelativeScanMatcher:
+    # Exhaustive correlative scan matching over a wide (x, y, theta) window,
+    # made fast with branch-and-bound over max-pooled occupancy grids.
+    # Returns the same best pose as scoring every candidate on the finest grid.
+    def __init__(self, mapping, linear_window=0.5, angular_window=math.radians(20.0),
+                 angular_resolution=None, min_score=0.5):
+        self.mapping = mapping
+        self.linear_window = linear_window      # +/- metres searched in x and y
+        self.angular_window = angular_window    # +/- radians searched in theta
+        # Default step moves the furthest beam endpoint by about one cell
+        if angular_resolution is None:
+            max_r = mapping.lidar_max * 0.95
+            cell = 1.0 / mapping.RESOLUTION
+            angular_resolution = math.acos(1.0 - cell * cell / (2.0 * max_r * max_r))
+        self.angular_resolution = angular_resolution
+        self.min_score = min_score              # mean cell probability needed to accept a match
+        self.nodes_scored = 0                   # Candidates evaluated in the last match
+
+    def build_pyramid(self, window, depth):
+        # Level h holds, for every cell, the max over the 2^h x 2^h block starting there
+        levels = [window]
+        for h in range(1, depth + 1):
+            prev = levels[-1]
+            half = 1 << (h - 1)
+            pooled = prev.copy()
+            pooled[:-half, :] = np.maximum(prev[:-half, :], prev[half:, :])
+            pooled[:, :-half] = np.maximum(pooled[:, :-half], pooled[:, half:])
+            levels.append(pooled)
+        return levels
+
+    def match(self, ranges, x, y, th):
+        m = self.mapping
+        self.nodes_scored = 0
+        if m.known_cells < 200:
+            return x, y, th, 0.0
+
+        points = m.get_scan_points(ranges, x, y, th)
+        if len(points) < 15:
+            return x, y, th, 0.0
+
+        # Scan cells at the unshifted pose for every rotation, shape (rotations, points)
+        n_rot = int(math.ceil(self.angular_window / self.angular_resolution))
+        dths = np.arange(-n_rot, n_rot + 1) * self.angular_resolution
+        rel_x = points[:, 0] - x
+        rel_y = points[:, 1] - y
+        cos_t = np.cos(dths)[:, None]
+        sin_t = np.sin(dths)[:, None]
+        cells_x = np.rint((x + rel_x * cos_t - rel_y * sin_t) * m.RESOLUTION).astype(np.int64) + m.MAP_W // 2
+        cells_y = np.rint((y + rel_x * sin_t + rel_y * cos_t) * m.RESOLUTION).astype(np.int64) + m.MAP_H // 2
+
+        # Translations are whole cells in [-w, w]; the top level covers them in a few blocks
+        w = int(round(self.linear_window * m.RESOLUTION))
+        depth = max(0, (2 * w).bit_length())
+        top = 1 << depth
+
+        # Local window covering every lookup, so scoring needs no bounds checks
+        x0 = int(cells_x.min()) - w
+        y0 = int(cells_y.min()) - w
+        x1 = int(cells_x.max()) + w + top + 1
+        y1 = int(cells_y.max()) + w + top + 1
+        levels = self.build_pyramid(m.likelihood.field.window(x0, y0, x1, y1), depth)
+        cells_x = cells_x - x0
+        cells_y = cells_y - y0
+
+        # Score all top-level nodes at once
+        starts = np.arange(-w, w + 1, top)
+        rot, tx, ty = [a.ravel() for a in np.meshgrid(np.arange(len(dths)), starts, starts, indexing="ij")]
+        scores = self.score_nodes(levels[depth], cells_x, cells_y, rot, tx, ty)
+
+        best = [self.min_score * len(points), None]
+        self.search(levels, depth, cells_x, cells_y, w, rot, tx, ty, scores, best)
+
+        if best[1] is None:
+            return x, y, th, 0.0
+        r, bx, by = best[1]
+        return (x + bx / m.RESOLUTION, y + by / m.RESOLUTION, th + float(dths[r]),
+                best[0] / len(points))
+
+    def score_nodes(self, level, cells_x, cells_y, rot, tx, ty):
+        self.nodes_scored += len(rot)
+        return level[cells_x[rot] + tx[:, None], cells_y[rot] + ty[:, None]].sum(axis=1)
+
+    def search(self, levels, h, cells_x, cells_y, w, rot, tx, ty, scores, best):
+        # Depth-first, highest bound first; a bound at or below the best leaf prunes the rest
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] <= best[0]:
+                return
+            if h == 0:
+                best[0] = float(scores[i])
+                best[1] = (int(rot[i]), int(tx[i]), int(ty[i]))
+                continue
+            half = 1 << (h - 1)
+            ctx = tx[i] + np.array([0, half, 0, half])
+            cty = ty[i] + np.array([0, 0, half, half])
+            keep = (ctx <= w) & (cty <= w)
+            ctx = ctx[keep]
+            cty = cty[keep]
+            crot = np.full(len(ctx), rot[i])
+            child_scores = self.score_nodes(levels[h - 1], cells_x, cells_y, crot, ctx, cty)
+            self.search(levels, h - 1, cells_x, cells_y, w, crot, ctx, cty, child_scores, best)
+
+
+class LikelihoodField:
+    # Scan-scoring layer: exp(-d^2 / 2 sigma^2) of the distance d to the nearest
+    # obstacle cell, capped at max_dist. Only blocks around cells whose obstacle
+    # state flipped are recomputed, using obstacles within max_dist of the block.
+    def __init__(self, mapping, sigma=0.15, max_dist=0.5, block=16):
+        self.mapping = mapping
+        self.sigma = sigma
+        self.max_cells = int(math.ceil(max_dist * mapping.RESOLUTION))
+        self.block = block
+        self.dist = TiledGrid(np.float32, self.max_cells)
+        self.field = TiledGrid(np.float32, 0.0)
+        self.blocks_updated = 0                 # Blocks recomputed in the last update
+
+    def update(self, flipped_cells):
+        self.blocks_updated = 0
+        if not flipped_cells:
+            return
+        self.update_blocks(self.blocks_of(flipped_cells))
+
+    def blocks_of(self, flipped_cells):
+        # Packed keys of the blocks containing the given cells
+        cx = np.concatenate([c[0] for c in flipped_cells])
+        cy = np.concatenate([c[1] for c in flipped_cells])
+        return np.unique(pack_cells(cx // self.block, cy // self.block))
+
+    def update_blocks(self, blocks):
+        bx, by = unpack_cells(blocks)
+        for i in range(len(blocks)):
+            self.update_block(int(bx[i]) * self.block, int(by[i]) * self.block)
+        self.blocks_updated = len(blocks)
+
+    def update_block(self, x0, y0):
+        # A change can move distances up to max_cells away, so refresh the block plus
+        # that margin, reading obstacles from a further max_cells around it
+        m = self.mapping
+        reach = self.max_cells
+        ox0, oy0 = x0 - reach, y0 - reach
+        ox1, oy1 = x0 + self.block + reach, y0 + self.block + reach
+        free = m.grid.window(ox0 - reach, oy0 - reach, ox1 + reach, oy1 + reach) <= m.OCC_THRESH
+        dist = cv2.distanceTransform(free.astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        dist = np.minimum(dist[reach:-reach, reach:-reach], self.max_cells)
+        self.dist.set_window(ox0, oy0, dist)
+        metres = dist / m.RESOLUTION
+        field = np.exp(-metres * metres / (2.0 * self.sigma * self.sigma))
+        field[dist >= self.max_cells] = 0.0
+        self.field.set_window(ox0, oy0, field)
+
+    def lookup(self, wx, wy):
+        # Bilinear likelihood at world points, with its gradient in world units
+        m = self.mapping
+        u = np.asarray(wx) * m.RESOLUTION + m.MAP_W // 2
+        v = np.asarray(wy) * m.RESOLUTION + m.MAP_H // 2
+        u0 = np.floor(u).astype(np.int64)
+        v0 = np.floor(v).astype(np.int64)
+        fu = u - u0
+        fv = v - v0
+        f00 = self.field[u0, v0]
+        f10 = self.field[u0 + 1, v0]
+        f01 = self.field[u0, v0 + 1]
+        f11 = self.field[u0 + 1, v0 + 1]
+        value = (f00 * (1 - fu) * (1 - fv) + f10 * fu * (1 - fv) +
+                 f01 * (1 - fu) * fv + f11 * fu * fv)
+        du = (f10 - f00) * (1 - fv) + (f11 - f01) * fv
+        dv = (f01 - f00) * (1 - fu) + (f11 - f10) * fu
+        return value, du * m.RESOLUTION, dv * m.RESOLUTION
+
+
+class MapRenderer:
+    # Keeps an RGBA image of the displayed part of the map (cells [0, MAP_W) x
+    # [0, MAP_H); obstacles blue, everything else black) and pastes only the
+    # tiles whose cells changed since the last frame. Robot and
+    # survivor markers are drawn on top; the tiles under last frame's markers are
+    # repasted to erase them, so the static map is never redrawn as a whole.
+    def __init__(self, mapping, refresh_period_ms=160, tile=16):
+        self.mapping = mapping
+        self.display = mapping.display
+        self.tile = tile
+        self.set_refresh_period(refresh_period_ms)
+        self.steps_since_render = self.refresh_steps
+        self.frame = np.zeros((mapping.MAP_H, mapping.MAP_W, 4), dtype=np.uint8)
+        self.frame[:, :, 3] = 255
+        self.dirty = np.ones((-(-mapping.MAP_W // tile), -(-mapping.MAP_H // tile)), dtype=bool)
+        self.markers = []                       # (x, y, w, h) drawn in the last frame
+        self.tiles_pasted = 0                   # Tiles pushed in the last frame
+
+    def set_refresh_period(self, refresh_period_ms):
+        # Frames are rendered every refresh_steps calls, independent of the mapping rate
+        self.refresh_steps = max(1, int(round(refresh_period_ms / self.mapping.TIME_STEP)))
+
+    def mark_cells(self, flipped_cells):
+        m = self.mapping
+        for cx, cy in flipped_cells:
+            shown = (cx >= 0) & (cy >= 0) & (cx < m.MAP_W) & (cy < m.MAP_H)
+            self.dirty[cx[shown] // self.tile, cy[shown] // self.tile] = True
+
+    def mark_rect(self, x, y, w, h):
+        m = self.mapping
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, m.MAP_W), min(y + h, m.MAP_H)
+        if x0 < x1 and y0 < y1:
+            self.dirty[x0 // self.tile:(x1 - 1) // self.tile + 1,
+                       y0 // self.tile:(y1 - 1) // self.tile + 1] = True
+
+    def render(self, force=False):
+        self.steps_since_render += 1
+        if not force and self.steps_since_render < self.refresh_steps:
+            return False
+        self.steps_since_render = 0
+
+        for rect in self.markers:
+            self.mark_rect(*rect)
+        tiles_x, tiles_y = np.nonzero(self.dirty)
+        m = self.mapping
+        if 2 * len(tiles_x) > self.dirty.size:
+            # Most of the map changed, one paste is cheaper than many
+            self.paste(0, 0, m.MAP_W, m.MAP_H)
+        else:
+            for tx, ty in zip(tiles_x, tiles_y):
+                x0, y0 = int(tx) * self.tile, int(ty) * self.tile
+                self.paste(x0, y0, min(x0 + self.tile, m.MAP_W), min(y0 + self.tile, m.MAP_H))
+        self.tiles_pasted = len(tiles_x)
+        self.dirty[:] = False
+
+        self.draw_markers()
+        return True
+
+    def paste(self, x0, y0, x1, y1):
+        # Refresh frame[y0:y1, x0:x1] from the grid and push it to the display
+        m = self.mapping
+        occupied = m.grid.window(x0, y0, x1, y1).T > m.OCC_THRESH
+        region = self.frame[y0:y1, x0:x1]
+        region[:, :, 2] = np.where(occupied, 255, 0)
+        image = self.display.imageNew(region.tobytes(), self.display.RGBA, x1 - x0, y1 - y0)
+        self.display.imagePaste(image, x0, y0, False)
+        self.display.imageDelete(image)
+
+    def draw_markers(self):
+        m = self.mapping
+        self.markers = []
+
+        # Draw robot (red/yellow if stuck)
+        rx, ry = m.world_to_map(m.x, m.y)
+        if 0 <= rx < m.MAP_W and 0 <= ry < m.MAP_H:
+            if m.estimator.stuck:
+                self.display.setColor(0xFFFF00)
+            else:
+                self.display.setColor(0xFF0000)
+            self.display.fillRectangle(rx - 1, ry - 1, 2, 2)
+            self.markers.append((rx - 1, ry - 1, 2, 2))
+
+        # Draw survivors (green)
+        self.display.setColor(0x00FF00)
+        for sx, sz in m.survivors.values():
+            mx, my = m.world_to_map(sx, sz)
+            if 0 <= mx < m.MAP_W and 0 <= my < m.MAP_H:
+                self.display.fillRectangle(mx - 1, my - 1, 3, 3)
+                self.markers.append((mx - 1, my - 1, 3, 3))
@@ -2,17 +2,24 @@
 # Handles robot movement and obstacle avoidance
 
 import math
+import time
+import cv2
 import numpy as np
-
-# TurtleBot measurements
-# From https://emanual.robotis.com/docs/en/platform/turtlebot3/features/
-AXLE_LENGTH = 0.160
-WHEEL_RADIUS = 0.033
+import telemetry
+from sensors import SensorSnapshot
+from state_estimator import PoseEstimator, WHEEL_RADIUS, WHEEL_BASE
 
 class Navigation:
-    def __init__(self, robot, timestep):
+    # sensors and estimator are the SensorSnapshot and PoseEstimator shared with
+    # the other modules; without them, Navigation reads its own snapshot and
+    # steps its own estimator at the start of every move
+    def __init__(self, robot, timestep, sensors=None, estimator=None):
         self.robot = robot
         self.timestep = timestep
+        self.own_sensors = sensors is None
+        self.sensors = SensorSnapshot(robot, timestep, camera=False) if sensors is None else sensors
+        self.own_estimator = estimator is None
+        self.estimator = PoseEstimator(self.sensors) if estimator is None else estimator
 
         # Set tolerance for how close to goal
         self.goal_tolerance = 0.25
@@ -21,11 +28,9 @@ class Navigation:
         self.left_motor = robot.getDevice('left wheel motor')
         self.right_motor = robot.getDevice('right wheel motor')
 
-        # Get Lidar
-        self.lidar = robot.getDevice('LDS-01')
-        self.lidar.enable(timestep)
-        self.lidar_max = self.lidar.getMaxRange()
-        self.lidar_width = self.lidar.getHorizontalResolution()
+        # Lidar parameters
+        self.lidar_max = self.sensors.lidar_max
+        self.lidar_width = self.sensors.lidar_res
 
         # Set velocity
         self.left_motor.setPosition(float('inf'))
@@ -33,21 +38,6 @@ class Navigation:
         self.left_motor.setVelocity(0.0)
         self.right_motor.setVelocity(0.0)
 
-        # Get encoders
-        self.left_sensor = robot.getDevice('left wheel sensor')
-        self.right_sensor = robot.getDevice('right wheel sensor')
-        self.left_sensor.enable(timestep)
-        self.right_sensor.enable(timestep)
-
-        # Store previous angles
-        self.prev_left_angle = 0.0
-        self.prev_right_angle = 0.0
-
-        # Initialise robot pose
-        self.x = 0.0
-        self.y = 0.0
-        self.theta = 0.0
-
         # Controller values
         self.k_rho = 5.0
         self.k_alpha = 10
@@ -56,6 +46,10 @@ class Navigation:
         # Motor limits
         self.max_speed = 6.28
 
+        # Dynamic window local planner, used instead of goto_position when enabled
+        self.USE_DWA = True
+        self.dwa = DynamicWindow(self.sensors, self.max_speed, timestep)
+
         # Set goal and start position
         self.goal = [1.0, 0]
         self.start = (0.0, 0.0)
@@ -93,33 +87,30 @@ class Navigation:
         self.paused = False
         self.just_reset = 0
         self.goalreached = False
-        print("nav complete")
-
-    # Update odometry values from encoder increments
-    def update_odometry(self):
-        # Read current wheel rotation
-        left_angle = self.left_sensor.getValue()
-        right_angle = self.right_sensor.getValue()
-
-        # Compute wheel displacements
-        dl = (left_angle - self.prev_left_angle) * WHEEL_RADIUS
-        dr = (right_angle - self.prev_right_angle) * WHEEL_RADIUS
 
-        # Store current angles for next step
-        self.prev_left_angle = left_angle
-        self.prev_right_angle = right_angle
-
-        # Compute linear and angular displacement
-        dc = (dl + dr) / 2.0
-        dtheta = (dr - dl) / AXLE_LENGTH
-
-        # Update pose
-        self.x += dc * math.cos(self.theta + dtheta / 2.0)
-        self.y += dc * math.sin(self.theta + dtheta / 2.0)
-        self.theta += dtheta
-
-        # Normalise angle
-        self.theta = (self.theta + math.pi) % (2 * math.pi) - math.pi
+        # Grid path planner (planner.GridPlanner), set by main_controller. With a
+        # path the robot follows its waypoints; Bug2 takes over when there is none
+        # or the lidar sees an obstacle the map does not have yet
+        self.planner = None
+        self.path = None
+        self.planner_failed = False
+        self.waypoint_tolerance = 0.15
+        # Distance wall following covers before the planner is tried again
+        self.replan_distance = 0.3
+        telemetry.info("nav", "nav complete")
+
+    # Robot pose, as published by the shared estimator
+    @property
+    def x(self):
+        return self.estimator.x
+
+    @property
+    def y(self):
+        return self.estimator.y
+
+    @property
+    def theta(self):
+        return self.estimator.theta
 
     # Compute wheel speeds
     def goto_position(self, x_goal, y_goal, goal_theta=0):
@@ -152,20 +143,9 @@ class Navigation:
         return distance_to_line < self.mline_tolerance
 
     def obstacle_detected(self):
-        # Get lidar distance values
-        ranges = self.lidar.getRangeImage()
-
-        # Get central region
-        one_third = int(self.lidar_width / 3)
-        two_third = int(2 * self.lidar_width / 3)
-
-        # Get lidar values from this region
-        center_ranges = []
-        for i in range(one_third, two_third):
-            center_ranges.append(ranges[i])
-
-        # Find the closest detected object in the central region
-        closest_distance = min(center_ranges)
+        # Closest object in the central third of the scan, shared with path_clear
+        # and the telemetry through the sensor snapshot
+        closest_distance = self.sensors.front
 
         # If it's closer than the threshold, its an obstacle
         if closest_distance < self.obs_threshold:
@@ -174,40 +154,16 @@ class Navigation:
             return False
 
     def path_clear(self):
-        # Get lidar distances from full 360
-        ranges = self.lidar.getRangeImage()
-
-        # Get central region in front of robot
-        center_start = self.lidar_width // 3
-        center_end = 2 * self.lidar_width // 3
-        center_ranges = ranges[center_start:center_end]
-
         # Return true if closest obstacle ahead is further than clearance threshold
-        return min(center_ranges) > self.clearance_threshold
+        return self.sensors.front > self.clearance_threshold
 
     def wall_follow(self):
-        # Get lidar distances from full 360
-        ranges = self.lidar.getRangeImage()
         n = self.lidar_width
 
-        # Split ranges into regions
-        left_range = ranges[n // 4 : n // 2]
-        right_range = ranges[n // 2 : 3 * n // 4]
-        front_range = ranges[2 * n // 5 : 3 * n // 5]
-
-        # Find closest object in each region
-        if left_range:
-            closest_left = min(left_range)
-        else:
-            closest_left = self.lidar_max
-        if right_range:
-            closest_right = min(right_range)
-        else:
-            closest_right = self.lidar_max
-        if front_range:
-            closest_front = min(front_range)
-        else:
-            closest_front = self.lidar_max
+        # Find closest object in each region, lidar_max if a region is empty
+        closest_left = self.sensors.left_side
+        closest_right = self.sensors.right_side
+        closest_front = self.sensors.sector_min(2 * n // 5, 3 * n // 5)
 
         # Decide which wall to follow
         if self.follow_side is None:
@@ -259,7 +215,41 @@ class Navigation:
         dy = goal_y - self.y
         return math.sqrt(dx*dx + dy*dy)
 
-    # Main movement function, implements Bug2 logic
+    def plan_path(self):
+        # Update the planned path from the current pose, False when there is none
+        self.path = self.planner.plan((self.x, self.y), tuple(self.goal))
+        if self.path is None:
+            self.planner_failed = True
+            telemetry.info("nav.state", "No planned path -> Bug2")
+            return False
+        return True
+
+    def follow_path(self):
+        # Steer towards the first waypoint that is not yet reached
+        while len(self.path) > 1:
+            wx, wy = self.path[0]
+            if math.hypot(wx - self.x, wy - self.y) > self.waypoint_tolerance:
+                break
+            self.path.pop(0)
+        return self.steer_to(*self.path[0])
+
+    def steer_to(self, x_goal, y_goal):
+        # Wheel speeds towards a point: the dynamic window when enabled, None if
+        # it finds no collision-free arc; otherwise the proportional controller
+        if not self.USE_DWA:
+            v_left, v_right, rho = self.goto_position(x_goal, y_goal)
+            return v_left, v_right
+        dx = x_goal - self.x
+        dy = y_goal - self.y
+        c, s = math.cos(self.theta), math.sin(self.theta)
+        dt = self.timestep / 1000.0
+        best = self.dwa.plan(c * dx + s * dy, -s * dx + c * dy, self.estimator.d / dt, self.estimator.dth / dt)
+        if best is None:
+            return None
+        v, w = best
+        return (v - 0.5 * w * WHEEL_BASE) / WHEEL_RADIUS, (v + 0.5 * w * WHEEL_BASE) / WHEEL_RADIUS
+
+    # Main movement function, follows the planned path with Bug2 as fallback
     def move(self):
         
         # Check if we need to pause for the scan
@@ -267,32 +257,68 @@ class Navigation:
             self.left_motor.setVelocity(0)
             self.right_motor.setVelocity(0)
             return
-            
-        print(self.goal)
-        #Update pose
-        self.update_odometry()
-        print("Distance from goal", self.distance_to_goal())
+
+        if self.own_sensors:
+            self.sensors.read()
+        if self.own_estimator:
+            self.estimator.step()
+        telemetry.debug("nav.progress", "Distance from goal", goal=self.goal, distance=self.distance_to_goal())
         # Check if we have reached the goal
         if self.distance_to_goal() < self.goal_tolerance or (self.goalreached == True and self.distance_to_goal() < 3 * self.goal_tolerance):
             self.left_motor.setVelocity(0)
             self.right_motor.setVelocity(0)
-            print("Goal reached")
+            telemetry.info("nav.goal", "Goal reached", goal=self.goal)
             self.goalreached = False
             self.detect.reset_scan()
             self.reset()
             return
 
+        planned = False
+        if self.state == "GO_TO_GOAL" and self.planner is not None and not self.planner_failed:
+            if not self.obstacle_detected() and self.plan_path():
+                telemetry.info("nav.state", "Path planned -> FOLLOW_PATH")
+                self.state = "FOLLOW_PATH"
+                planned = True
+
+        if self.state == "FOLLOW_PATH":
+            # Unmapped obstacle straight ahead: leave it to Bug2 until the map catches up.
+            # Paths pass obstacles closely, so only the narrow front sector counts here;
+            # the dynamic window checks its arcs against the whole scan instead
+            n = self.lidar_width
+            wheels = None
+            if self.USE_DWA or self.sensors.sector_min(2 * n // 5, 3 * n // 5) >= self.obs_threshold:
+                # A path planned a moment ago for the switch to FOLLOW_PATH is still current
+                if planned or self.plan_path():
+                    wheels = self.follow_path()
+                else:
+                    self.state = "GO_TO_GOAL"
+                    self.compute_m_line()
+            if self.state == "FOLLOW_PATH":
+                if wheels is None:
+                    self.state = "WALL_FOLLOW"
+                    self.hit_point = (self.x, self.y)
+                    self.follow_side = None
+                    self.compute_m_line()
+                    telemetry.info("nav.state", "Hit obstacle -> WALL_FOLLOW")
+                    v_left, v_right = self.wall_follow()
+                else:
+                    v_left, v_right = wheels
+
         if self.state == "GO_TO_GOAL":
-            # If obstacle appears ahead, switch to wall follow state
-            if self.obstacle_detected():
+            # If obstacle appears ahead, or the dynamic window finds every arc
+            # colliding, switch to wall follow state
+            wheels = None
+            if not self.obstacle_detected():
+                wheels = self.steer_to(*self.goal)
+            if wheels is None:
                 self.state = "WALL_FOLLOW"
                 self.hit_point = (self.x, self.y)
                 self.follow_side = None
-                print("Hit obstacle -> WALL_FOLLOW")
+                telemetry.info("nav.state", "Hit obstacle -> WALL_FOLLOW")
                 v_left, v_right = self.wall_follow()
             else:
                 # Continue towards goal
-                v_left, v_right, rho = self.goto_position(*self.goal)
+                v_left, v_right = wheels
 
         elif self.state == "WALL_FOLLOW":
             # Compute distance from hit point to goal
@@ -311,10 +337,25 @@ class Navigation:
 
             current_distance = self.distance_to_goal()
 
-            if self.on_mline() and current_distance < distance_hit_to_goal and self.path_clear():
-                print("Back on M-line -> GO_TO_GOAL")
+            # With a planner, hand back to it once clear of the hit point
+            left_hit = self.hit_point is None or \
+                math.hypot(self.x - self.hit_point[0], self.y - self.hit_point[1]) > self.replan_distance
+            if self.planner is not None and not self.planner_failed and left_hit and self.path_clear():
+                telemetry.info("nav.state", "Clear of obstacle -> GO_TO_GOAL")
+                self.state = "GO_TO_GOAL"
+                self.follow_side = None
+                wheels = self.follow_path() if self.plan_path() else None
+                if wheels is not None:
+                    self.state = "FOLLOW_PATH"
+                    v_left, v_right = wheels
+                else:
+                    v_left, v_right, rho = self.goto_position(*self.goal)
+            elif self.on_mline() and current_distance < distance_hit_to_goal and self.path_clear():
+                telemetry.info("nav.state", "Back on M-line -> GO_TO_GOAL")
                 self.state = "GO_TO_GOAL"
                 self.follow_side = None
+                # Try the planner again now that the obstacle is mapped
+                self.planner_failed = False
                 v_left, v_right, rho = self.goto_position(*self.goal)
             else:
                 # Continue to follow obstacle
@@ -324,7 +365,7 @@ class Navigation:
         self.left_motor.setVelocity(v_left)
         self.right_motor.setVelocity(v_right)
 
-        print(f"[{self.state}] x={self.x:.3f}, y={self.y:.3f}, theta={self.theta:.3f}")
+        telemetry.debug("nav.pose", self.state, x=self.x, y=self.y, theta=self.theta)
     
     # Pause movement while scanning (Keep odometry tracking)
     def pause(self):
@@ -351,8 +392,10 @@ class Navigation:
             
         # Unpause and proceed towards goal
         self.state = "GO_TO_GOAL"
+        self.path = None
+        self.planner_failed = False
         self.paused = False
-        print(f"New goal set: {self.goal}. M-line defined.")
+        telemetry.info("nav.goal", "New goal set, M-line defined", goal=self.goal)
         
     # Compute new M-Line from new start position
     def compute_m_line(self):
@@ -370,5 +413,124 @@ class Navigation:
             self.b /= norm
             self.c /= norm
     
-        print(f"M-line updated: a={self.a:.3f}, b={self.b:.3f}, c={self.c:.3f}")
-      
\ No newline at end of file
+        telemetry.info("nav.goal", "M-line updated", a=self.a, b=self.b, c=self.c)
+
+
+class DynamicWindow:
+    # Dynamic window local planner: samples (v, w) pairs reachable from the
+    # current velocity within the wheel limits, rolls every pair out as an arc
+    # for a short horizon at once, and scores the arcs for clearance against
+    # the current lidar scan, heading towards the target and speed.
+    # Clearance comes from a distance transform of the scan drawn into a small
+    # grid around the robot, so checking an arc point is a single lookup.
+    def __init__(self, sensors, max_wheel_speed, timestep):
+        self.sensors = sensors
+        self.dt = timestep / 1000.0
+        self.v_max = max_wheel_speed * WHEEL_RADIUS
+        self.w_max = 2.0 * self.v_max / WHEEL_BASE
+
+        # Sampling: velocities the motors can reach within window_time
+        self.v_samples = 15
+        self.w_samples = 31
+        self.accel = 1.0                    # m/s^2
+        self.angular_accel = 6.0            # rad/s^2
+        self.window_time = 0.2
+
+        # Rollout
+        self.horizon = 1.2                  # s
+        self.rollout_steps = 12
+
+        # Scoring
+        self.robot_radius = 0.11
+        self.safety_margin = 0.03
+        self.clearance_cap = 0.4            # Clearance beyond this scores the same
+        self.heading_weight = 1.0
+        self.clearance_weight = 0.4
+        self.speed_weight = 0.3
+        self.k_slow = 1.0                   # Target speed per metre to the target
+
+        # Local distance map: cells of grid_resolution around the robot
+        self.grid_resolution = 0.025
+        self.grid_half = int(math.ceil((self.v_max * self.horizon + self.robot_radius + self.clearance_cap)
+                                       / self.grid_resolution)) + 1
+        size = 2 * self.grid_half + 1
+        self.grid = np.full((size, size), 255, dtype=np.uint8)
+
+        # Stats of the last plan() call
+        self.candidates = 0
+        self.admissible = 0
+        self.last_ms = 0.0
+
+    def sample(self, v_now, w_now):
+        v_lo = max(0.0, v_now - self.accel * self.window_time)
+        v_hi = min(self.v_max, v_now + self.accel * self.window_time)
+        w_lo = max(-self.w_max, w_now - self.angular_accel * self.window_time)
+        w_hi = min(self.w_max, w_now + self.angular_accel * self.window_time)
+        v, w = np.meshgrid(np.linspace(v_lo, v_hi, self.v_samples),
+                           np.linspace(w_lo, w_hi, self.w_samples), indexing="ij")
+        v = v.ravel()
+        w = w.ravel()
+        # Both wheels within their speed limit
+        feasible = np.abs(v) + 0.5 * WHEEL_BASE * np.abs(w) <= self.v_max + 1e-9
+        return v[feasible], w[feasible]
+
+    def rollout(self, v, w):
+        # Robot-frame poses along every arc, shape (candidates, rollout_steps)
+        t = np.linspace(self.horizon / self.rollout_steps, self.horizon, self.rollout_steps)
+        v = v[:, None]
+        w = w[:, None]
+        th = w * t
+        straight = np.abs(w) < 1e-6
+        safe_w = np.where(straight, 1.0, w)
+        x = np.where(straight, v * t, v / safe_w * np.sin(th))
+        y = np.where(straight, 0.0, v / safe_w * (1.0 - np.cos(th)))
+        return x, y, th
+
+    def distance_map(self):
+        # Distance (m) from every local grid cell to the nearest scan point
+        s = self.sensors
+        valid = s.valid
+        r = s.ranges[valid]
+        # Beam angles are clockwise, the robot frame here is counter-clockwise
+        a = -s.beam_angles[valid]
+        gx = np.rint(r * np.cos(a) / self.grid_resolution).astype(np.int64) + self.grid_half
+        gy = np.rint(r * np.sin(a) / self.grid_resolution).astype(np.int64) + self.grid_half
+        n = self.grid.shape[0]
+        inside = (gx >= 0) & (gx < n) & (gy >= 0) & (gy < n)
+        self.grid.fill(255)
+        self.grid[gx[inside], gy[inside]] = 0
+        return cv2.distanceTransform(self.grid, cv2.DIST_L2, cv2.DIST_MASK_PRECISE) * self.grid_resolution
+
+    def plan(self, target_x, target_y, v_now, w_now):
+        # Best (v, w) towards the target given in the robot frame, None when
+        # every arc collides
+        start = time.perf_counter()
+        v, w = self.sample(v_now, w_now)
+        x, y, th = self.rollout(v, w)
+
+        dist = self.distance_map()
+        n = dist.shape[0]
+        gx = np.clip(np.rint(x / self.grid_resolution).astype(np.int64) + self.grid_half, 0, n - 1)
+        gy = np.clip(np.rint(y / self.grid_resolution).astype(np.int64) + self.grid_half, 0, n - 1)
+        clearance = dist[gx, gy].min(axis=1) - self.robot_radius
+        admissible = clearance > self.safety_margin
+
+        # Heading from the end of each arc towards the target
+        bearing = np.arctan2(target_y - y[:, -1], target_x - x[:, -1]) - th[:, -1]
+        bearing = np.abs((bearing + np.pi) % (2.0 * np.pi) - np.pi)
+        heading = 1.0 - bearing / np.pi
+        # Speed: as fast as allowed, slowing down towards the target
+        v_target = min(self.v_max, self.k_slow * math.hypot(target_x, target_y))
+        speed = 1.0 - np.abs(v - v_target) / self.v_max
+        score = (self.heading_weight * heading
+                 + self.clearance_weight * np.minimum(clearance, self.clearance_cap) / self.clearance_cap
+                 + self.speed_weight * speed)
+        score[~admissible] = -np.inf
+
+        self.candidates = len(v)
+        self.admissible = int(np.count_nonzero(admissible))
+        self.last_ms = (time.perf_counter() - start) * 1000.0
+        if self.admissible == 0:
+            return None
+        best = int(np.argmax(score))
+        return float(v[best]), float(w[best])
@@ -0,0 +1,380 @@
+# planner.py
+# Shortest collision-free paths on the Mapping occupancy grid with D* Lite
+#
+# The search runs from the goal towards the robot, so when the robot moves only
+# the heuristic offset (km) changes, and when cells change after a scan only the
+# part of the search they affect is repaired instead of planning from scratch.
+# Cells within inflation_radius of an obstacle (from the distance field) are
+# blocked, unknown cells are assumed free. Poses and waypoints are in the
+# navigation frame (the map frame mirrored across the x axis, see
+# state_estimator.py).
+
+import heapq
+import math
+import time
+import numpy as np
+
+# Step costs in tenths of a cell, integers so that equal path costs compare equal
+STRAIGHT = 10
+DIAGONAL = 14
+INF = float("inf")
+
+
+class GridPlanner:
+    def __init__(self, field, inflation_radius=0.3, goal_radius=0.35, margin=3.0, max_expansions=50000):
+        # field is the distance_field.DistanceField of the map to plan on
+        if inflation_radius >= field.max_distance:
+            raise ValueError("inflation_radius must be below the distance field's max_distance")
+        self.field = field
+        self.mapping = field.mapping
+        self.resolution = self.mapping.RESOLUTION
+        self.inflation_cells = inflation_radius * self.resolution
+        self.goal_cells = int(math.ceil(goal_radius * self.resolution))
+        self.margin = int(math.ceil(margin * self.resolution))
+        self.max_expansions = max_expansions
+        self.changed = []                       # Cells whose blocked state changed since the last plan
+
+        # Search state over the box [x0, x0 + W) x [y0, y0 + H) of map cells,
+        # cells are flat indices (x - x0) * H + (y - y0)
+        self.goal = None
+        self.start = None
+        self.start_ij = None
+        self.box = None
+        self.margin_used = self.margin
+        self.goal_zone = None
+        self.steps = None                       # Flat index offset and cost of the 8 neighbours
+        self.blocked = None
+        self.g = None
+        self.rhs = None
+        self.queue = []
+        self.queued = {}
+        self.km = 0
+        self.path = None
+
+        # Stats of the last plan() call
+        self.expanded = 0
+        self.last_ms = 0.0
+        self.repaired = False
+
+        field.listeners.append(self.on_distance_changed)
+
+    # --- Map changes -----------------------------------------------------------
+
+    def on_distance_changed(self, cx, cy, old, new):
+        # Cells within inflation_cells of an obstacle are blocked
+        r = self.inflation_cells
+        flips = (old <= r) != (new <= r)
+        if flips.any():
+            self.changed.append((cx[flips], cy[flips]))
+
+    # --- Coordinates -------------------------------------------------------------
+
+    def to_cell(self, x, y):
+        return self.mapping.world_to_map(x, -y)
+
+    def to_world(self, mx, my):
+        m = self.mapping
+        return (mx - m.MAP_W // 2) / m.RESOLUTION, -(my - m.MAP_H // 2) / m.RESOLUTION
+
+    def index(self, mx, my):
+        # Flat index of a cell inside the box, None outside it or on its border
+        x0, y0, w, h = self.box
+        if 0 < mx - x0 < w - 1 and 0 < my - y0 < h - 1:
+            return (mx - x0) * h + (my - y0)
+        return None
+
+    def cell(self, s):
+        x0, y0, w, h = self.box
+        i, j = divmod(s, h)
+        return i + x0, j + y0
+
+    # --- D* Lite -------------------------------------------------------------------
+
+    def heuristic(self, a, b):
+        h = self.box[3]
+        ax, ay = divmod(a, h)
+        bx, by = divmod(b, h)
+        dx = abs(ax - bx)
+        dy = abs(ay - by)
+        return STRAIGHT * max(dx, dy) + (DIAGONAL - STRAIGHT) * min(dx, dy)
+
+    def set_start(self, s):
+        self.start = s
+        self.start_ij = divmod(s, self.box[3])
+
+    def passable(self, s):
+        return not self.blocked[s] or s == self.start
+
+    def key(self, s):
+        v = min(self.g[s], self.rhs[s])
+        i, j = divmod(s, self.box[3])
+        si, sj = self.start_ij
+        dx = abs(i - si)
+        dy = abs(j - sj)
+        h = STRAIGHT * dx + (DIAGONAL - STRAIGHT) * dy if dx > dy else STRAIGHT * dy + (DIAGONAL - STRAIGHT) * dx
+        return (v + h + self.km, v)
+
+    def push(self, s):
+        k = self.key(s)
+        self.queued[s] = k
+        heapq.heappush(self.queue, (k, s))
+
+    def requeue(self, s):
+        if self.g[s] != self.rhs[s]:
+            self.push(s)
+        else:
+            self.queued.pop(s, None)
+
+    def update_vertex(self, s):
+        # rhs from scratch: the cheapest way to the goal through a neighbour
+        if s != self.goal:
+            best = INF
+            blocked = self.blocked
+            start = self.start
+            if not blocked[s] or s == start:
+                g = self.g
+                for d, c in self.steps:
+                    n = s + d
+                    if not blocked[n] or n == start:
+                        v = g[n] + c
+                        if v < best:
+                            best = v
+            self.rhs[s] = best
+        self.requeue(s)
+
+    def top_key(self):
+        # Smallest key still current, dropping entries superseded by later pushes
+        while self.queue:
+            k, s = self.queue[0]
+            if self.queued.get(s) == k:
+                return k, s
+            heapq.heappop(self.queue)
+        return (INF, INF), None
+
+    def compute_shortest_path(self):
+        g, rhs = self.g, self.rhs
+        while True:
+            k_old, u = self.top_key()
+            if u is None or (k_old >= self.key(self.start) and rhs[self.start] == g[self.start]):
+                return True
+            if self.expanded >= self.max_expansions:
+                return False
+            self.expanded += 1
+            heapq.heappop(self.queue)
+            del self.queued[u]
+            k_new = self.key(u)
+            if k_old < k_new:
+                self.push(u)
+            elif g[u] > rhs[u]:
+                # Cheaper than before: neighbours only need to check the way through u
+                g[u] = rhs[u]
+                if not self.passable(u):
+                    continue
+                for d, c in self.steps:
+                    n = u + d
+                    if n != self.goal and self.passable(n) and g[u] + c < rhs[n]:
+                        rhs[n] = g[u] + c
+                        self.requeue(n)
+            else:
+                g[u] = INF
+                self.update_vertex(u)
+                for d, _ in self.steps:
+                    self.update_vertex(u + d)
+
+    def blocked_window(self, x0, y0, w, h, free_cells):
+        # Blocked cells of the box as a flat bytearray. Around free_cells nothing
+        # is blocked: survivors show up as obstacles themselves. The border of the
+        # box is a wall, so neighbours never leave the box
+        blocked = self.field.distance.window(x0, y0, x0 + w, y0 + h) <= self.inflation_cells
+        ix, iy = np.meshgrid(np.arange(x0, x0 + w), np.arange(y0, y0 + h), indexing="ij")
+        r = self.goal_cells
+        for fx, fy in free_cells:
+            blocked &= (ix - fx) ** 2 + (iy - fy) ** 2 > r * r
+        blocked[[0, -1], :] = True
+        blocked[:, [0, -1]] = True
+        return bytearray(blocked.ravel().tobytes())
+
+    def neighbour_steps(self, h):
+        return [(h, STRAIGHT), (-h, STRAIGHT), (1, STRAIGHT), (-1, STRAIGHT),
+                (h + 1, DIAGONAL), (h - 1, DIAGONAL), (-h + 1, DIAGONAL), (-h - 1, DIAGONAL)]
+
+    def reset_search(self, start_cell, goal_cell, margin):
+        # New search box around start and goal, planned from scratch
+        x0 = min(start_cell[0], goal_cell[0]) - margin
+        y0 = min(start_cell[1], goal_cell[1]) - margin
+        w = abs(start_cell[0] - goal_cell[0]) + 2 * margin + 1
+        h = abs(start_cell[1] - goal_cell[1]) + 2 * margin + 1
+        self.box = (x0, y0, w, h)
+        self.blocked = self.blocked_window(x0, y0, w, h, [goal_cell])
+        self.goal_zone = (goal_cell[0], goal_cell[1], self.goal_cells)
+        self.steps = self.neighbour_steps(h)
+        self.changed = []
+
+        self.goal = self.index(*goal_cell)
+        self.set_start(self.index(*start_cell))
+        self.g = [INF] * (w * h)
+        self.rhs = [INF] * (w * h)
+        self.queue = []
+        self.queued = {}
+        self.km = 0
+        self.rhs[self.goal] = 0
+        self.push(self.goal)
+        self.margin_used = margin
+
+    def apply_changes(self):
+        # Feed blocked-state changes inside the box to the search
+        if not self.changed:
+            return False
+        cx = np.concatenate([c[0] for c in self.changed])
+        cy = np.concatenate([c[1] for c in self.changed])
+        self.changed = []
+        x0, y0, w, h = self.box
+        gx, gy, r = self.goal_zone
+        inside = (cx > x0) & (cx < x0 + w - 1) & (cy > y0) & (cy < y0 + h - 1) & \
+                 ((cx - gx) ** 2 + (cy - gy) ** 2 > r * r)
+        cx = cx[inside]
+        cy = cy[inside]
+        if len(cx) == 0:
+            return False
+        now = (self.field.distance[cx, cy] <= self.inflation_cells).tolist()
+        index = ((cx - x0) * h + (cy - y0)).tolist()
+        touched = set()
+        for s, b in zip(index, now):
+            if self.blocked[s] != b:
+                self.blocked[s] = b
+                touched.add(s)
+                touched.update(s + d for d, _ in self.steps)
+        for s in touched:
+            self.update_vertex(s)
+        return bool(touched)
+
+    # --- Paths ---------------------------------------------------------------------
+
+    def plan(self, start, goal):
+        # Waypoints (navigation frame) from start to goal, or None if there is no path
+        t0 = time.perf_counter()
+        self.expanded = 0
+        start_cell = self.to_cell(*start)
+        goal_cell = self.to_cell(*goal)
+
+        new_goal = self.box is None or self.cell(self.goal) != goal_cell
+        if new_goal or self.index(*start_cell) is None:
+            self.reset_search(start_cell, goal_cell, self.margin)
+            self.path = None
+            self.repaired = False
+        else:
+            s = self.index(*start_cell)
+            if s != self.start:
+                # The old start cell takes its own blocked state back, the new one is passable
+                self.km += self.heuristic(self.start, s)
+                old = self.start
+                self.set_start(s)
+                self.update_vertex(old)
+                for d, _ in self.steps:
+                    self.update_vertex(old + d)
+                self.update_vertex(s)
+                self.path = None
+            if self.apply_changes():
+                self.path = None
+                self.repaired = True
+
+        found = self.compute_shortest_path() and self.g[self.start] < INF
+        if not found and self.margin_used < 4 * self.margin:
+            # The way round may leave the box, search a larger one
+            self.reset_search(start_cell, goal_cell, 2 * self.margin_used)
+            found = self.compute_shortest_path() and self.g[self.start] < INF
+            self.path = None
+        if not found:
+            self.last_ms = (time.perf_counter() - t0) * 1000.0
+            return None
+
+        if self.path is None:
+            self.path = self.extract_path()
+        self.last_ms = (time.perf_counter() - t0) * 1000.0
+        return None if self.path is None else list(self.path)
+
+    def extract_path(self):
+        # Follow the cheapest successor from the robot to the goal, then shorten
+        # the cell path to waypoints with clear straight lines between them
+        cells = [self.start]
+        visited = {self.start}
+        s = self.start
+        while s != self.goal:
+            best = None
+            best_v = INF
+            for d, c in self.steps:
+                n = s + d
+                v = self.g[n] + c if self.passable(n) else INF
+                if v < best_v:
+                    best_v = v
+                    best = n
+            if best is None or best in visited:
+                return None
+            visited.add(best)
+            cells.append(best)
+            s = best
+
+        waypoints = []
+        anchor = 0
+        while anchor < len(cells) - 1:
+            nxt = anchor + 1
+            for k in range(min(len(cells) - 1, anchor + 40), anchor + 1, -1):
+                if self.line_clear(cells[anchor], cells[k]):
+                    nxt = k
+                    break
+            waypoints.append(self.to_world(*self.cell(cells[nxt])))
+            anchor = nxt
+        return waypoints
+
+    def line_clear(self, a, b):
+        h = self.box[3]
+        ai, aj = divmod(a, h)
+        bi, bj = divmod(b, h)
+        n = max(abs(bi - ai), abs(bj - aj))
+        for k in range(1, n):
+            i = ai + round((bi - ai) * k / n)
+            j = aj + round((bj - aj) * k / n)
+            if self.blocked[i * h + j]:
+                return False
+        return True
+
+    # --- Path lengths --------------------------------------------------------------
+
+    def path_costs(self, source, targets):
+        # Path lengths in metres from source to every target through the inflated
+        # map, inf where there is none. A Dijkstra search of its own that stops
+        # once every target is settled; the D* Lite state is left alone.
+        cells = [self.to_cell(*t) for t in targets]
+        if not cells:
+            return []
+        src = self.to_cell(*source)
+        xs = [src[0]] + [c[0] for c in cells]
+        ys = [src[1]] + [c[1] for c in cells]
+        x0 = min(xs) - self.margin
+        y0 = min(ys) - self.margin
+        w = max(xs) - x0 + self.margin + 1
+        h = max(ys) - y0 + self.margin + 1
+        blocked = self.blocked_window(x0, y0, w, h, [src] + cells)
+        steps = self.neighbour_steps(h)
+
+        dist = [INF] * (w * h)
+        s0 = (src[0] - x0) * h + (src[1] - y0)
+        dist[s0] = 0
+        queue = [(0, s0)]
+        index = [(cx - x0) * h + (cy - y0) for cx, cy in cells]
+        remaining = set(index)
+        while queue and remaining:
+            d, s = heapq.heappop(queue)
+            if d > dist[s]:
+                continue
+            remaining.discard(s)
+            for step, c in steps:
+                n = s + step
+                if blocked[n]:
+                    continue
+                nd = d + c
+                if nd < dist[n]:
+                    dist[n] = nd
+                    heapq.heappush(queue, (nd, n))
+        scale = 1.0 / (STRAIGHT * self.resolution)
+        return [dist[i] * scale for i in index]
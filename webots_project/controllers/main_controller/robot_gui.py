@@ -114,7 +114,7 @@ class RescueGUI:
         battery = self.robot_data.get("battery",0)
         left = self.robot_data.get("left_speed",0)
         right = self.robot_data.get("right_speed",0)
-        text = f"State: {status}\nBattery: {battery}%\nPosition: ({pos.get('x',0):.2f},{pos.get('y',0):.2f})\nTheta: {self.robot_data.get('position',{}).get('theta_degrees',0):.1f}°\nLeft R: {left:.2f} Right R: {right:.2f}"
+        text = f"State: {status}\nBattery: {battery}%\nPosition: ({pos.get('x',0):.2f},{pos.get('y',0):.2f}) ±{pos.get('sigma_xy',0):.2f} m\nTheta: {self.robot_data.get('position',{}).get('theta_degrees',0):.1f}° ±{pos.get('sigma_theta_degrees',0):.1f}°\nLeft R: {left:.2f} Right R: {right:.2f}"
         self.status_text.set(text)
 
     def update_survivors(self):
@@ -0,0 +1,209 @@
+# scheduler.py
+# Order in which the known, unvisited survivors are visited
+#
+# Travel costs between survivors are kept in a matrix: path lengths through the
+# map when a path_cost function is given (e.g. GridPlanner.path_costs),
+# straight-line distances otherwise. The order is an open tour starting at the
+# robot, built by nearest neighbour and improved with 2-opt and Or-opt moves.
+# A new survivor adds one row to the matrix and is inserted where it costs
+# least, followed by the same local moves, instead of solving from scratch.
+# Positions are in the navigation frame.
+
+import math
+import numpy as np
+
+
+class VisitScheduler:
+    def __init__(self, path_cost=None, merge_distance=0.5, unreachable_penalty=100.0):
+        self.path_cost = path_cost              # path_cost(source, targets) -> metres to each target
+        self.merge_distance = merge_distance    # Closer survivors are taken to be the same one
+        self.unreachable_penalty = unreachable_penalty
+
+        self.points = []                        # Unvisited survivor positions
+        self.cost = np.zeros((0, 0))            # cost[i, j]: travel from points[i] to points[j]
+        self.robot = None
+        self.robot_cost = np.zeros(0)           # Travel from the robot to every point
+        self.order = []                         # Indices into points, in visiting order
+        self.moves = 0                          # Improving moves made by the last improve()
+
+    def __len__(self):
+        return len(self.points)
+
+    def costs_from(self, source, targets):
+        # Travel costs from source to targets; unreachable targets cost their
+        # straight-line distance plus a penalty, so they are visited last
+        if not targets:
+            return np.zeros(0)
+        straight = np.array([math.hypot(t[0] - source[0], t[1] - source[1]) for t in targets])
+        if self.path_cost is None:
+            return straight
+        costs = np.array(self.path_cost(source, targets), dtype=np.float64)
+        return np.where(np.isfinite(costs), costs, straight + self.unreachable_penalty)
+
+    def tour_cost(self, order=None):
+        order = self.order if order is None else order
+        if not order:
+            return 0.0
+        o = np.asarray(order)
+        return float(self.robot_cost[o[0]] + self.cost[o[:-1], o[1:]].sum())
+
+    # --- Changes -------------------------------------------------------------------
+
+    def set_robot(self, position):
+        # Costs from the robot's current position, then re-polish the order for the new start
+        self.robot = tuple(position)
+        self.robot_cost = self.costs_from(self.robot, self.points)
+        if self.order:
+            self.improve()
+
+    def add(self, positions):
+        # Insert survivors not yet known; returns the ones that were new
+        added = []
+        for p in positions:
+            p = (float(p[0]), float(p[1]))
+            if any(math.hypot(p[0] - q[0], p[1] - q[1]) < self.merge_distance for q in self.points + added):
+                continue
+            # One search from the new point gives its row and its cost from the robot
+            targets = self.points + ([self.robot] if self.robot is not None else [])
+            row = self.costs_from(p, targets)
+            n = len(self.points)
+            cost = np.zeros((n + 1, n + 1))
+            cost[:n, :n] = self.cost
+            cost[n, :n] = row[:n]
+            cost[:n, n] = row[:n]
+            self.cost = cost
+            self.robot_cost = np.append(self.robot_cost, row[n] if self.robot is not None else 0.0)
+            self.points.append(p)
+            self.insert(n)
+            added.append(p)
+        if added:
+            self.improve()
+        return added
+
+    def insert(self, i):
+        # Cheapest insertion of point i into the current order
+        best_at = len(self.order)
+        best = math.inf
+        for k in range(len(self.order) + 1):
+            before = self.robot_cost[i] if k == 0 else self.cost[self.order[k - 1], i]
+            if k < len(self.order):
+                after = self.cost[i, self.order[k]]
+                removed = self.robot_cost[self.order[k]] if k == 0 else self.cost[self.order[k - 1], self.order[k]]
+            else:
+                after = removed = 0.0
+            delta = before + after - removed
+            if delta < best:
+                best = delta
+                best_at = k
+        self.order.insert(best_at, i)
+
+    def pop_next(self):
+        # Position of the next survivor to visit, removed from the schedule; the
+        # robot is taken to be there from now on. None when nothing is left
+        if not self.order:
+            return None
+        i = self.order.pop(0)
+        p = self.points[i]
+        self.robot = p
+        self.robot_cost = self.cost[i].copy()
+        keep = [k for k in range(len(self.points)) if k != i]
+        self.points = [self.points[k] for k in keep]
+        self.cost = self.cost[np.ix_(keep, keep)]
+        self.robot_cost = self.robot_cost[keep]
+        self.order = [k if k < i else k - 1 for k in self.order]
+        return p
+
+    def positions(self):
+        # Unvisited survivors in visiting order
+        return [self.points[i] for i in self.order]
+
+    def clear(self):
+        self.points = []
+        self.cost = np.zeros((0, 0))
+        self.robot_cost = np.zeros(0)
+        self.order = []
+
+    # --- Ordering ------------------------------------------------------------------
+
+    def solve(self):
+        # Order from scratch: nearest neighbour from the robot, then local moves
+        left = set(range(len(self.points)))
+        self.order = []
+        while left:
+            if not self.order:
+                nxt = min(left, key=lambda k: self.robot_cost[k])
+            else:
+                last = self.order[-1]
+                nxt = min(left, key=lambda k: self.cost[last, k])
+            self.order.append(nxt)
+            left.remove(nxt)
+        self.improve()
+
+    def improve(self):
+        # 2-opt and Or-opt moves until neither shortens the tour
+        self.moves = 0
+        improved = True
+        while improved:
+            improved = self.two_opt() or self.or_opt()
+
+    def two_opt(self):
+        # Reverse order[i..j] when that is shorter
+        order = self.order
+        n = len(order)
+        for i in range(n - 1):
+            prev = self.robot_cost if i == 0 else self.cost[order[i - 1]]
+            for j in range(i + 1, n):
+                delta = prev[order[j]] - prev[order[i]]
+                if j + 1 < n:
+                    delta += self.cost[order[i], order[j + 1]] - self.cost[order[j], order[j + 1]]
+                if delta < -1e-9:
+                    order[i:j + 1] = order[i:j + 1][::-1]
+                    self.moves += 1
+                    return True
+        return False
+
+    def or_opt(self):
+        # Move runs of up to three survivors, possibly reversed, to where they
+        # cost least; each move is scored from the edges it breaks and makes
+        improved = False
+        for length in (1, 2, 3):
+            i = 0
+            while i + length <= len(self.order):
+                if self.move_segment(i, length):
+                    self.moves += 1
+                    improved = True
+                i += 1
+        return improved
+
+    def move_segment(self, i, length):
+        # Move order[i:i + length] to its cheapest place in the rest of the order
+        order = self.order
+        n = len(order)
+        if n == length:
+            return False
+        seg = order[i:i + length]
+        rest = np.array(order[:i] + order[i + length:])
+        prev = self.robot_cost if i == 0 else self.cost[order[i - 1]]
+        if i + length < n:
+            removed = prev[seg[0]] + self.cost[seg[-1], order[i + length]] - prev[order[i + length]]
+        else:
+            removed = prev[seg[0]]
+        # Edge broken at each gap k of rest, before rest[k]; the open end costs nothing
+        broken = np.concatenate(([self.robot_cost[rest[0]]], self.cost[rest[:-1], rest[1:]], [0.0]))
+        inner = sum(self.cost[a, b] for a, b in zip(seg, seg[1:]))
+        best, best_at, best_seg = -1e-9, None, None
+        for s in (seg, seg[::-1]):
+            joined_in = np.concatenate(([self.robot_cost[s[0]]], self.cost[rest, s[0]]))
+            joined_out = np.append(self.cost[s[-1], rest], 0.0)
+            delta = joined_in + joined_out - broken - removed
+            delta += sum(self.cost[a, b] for a, b in zip(s, s[1:])) - inner
+            if s is seg:
+                delta[i] = np.inf              # Where it already is
+            k = int(np.argmin(delta))
+            if delta[k] < best:
+                best, best_at, best_seg = delta[k], k, s
+        if best_at is None:
+            return False
+        rest = rest.tolist()
+        self.order = rest[:best_at] + best_seg + rest[best_at:]
+        return True
@@ -0,0 +1,106 @@
+# segmentation.py
+# "Warm red" pixels of the camera image, straight from the Webots BGRA buffer
+#
+# The buffer is viewed as one little-endian uint32 per pixel (B | G << 8 |
+# R << 16 | A << 24) without copying. With the alpha byte masked off, the
+# colour indexes a 16 MiB table that says whether the HSV bands Detection used
+# to threshold with hold for it, so the mask is exactly the one the HSV
+# conversion gave. The table is built a slice of red values at a time, so only
+# a few MiB of intermediates live at once, and cached next to this file with
+# the bands it was built from; a cache built from other bands is rebuilt.
+# Index and mask buffers are allocated once and reused for every frame, and
+# an ROI (x0, y0, x1, y1) and a stride to skip pixels shrink the work further.
+
+import os
+import cv2
+import numpy as np
+import telemetry
+
+# Warm colour bands in OpenCV HSV (H 0..180): light red to dark red
+WARM_BANDS = (
+    ((0, 160, 120), (20, 255, 255)),
+    ((170, 120, 70), (180, 255, 255)),
+)
+
+_table = None
+
+
+def build_warm_table(bands=WARM_BANDS, chunk=16):
+    # uint8 table indexed by b | g << 8 | r << 16; 255 where the colour is warm
+    table = np.empty((256, 256, 256), dtype=np.uint8)           # r, g, b
+    levels = np.arange(256, dtype=np.uint8)
+    g, b = np.meshgrid(levels, levels, indexing="ij")
+    bgr = np.empty((chunk, 256, 256, 3), dtype=np.uint8)
+    bgr[..., 0] = b
+    bgr[..., 1] = g
+    mask = np.empty((chunk * 256 * 256, 1), dtype=np.uint8)
+    for r0 in range(0, 256, chunk):
+        bgr[..., 2] = np.arange(r0, r0 + chunk, dtype=np.uint8)[:, None, None]
+        hsv = cv2.cvtColor(bgr.reshape(-1, 1, 3), cv2.COLOR_BGR2HSV)
+        out = table[r0:r0 + chunk].reshape(-1, 1)
+        out[:] = 0
+        for lower, upper in bands:
+            cv2.inRange(hsv, np.array(lower), np.array(upper), dst=mask)
+            np.bitwise_or(out, mask, out=out)
+    return table.ravel()
+
+
+def warm_table(cache_dir=None):
+    # The table for WARM_BANDS, from the cache file when it was built from the same bands
+    global _table
+    if _table is not None:
+        return _table
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(cache_dir, "warm_table.npz")
+    bands = np.array(WARM_BANDS, dtype=np.int64)
+    try:
+        with np.load(path) as cached:
+            if np.array_equal(cached["bands"], bands) and cached["table"].shape == (1 << 24,):
+                _table = cached["table"]
+    except (OSError, KeyError, ValueError):
+        pass
+    if _table is None:
+        _table = build_warm_table()
+        try:
+            np.savez(path, bands=bands, table=_table)
+        except OSError as e:
+            telemetry.warning("detection", "could not cache the warm colour table", error=e)
+    return _table
+
+
+class WarmSegmenter:
+    def __init__(self, width, height, roi=None, stride=1):
+        self.width = width
+        self.height = height
+        self.table = warm_table()
+        self.set_region(roi, stride)
+
+    def set_region(self, roi=None, stride=1):
+        # Pixels looked at: the ROI (whole image when None), every stride-th row and column
+        x0, y0, x1, y1 = roi if roi is not None else (0, 0, self.width, self.height)
+        self.roi = (x0, y0, x1, y1)
+        self.stride = stride
+        shape = (len(range(y0, y1, stride)), len(range(x0, x1, stride)))
+        self.index = np.empty(shape, dtype=np.uint32)
+        self.mask = np.empty(shape, dtype=np.uint8)
+
+    def segment(self, image):
+        # Mask (255 = warm) of the region, from the raw BGRA buffer
+        x0, y0, x1, y1 = self.roi
+        s = self.stride
+        pixels = np.frombuffer(image, np.uint32).reshape(self.height, self.width)[y0:y1:s, x0:x1:s]
+        np.bitwise_and(pixels, 0xFFFFFF, out=self.index)
+        np.take(self.table, self.index, out=self.mask)
+        return self.mask
+
+    def to_image(self, contours):
+        # Contours found on the mask, in full-image pixel coordinates
+        x0, y0 = self.roi[:2]
+        if self.stride == 1 and x0 == 0 and y0 == 0:
+            return contours
+        return [c * self.stride + np.array((x0, y0), dtype=c.dtype) for c in contours]
+
+    def coverage(self):
+        # Fraction of the whole image that is warm, estimated from the region
+        return np.count_nonzero(self.mask) * self.stride * self.stride / (self.width * self.height)
@@ -0,0 +1,236 @@
+# sensor_log.py
+# Recording of the sensors Mapping reads (lidar, wheel encoders, IMU yaw) and
+# offline replay of such logs through Mapping, without Webots:
+#   python sensor_log.py LOG [ATTRIBUTE=VALUE ...]
+# e.g. python sensor_log.py run.slog OCC_CONFIRM=6 SCAN_MATCH_INTERVAL=5
+#
+# File layout: 8-byte magic, 8-byte little-endian header length, JSON header
+# (timestep, lidar parameters, encoder values at start), then one fixed-size
+# record per timestep. A record that was cut off by a crash is ignored.
+
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+
+MAGIC = b"G47SLOG1"
+
+
+def frame_dtype(lidar_res):
+    return np.dtype([("time", "<f8"), ("left", "<f8"), ("right", "<f8"), ("yaw", "<f8"),
+                     ("ranges", "<f4", (lidar_res,))])
+
+
+class SensorLogRecorder:
+    # Appends the readings of a SensorSnapshot per record() call. Records are
+    # collected in a preallocated chunk and written once it is full, or on
+    # flush()/close().
+    def __init__(self, sensors, path, chunk_frames=256):
+        lidar_res = sensors.lidar_res
+        header = {
+            "timestep": sensors.timestep,
+            "lidar": {
+                "resolution": lidar_res,
+                "fov": sensors.lidar_fov,
+                "min_range": sensors.lidar_min,
+                "max_range": sensors.lidar_max,
+            },
+            # Encoder values when recording started, which Mapping takes as its reference
+            "initial": {"left": sensors.left, "right": sensors.right},
+        }
+        self.chunk = np.zeros(chunk_frames, dtype=frame_dtype(lidar_res))
+        self.count = 0
+        self.frames_written = 0
+
+        data = json.dumps(header).encode("utf-8")
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.file.write(len(data).to_bytes(8, "little"))
+        self.file.write(data)
+
+    def record(self, sensors):
+        frame = self.chunk[self.count]
+        frame["time"] = sensors.time
+        frame["left"] = sensors.left
+        frame["right"] = sensors.right
+        frame["yaw"] = sensors.yaw
+        frame["ranges"] = sensors.ranges
+        self.count += 1
+        if self.count == len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        if self.count:
+            self.file.write(self.chunk[:self.count].tobytes())
+            self.file.flush()
+            self.frames_written += self.count
+            self.count = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class SensorLogReader:
+    # Streams records in chunks, so logs of any length are read in bounded memory
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(8) != MAGIC:
+                raise ValueError("not a sensor log: " + path)
+            header_len = int.from_bytes(f.read(8), "little")
+            self.header = json.loads(f.read(header_len).decode("utf-8"))
+        self.data_start = 16 + header_len
+        self.dtype = frame_dtype(self.header["lidar"]["resolution"])
+
+    def __len__(self):
+        return (os.path.getsize(self.path) - self.data_start) // self.dtype.itemsize
+
+    def chunks(self, chunk_frames=1024):
+        n = len(self)
+        with open(self.path, "rb") as f:
+            f.seek(self.data_start)
+            while n > 0:
+                chunk = np.fromfile(f, dtype=self.dtype, count=min(chunk_frames, n))
+                if len(chunk) == 0:
+                    break
+                n -= len(chunk)
+                yield chunk
+
+
+class ReplayDevice:
+    def __init__(self, value=None):
+        self.value = value
+
+    def enable(self, sampling_period):
+        pass
+
+    def disable(self):
+        pass
+
+    def getValue(self):
+        return self.value
+
+
+class ReplayLidar(ReplayDevice):
+    def __init__(self, params):
+        super().__init__(np.full(params["resolution"], np.inf, dtype=np.float32))
+        self.params = params
+
+    def getHorizontalResolution(self):
+        return self.params["resolution"]
+
+    def getFov(self):
+        return self.params["fov"]
+
+    def getMinRange(self):
+        return self.params["min_range"]
+
+    def getMaxRange(self):
+        return self.params["max_range"]
+
+    def getRangeImage(self):
+        return self.value
+
+
+class ReplayIMU(ReplayDevice):
+    def getRollPitchYaw(self):
+        return [0.0, 0.0, self.value]
+
+
+class ReplayDisplay(ReplayDevice):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class ReplayRobot:
+    # Serves the devices Mapping uses, with the values of the current record
+    def __init__(self, header):
+        self.header = header
+        self.time = 0.0
+        self.devices = {
+            "display": ReplayDisplay(),
+            "LDS-01": ReplayLidar(header["lidar"]),
+            "inertial unit": ReplayIMU(float("nan")),
+            "left wheel sensor": ReplayDevice(header["initial"]["left"]),
+            "right wheel sensor": ReplayDevice(header["initial"]["right"]),
+        }
+
+    def getBasicTimeStep(self):
+        return self.header["timestep"]
+
+    def getDevice(self, name):
+        return self.devices[name]
+
+    def getTime(self):
+        return self.time
+
+    def load(self, frame):
+        self.time = float(frame["time"])
+        self.devices["LDS-01"].value = frame["ranges"]
+        self.devices["inertial unit"].value = float(frame["yaw"])
+        self.devices["left wheel sensor"].value = float(frame["left"])
+        self.devices["right wheel sensor"].value = float(frame["right"])
+
+
+def replay(path, overrides=None, chunk_frames=1024, max_frames=None):
+    # Run Mapping.update on every record of a log as fast as possible.
+    # overrides sets Mapping attributes (e.g. {"OCC_CONFIRM": 6}) before the first update.
+    # Returns the Mapping and the time spent in each update, in ms.
+    import mapping
+    reader = SensorLogReader(path)
+    robot = ReplayRobot(reader.header)
+    mapper = mapping.Mapping(robot)
+    for name, value in (overrides or {}).items():
+        if not hasattr(mapper, name):
+            raise AttributeError("Mapping has no attribute " + name)
+        setattr(mapper, name, value)
+
+    frames = len(reader) if max_frames is None else min(len(reader), max_frames)
+    update_ms = np.zeros(frames)
+    i = 0
+    for chunk in reader.chunks(chunk_frames):
+        for frame in chunk:
+            if i == frames:
+                return mapper, update_ms
+            robot.load(frame)
+            start = time.perf_counter()
+            mapper.update()
+            update_ms[i] = (time.perf_counter() - start) * 1000.0
+            i += 1
+    return mapper, update_ms[:i]
+
+
+def report(update_ms, timestep):
+    if len(update_ms) == 0:
+        print("replayed 0 frames")
+        return
+    total_s = update_ms.sum() / 1000.0
+    print(f"replayed {len(update_ms)} frames ({len(update_ms) * timestep / 1000.0:.1f} s simulated) "
+          f"in {total_s:.2f} s, {len(update_ms) / max(total_s, 1e-9):.0f} frames/s")
+    print(f"  Mapping.update mean {update_ms.mean():.3f} ms  p50 {np.percentile(update_ms, 50):.3f} ms  "
+          f"p95 {np.percentile(update_ms, 95):.3f} ms  max {update_ms.max():.3f} ms")
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python sensor_log.py LOG [ATTRIBUTE=VALUE ...]")
+        sys.exit(1)
+    overrides = {}
+    for arg in sys.argv[2:]:
+        name, _, value = arg.partition("=")
+        overrides[name] = parse_value(value)
+    mapper, update_ms = replay(sys.argv[1], overrides)
+    report(update_ms, mapper.TIME_STEP)
+    x, y, th = mapper.get_pose()
+    print(f"  final pose ({x:.3f}, {y:.3f}, {math.degrees(th):.1f} deg), {mapper.known_cells} known cells")
@@ -0,0 +1,114 @@
+# sensors.py
+# Shared per-timestep snapshot of the robot's sensors
+#
+# main_controller calls read() once after every robot.step; Navigation, Mapping
+# and Detection then take their readings from the snapshot instead of querying
+# the devices themselves. Derived views (sector minima, valid-beam mask, world
+# points) are computed on first use and memoized until the next read().
+
+import numpy as np
+
+
+class SensorSnapshot:
+    def __init__(self, robot, timestep, camera=True):
+        self.robot = robot
+        self.timestep = timestep
+
+        self.lidar = robot.getDevice("LDS-01")
+        self.imu = robot.getDevice("inertial unit")
+        self.left_enc = robot.getDevice("left wheel sensor")
+        self.right_enc = robot.getDevice("right wheel sensor")
+        self.lidar.enable(timestep)
+        self.imu.enable(timestep)
+        self.left_enc.enable(timestep)
+        self.right_enc.enable(timestep)
+
+        self.lidar_res = self.lidar.getHorizontalResolution()
+        self.lidar_fov = self.lidar.getFov()
+        self.lidar_min = self.lidar.getMinRange()
+        self.lidar_max = self.lidar.getMaxRange()
+        # Beam i looks at beam_angles[i] in the robot frame
+        self.beam_angles = np.linspace(-self.lidar_fov / 2.0, self.lidar_fov / 2.0, self.lidar_res)
+
+        # Camera pan angle, and the camera image read on first use
+        self.camera = None
+        self.camera_sensor = None
+        if camera:
+            self.camera = robot.getDevice("rgb_camera")
+            self.camera_sensor = robot.getDevice("camera_motor").getPositionSensor()
+            self.camera.enable(timestep)
+            self.camera_sensor.enable(timestep)
+
+        # Buffers reused between steps
+        self.ranges = np.full(self.lidar_res, np.inf, dtype=np.float32)
+        self.time = 0.0
+        self.left = 0.0
+        self.right = 0.0
+        self.yaw = 0.0
+        self.camera_angle = 0.0
+        self.cache = {}
+        self.read()
+
+    def read(self):
+        # Take this timestep's readings and drop the views derived from the last ones
+        self.time = self.robot.getTime()
+        self.ranges[:] = self.lidar.getRangeImage()
+        self.left = self.left_enc.getValue()
+        self.right = self.right_enc.getValue()
+        self.yaw = self.imu.getRollPitchYaw()[2]
+        if self.camera_sensor is not None:
+            self.camera_angle = self.camera_sensor.getValue()
+        self.cache.clear()
+
+    def memo(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    @property
+    def image(self):
+        # Raw BGRA camera buffer of this step, None before the first frame
+        return self.memo("image", self.camera.getImage)
+
+    @property
+    def clipped(self):
+        # Ranges clipped to the lidar's measuring range
+        return self.memo("clipped", lambda: np.clip(self.ranges, self.lidar_min, self.lidar_max))
+
+    @property
+    def valid(self):
+        # Beams that hit something within range
+        return self.memo("valid", lambda: np.isfinite(self.ranges)
+                         & (self.ranges >= self.lidar_min) & (self.ranges < self.lidar_max))
+
+    def sector_min(self, start, end):
+        # Closest range over beams [start, end), lidar_max for an empty sector
+        def compute():
+            if end <= start:
+                return self.lidar_max
+            return float(self.ranges[start:end].min())
+        return self.memo(("sector_min", start, end), compute)
+
+    @property
+    def front(self):
+        # Middle third of the scan, the sector obstacle checks look at
+        n = self.lidar_res
+        return self.sector_min(n // 3, 2 * n // 3)
+
+    @property
+    def left_side(self):
+        n = self.lidar_res
+        return self.sector_min(n // 4, n // 2)
+
+    @property
+    def right_side(self):
+        n = self.lidar_res
+        return self.sector_min(n // 2, 3 * n // 4)
+
+    def world_points(self, x, y, th):
+        # World coordinates of the valid beams' endpoints seen from pose (x, y, th)
+        def compute():
+            r = self.ranges[self.valid].astype(np.float64)
+            a = th + self.beam_angles[self.valid]
+            return np.stack((x + r * np.cos(a), y + r * np.sin(a)), axis=1)
+        return self.memo(("world_points", x, y, th), compute)
@@ -0,0 +1,166 @@
+# state_estimator.py
+# Single pose estimate shared by navigation, mapping, detection and the GUI
+#
+# An extended Kalman filter over (x, y, theta) in the navigation frame: x and y
+# in metres from the start position, theta counter-clockwise and equal to the
+# IMU yaw. step() runs once per timestep, predicting with the wheel encoders
+# and correcting with the IMU yaw; Mapping adds scan-match corrections.
+# Mapping draws its grid in the same frame mirrored across the x axis
+# (y and theta negated), see map_pose().
+
+import math
+import numpy as np
+
+# TurtleBot measurements
+WHEEL_RADIUS = 0.033
+WHEEL_BASE = 0.160
+
+
+def wrap_angle(a):
+    return math.atan2(math.sin(a), math.cos(a))
+
+
+class PoseEstimator:
+    def __init__(self, sensors):
+        self.sensors = sensors
+
+        self.state = np.zeros(3)                   # x, y, theta
+        # Position is known at the start, heading comes from the first IMU reading
+        self.P = np.diag([1e-6, 1e-6, math.pi ** 2])
+
+        # Noise: encoder travel error grows with distance and turn, IMU yaw is absolute
+        self.ENC_NOISE_D = 0.05                    # std as a fraction of distance travelled
+        self.ENC_NOISE_TH = 0.10                   # std as a fraction of the encoder turn
+        self.ENC_NOISE_MIN = 0.0005                # std per step while moving, m or rad
+        self.IMU_NOISE = math.radians(1.0)
+
+        self.last_l = sensors.left
+        self.last_r = sensors.right
+        self.d = 0.0                               # Motion of the last step
+        self.dth = 0.0
+
+        # Stuck detection: wheels turning while the scan stays the same
+        self.stuck_counter = 0
+        self.STUCK_THRESHOLD = 5
+        self.prev_ranges = None
+
+    @property
+    def x(self):
+        return float(self.state[0])
+
+    @property
+    def y(self):
+        return float(self.state[1])
+
+    @property
+    def theta(self):
+        return float(self.state[2])
+
+    @property
+    def stuck(self):
+        return self.stuck_counter > self.STUCK_THRESHOLD
+
+    def pose(self):
+        return self.x, self.y, self.theta
+
+    def map_pose(self):
+        # Pose in the mapping frame
+        return self.x, -self.y, -self.theta
+
+    def covariance(self):
+        return self.P.copy()
+
+    def step(self):
+        s = self.sensors
+        l, r = s.left, s.right
+        dl = (l - self.last_l) * WHEEL_RADIUS
+        dr = (r - self.last_r) * WHEEL_RADIUS
+        self.last_l, self.last_r = l, r
+        d = 0.5 * (dl + dr)
+        dth = (dr - dl) / WHEEL_BASE
+        if not (math.isfinite(d) and math.isfinite(dth)):
+            d = dth = 0.0
+
+        ranges = s.clipped
+        if self.detect_stuck(ranges, d, dth):
+            self.stuck_counter += 1
+        else:
+            self.stuck_counter = max(0, self.stuck_counter - 1)
+        self.prev_ranges = ranges.copy()
+        if self.stuck:
+            d = dth = 0.0
+
+        self.d, self.dth = d, dth
+        self.predict(d, dth)
+        if not math.isnan(s.yaw):
+            self.correct_heading(s.yaw)
+
+        if not np.all(np.isfinite(self.state)):
+            self.state[:] = 0.0
+            self.state[2] = 0.0 if math.isnan(s.yaw) else s.yaw
+            self.P = np.diag([1e-6, 1e-6, math.pi ** 2])
+            self.stuck_counter = 0
+
+    def predict(self, d, dth):
+        x, y, th = self.state
+        th_mid = th + 0.5 * dth
+        c, sn = math.cos(th_mid), math.sin(th_mid)
+        self.state[:] = (x + d * c, y + d * sn, wrap_angle(th + dth))
+
+        moving = d != 0.0 or dth != 0.0
+        sd = self.ENC_NOISE_D * abs(d) + (self.ENC_NOISE_MIN if moving else 0.0)
+        sth = self.ENC_NOISE_TH * abs(dth) + (self.ENC_NOISE_MIN if moving else 0.0)
+        F = np.array([[1.0, 0.0, -d * sn], [0.0, 1.0, d * c], [0.0, 0.0, 1.0]])
+        G = np.array([[c, -0.5 * d * sn], [sn, 0.5 * d * c], [0.0, 1.0]])
+        self.P = F @ self.P @ F.T + G @ np.diag([sd * sd, sth * sth]) @ G.T
+
+    def correct_heading(self, yaw):
+        innovation = wrap_angle(yaw - self.state[2])
+        S = self.P[2, 2] + self.IMU_NOISE ** 2
+        K = self.P[:, 2] / S
+        self.state += K * innovation
+        self.state[2] = wrap_angle(self.state[2])
+        self.P = self.P - np.outer(K, self.P[2, :])
+
+    def correct_pose(self, x, y, theta, sigma_xy, sigma_th):
+        # Full pose measurement, e.g. from scan matching
+        innovation = np.array([x - self.state[0], y - self.state[1], wrap_angle(theta - self.state[2])])
+        S = self.P + np.diag([sigma_xy ** 2, sigma_xy ** 2, sigma_th ** 2])
+        K = self.P @ np.linalg.inv(S)
+        self.state += K @ innovation
+        self.state[2] = wrap_angle(self.state[2])
+        self.P = (np.eye(3) - K) @ self.P
+        self.P = 0.5 * (self.P + self.P.T)
+
+    def correct_map_pose(self, x, y, th, sigma_xy, sigma_th):
+        # Pose measurement given in the mapping frame
+        self.correct_pose(x, -y, -th, sigma_xy, sigma_th)
+
+    def set_pose(self, x, y, theta, covariance=None):
+        self.state[:] = (x, y, theta)
+        if covariance is not None:
+            self.P = np.array(covariance, dtype=np.float64).reshape(3, 3)
+        self.last_l = self.sensors.left
+        self.last_r = self.sensors.right
+
+    def detect_stuck(self, ranges, d, dth):
+        if ranges is None or abs(d) < 0.001:
+            return False
+
+        # Ranges are clipped to the lidar's minimum (0.12 m), so beams touching
+        # something read exactly that
+        very_close = np.sum((ranges > 0.05) & (ranges <= max(0.12, self.sensors.lidar_min)))
+
+        if very_close > self.sensors.lidar_res * 0.15:
+            if self.prev_ranges is not None and abs(d) > 0.003:
+                lidar_max = self.sensors.lidar_max
+                valid_mask = (ranges > 0.05) & (ranges < lidar_max * 0.9) & \
+                            (self.prev_ranges > 0.05) & (self.prev_ranges < lidar_max * 0.9)
+
+                if np.sum(valid_mask) > 20:
+                    range_change = np.mean(np.abs(ranges[valid_mask] - self.prev_ranges[valid_mask]))
+
+                    if range_change < 0.015:
+                        return True
+
+        return False
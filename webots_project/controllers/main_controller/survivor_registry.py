@@ -0,0 +1,195 @@
+# survivor_registry.py
+# Every survivor the robot has found, in one place, with a change feed
+#
+# Survivors are kept by id in the navigation frame and indexed by a uniform
+# grid hash of cell_size squares, so the survivors within a radius are found
+# by looking at the few cells the radius touches instead of at every survivor.
+# An observation within merge_radius of a known survivor is taken to be that
+# survivor again: its position becomes the confidence-weighted mean of the
+# observations, its observation count goes up, and its confidence combines
+# the observations' as independent evidence, 1 - prod(1 - c).
+#
+# Every change is numbered, and the registry keeps only each survivor's
+# latest change, in change order, with the numbers of its "added" and
+# "visited" changes: memory stays bounded by the number of survivors however
+# often they are seen again. A consumer (Mapping's markers, Communication's
+# survivor list, the visit scheduler) keeps a cursor from cursor() and gets
+# the survivors changed after it from changes(cursor), reading their current
+# state, so it never re-reads the whole registry. A survivor changed after the
+# cursor comes once, as "added" if it was added after the cursor, and with a
+# "visited" change if it was visited after the cursor; otherwise as "updated".
+# load() replaces everything, e.g. from a checkpoint; consumers then get
+# ("reset", None) followed by an "added" (and "visited") change for every
+# survivor.
+
+import math
+from collections import OrderedDict
+
+
+class Survivor:
+    def __init__(self, survivor_id, x, y, confidence):
+        self.id = survivor_id
+        self.x = x
+        self.y = y
+        self.weight = confidence            # Sum of observation confidences, for the mean position
+        self.observations = 1
+        self.confidence = confidence
+        self.visited = False
+
+    @property
+    def position(self):
+        return (self.x, self.y)
+
+
+class SurvivorRegistry:
+    def __init__(self, merge_radius=0.5, cell_size=None):
+        self.merge_radius = merge_radius    # Closer observations are the same survivor
+        self.cell_size = cell_size if cell_size is not None else merge_radius
+        self.survivors = {}                 # id -> Survivor
+        self.cells = {}                     # (i, j) -> ids of the survivors in the cell
+        self.next_id = 0
+        self.seq = 0                        # Number of the latest change
+        self.latest = OrderedDict()         # id -> number of its latest change, oldest first
+        self.added_at = {}                  # id -> number of its "added" change
+        self.visited_at = {}                # id -> number of its "visited" change
+        self.generation = 0                 # Bumped by load(); older cursors start over
+
+    def __len__(self):
+        return len(self.survivors)
+
+    def __iter__(self):
+        return iter(self.survivors.values())
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def place(self, survivor):
+        self.cells.setdefault(self.cell(survivor.x, survivor.y), []).append(survivor.id)
+
+    def unplace(self, survivor):
+        key = self.cell(survivor.x, survivor.y)
+        ids = self.cells[key]
+        ids.remove(survivor.id)
+        if not ids:
+            del self.cells[key]
+
+    # --- Queries -------------------------------------------------------------------
+
+    def near(self, x, y, radius=None):
+        # Survivors within radius (merge_radius by default), nearest first
+        radius = self.merge_radius if radius is None else radius
+        i0, j0 = self.cell(x - radius, y - radius)
+        i1, j1 = self.cell(x + radius, y + radius)
+        found = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for survivor_id in self.cells.get((i, j), ()):
+                    s = self.survivors[survivor_id]
+                    d = math.hypot(s.x - x, s.y - y)
+                    if d < radius:
+                        found.append((d, survivor_id))
+        found.sort()
+        return [self.survivors[survivor_id] for _, survivor_id in found]
+
+    def nearest(self, x, y, radius=None):
+        found = self.near(x, y, radius)
+        return found[0] if found else None
+
+    def visited(self):
+        return [s for s in self.survivors.values() if s.visited]
+
+    # --- Changes -------------------------------------------------------------------
+
+    def observe(self, x, y, confidence=0.8):
+        # One sighting at (x, y); returns the survivor it was merged into or added as
+        s = self.nearest(x, y)
+        if s is None:
+            s = Survivor(self.next_id, float(x), float(y), confidence)
+            self.next_id += 1
+            self.survivors[s.id] = s
+            self.place(s)
+            self.record("added", s.id)
+            return s
+        self.unplace(s)
+        s.weight += confidence
+        s.x += (x - s.x) * confidence / s.weight
+        s.y += (y - s.y) * confidence / s.weight
+        s.observations += 1
+        s.confidence = 1.0 - (1.0 - s.confidence) * (1.0 - confidence)
+        self.place(s)
+        self.record("updated", s.id)
+        return s
+
+    def mark_visited(self, survivor_id):
+        s = self.survivors[survivor_id]
+        if not s.visited:
+            s.visited = True
+            self.record("visited", s.id)
+        return s
+
+    # --- Change feed ---------------------------------------------------------------
+
+    def record(self, kind, survivor_id):
+        self.seq += 1
+        self.latest[survivor_id] = self.seq
+        self.latest.move_to_end(survivor_id)
+        if kind == "added":
+            self.added_at[survivor_id] = self.seq
+        elif kind == "visited":
+            self.visited_at[survivor_id] = self.seq
+
+    def cursor(self):
+        # Cursor past every change so far
+        return (self.generation, self.seq)
+
+    def changes(self, cursor=None):
+        # (cursor, [(kind, survivor)]) for the survivors changed after cursor; None starts from the beginning
+        generation, start = cursor if cursor is not None else (self.generation, 0)
+        if generation != self.generation:
+            events = [("reset", None)]
+            start = 0
+        else:
+            events = []
+        changed = []
+        for survivor_id in reversed(self.latest):
+            if self.latest[survivor_id] <= start:
+                break
+            changed.append(survivor_id)
+        for survivor_id in reversed(changed):
+            s = self.survivors[survivor_id]
+            added = self.added_at[survivor_id] > start
+            visited = self.visited_at.get(survivor_id, 0) > start
+            if added:
+                events.append(("added", s))
+            if visited:
+                events.append(("visited", s))
+            if not (added or visited):
+                events.append(("updated", s))
+        return self.cursor(), events
+
+    # --- Checkpoints ---------------------------------------------------------------
+
+    def state(self):
+        return [[s.id, s.x, s.y, s.weight, s.observations, s.confidence, s.visited]
+                for s in self.survivors.values()]
+
+    def load(self, rows):
+        # Replace every survivor with the rows from state(); the change numbers start over
+        self.survivors = {}
+        self.cells = {}
+        self.seq = 0
+        self.latest = OrderedDict()
+        self.added_at = {}
+        self.visited_at = {}
+        self.generation += 1
+        for survivor_id, x, y, weight, observations, confidence, visited in rows:
+            s = Survivor(int(survivor_id), float(x), float(y), float(confidence))
+            s.weight = float(weight)
+            s.observations = int(observations)
+            s.visited = bool(visited)
+            self.survivors[s.id] = s
+            self.place(s)
+            self.record("added", s.id)
+            if s.visited:
+                self.record("visited", s.id)
+        self.next_id = max(self.survivors, default=-1) + 1
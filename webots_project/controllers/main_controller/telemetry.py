@@ -0,0 +1,196 @@
+# telemetry.py
+# Structured log records from the controller modules, in place of print
+#
+#   telemetry.info("nav.state", "Hit obstacle -> WALL_FOLLOW", x=nav.x, y=nav.y)
+#
+# A record is a tuple put into a fixed-size ring buffer; formatting and I/O
+# happen on a background thread, which writes every record as one JSON line
+# (NDJSON) and echoes those at console_level or above to stdout. Records below
+# the logger's level, and records of a topic over its rate limit, are dropped
+# before anything is built; the next accepted record of that topic carries the
+# number suppressed. A limit set for a topic also covers the topics below it
+# ("controller.error" covers "controller.error.map"), each with its own budget,
+# so one noisy source does not hide the others. Until start() is called (offline tools, benchmarks) records
+# at console_level or above are printed straight away and nothing is buffered.
+#
+# The ring takes records from any thread without a lock: each record gets a
+# sequence number from an itertools.count, which is atomic under the GIL, and
+# goes into slot seq % capacity. The writer thread reads the slots in sequence
+# order; a slot holding an older number is not written yet, a newer one means
+# the producers lapped the writer and the records before it were lost. Only
+# the rate-limit bookkeeping of limited topics takes a lock.
+
+import atexit
+import itertools
+import json
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+
+class TelemetryLogger:
+    def __init__(self, capacity=4096, level=DEBUG, console_level=INFO, rate_limits=None,
+                 flush_interval=0.5, clock=time.monotonic):
+        self.capacity = capacity
+        self.level = level                      # Records below this are dropped
+        self.console_level = console_level      # Records at or above this are also printed
+        # Most records per second for each topic; topics not listed are not limited
+        self.rate_limits = dict(rate_limits or {})
+        self.flush_interval = flush_interval
+        self.clock = clock                      # e.g. robot.getTime, for limits in simulated time
+
+        self.slots = [None] * capacity
+        self.sequence = itertools.count()
+        self.read_seq = 0
+        self.next_allowed = {}                  # Topic -> earliest time of its next record
+        self.suppressed = {}                    # Topic -> records dropped by its rate limit
+        self.topic_limits = {}                  # Topic -> limit from itself or the nearest parent
+        self.limit_lock = threading.Lock()
+
+        self.path = None
+        self.file = None
+        self.thread = None
+        self.wake = threading.Event()
+        self.stopping = False
+        self.lost = 0                           # Records overwritten before the writer got to them
+        self.written = 0
+
+    # --- Producers -------------------------------------------------------------------
+
+    def log(self, level, topic, message, fields):
+        if level < self.level:
+            return
+        now = self.clock()
+        limit = self.limit_for(topic)
+        if limit is not None:
+            with self.limit_lock:
+                if now < self.next_allowed.get(topic, 0.0):
+                    self.suppressed[topic] = self.suppressed.get(topic, 0) + 1
+                    return
+                self.next_allowed[topic] = now + 1.0 / limit
+                dropped = self.suppressed.pop(topic, 0)
+            if dropped:
+                fields["suppressed"] = dropped
+        if self.thread is None:
+            if level >= self.console_level:
+                print(self.format(level, topic, message, fields))
+            return
+        seq = next(self.sequence)
+        self.slots[seq % self.capacity] = (seq, now, level, topic, message, fields)
+
+    def limit_for(self, topic):
+        # Records per second allowed for topic, None when it is not limited
+        if topic not in self.topic_limits:
+            limit = None
+            parts = topic.split(".")
+            for n in range(len(parts), 0, -1):
+                limit = self.rate_limits.get(".".join(parts[:n]))
+                if limit is not None:
+                    break
+            self.topic_limits[topic] = limit
+        return self.topic_limits[topic]
+
+    # --- Writer ----------------------------------------------------------------------
+
+    def start(self, path=None):
+        # Write records to path (NDJSON, appended) from a background thread;
+        # without a path they are only echoed to the console
+        if self.thread is not None:
+            return
+        self.path = path
+        if path is not None:
+            self.file = open(path, "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping = True
+        self.wake.set()
+        self.thread.join(timeout=2.0)
+        self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print("telemetry flush error:", e)
+            if self.stopping:
+                return
+
+    def flush(self):
+        # Write every record published so far, oldest first
+        lines = []
+        echo = []
+        while True:
+            record = self.slots[self.read_seq % self.capacity]
+            if record is None or record[0] < self.read_seq:
+                break
+            if record[0] > self.read_seq:
+                # Lapped: only the last capacity records are still in the ring
+                oldest = record[0] - self.capacity + 1
+                self.lost += oldest - self.read_seq
+                self.read_seq = oldest
+                continue
+            seq, now, level, topic, message, fields = record
+            self.read_seq += 1
+            if self.file is not None:
+                entry = {"t": round(now, 4), "level": LEVEL_NAMES.get(level, level),
+                         "topic": topic, "msg": message}
+                entry.update(fields)
+                lines.append(json.dumps(entry, default=str))
+            if level >= self.console_level:
+                echo.append(self.format(level, topic, message, fields))
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+        if echo:
+            print("\n".join(echo))
+        self.written += len(lines)
+
+    def format(self, level, topic, message, fields):
+        text = message
+        if fields:
+            text += " " + " ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}"
+                                   for k, v in fields.items())
+        if level >= WARNING:
+            text = LEVEL_NAMES.get(level, str(level)) + " " + text
+        return text
+
+
+# Logger shared by all modules; main_controller configures and starts it
+logger = TelemetryLogger(rate_limits={
+    "nav.pose": 2.0,
+    "nav.progress": 2.0,
+    "controller.error": 2.0,
+    "detection.error": 2.0,
+})
+
+
+def debug(topic, message, **fields):
+    logger.log(DEBUG, topic, message, fields)
+
+
+def info(topic, message, **fields):
+    logger.log(INFO, topic, message, fields)
+
+
+def warning(topic, message, **fields):
+    logger.log(WARNING, topic, message, fields)
+
+
+def error(topic, message, **fields):
+    logger.log(ERROR, topic, message, fields)
@@ -0,0 +1,6 @@
+# Tests run offline against the stand-in devices in stand_ins.py; the
+# controller modules import each other by bare name, as Webots runs them
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,250 @@
+# stand_ins.py
+# Stand-ins for the Webots devices and a synthetic world, so the controller
+# modules run offline in the tests and in benchmarks.py
+
+import math
+import numpy as np
+
+
+class SyntheticWorld:
+    # Walled room with a few boxes, lidar ranges are computed by ray casting
+    def __init__(self, size=6.0, boxes=None):
+        h = size / 2.0
+        self.segments = [(-h, -h, h, -h), (h, -h, h, h), (h, h, -h, h), (-h, h, -h, -h)]
+        if boxes is None:
+            boxes = [(1.0, 1.0, 0.6), (-2.0, 1.5, 0.4), (1.5, -2.0, 0.8), (-1.5, -1.0, 0.5)]
+        for bx, by, bw in boxes:
+            self.add_box(bx, by, bw)
+        self.segments = np.array(self.segments, dtype=np.float64)
+        self.x = 0.0
+        self.y = 0.0
+        self.th = 0.0
+
+    def add_box(self, cx, cy, w):
+        c = [(cx - w / 2, cy - w / 2), (cx + w / 2, cy - w / 2), (cx + w / 2, cy + w / 2), (cx - w / 2, cy + w / 2)]
+        for i in range(4):
+            self.segments.append(c[i] + c[(i + 1) % 4])
+
+    def ranges(self, angles, max_range):
+        # Distance along every world-frame angle to the nearest segment
+        dx = np.cos(angles)[:, None]
+        dy = np.sin(angles)[:, None]
+        x1, y1, x2, y2 = [self.segments[:, i][None, :] for i in range(4)]
+        ex = x2 - x1
+        ey = y2 - y1
+        den = dx * ey - dy * ex
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((x1 - self.x) * ey - (y1 - self.y) * ex) / den
+            u = ((x1 - self.x) * dy - (y1 - self.y) * dx) / den
+        t = np.where((np.abs(den) > 1e-12) & (t > 0) & (u >= 0) & (u <= 1), t, np.inf)
+        return np.minimum(t.min(axis=1), max_range)
+
+
+class StandInDevice:
+    def __init__(self, value=None):
+        self.value = value
+
+    def enable(self, sampling_period):
+        pass
+
+    def disable(self):
+        pass
+
+    def getValue(self):
+        return self.value
+
+
+class StandInLidar(StandInDevice):
+    def __init__(self, world, resolution=360, max_range=3.5):
+        super().__init__()
+        self.world = world
+        self.resolution = resolution
+        self.max_range = max_range
+
+    def getHorizontalResolution(self):
+        return self.resolution
+
+    def getFov(self):
+        return 2 * math.pi
+
+    def getMinRange(self):
+        return 0.12
+
+    def getMaxRange(self):
+        return self.max_range
+
+    def getRangeImage(self):
+        # Webots lidar images run left to right (clockwise) and measure in float32
+        beams = np.linspace(math.pi, -math.pi, self.resolution)
+        return self.world.ranges(self.world.th + beams, self.max_range).astype(np.float32).tolist()
+
+
+class StandInIMU(StandInDevice):
+    def __init__(self, world):
+        super().__init__()
+        self.world = world
+
+    def getRollPitchYaw(self):
+        return [0.0, 0.0, self.world.th]
+
+
+class StandInDisplay(StandInDevice):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class StandInCamera(StandInDevice):
+    # Serves the given BGRA frames in turn, one per sampling period
+    def __init__(self, frames, width=640, height=480, fov=1.047):
+        super().__init__()
+        self.frames = frames
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self.period = None
+        self.reads = 0
+
+    def enable(self, sampling_period):
+        self.period = sampling_period
+
+    def disable(self):
+        self.period = None
+
+    def getImage(self):
+        if self.period is None:
+            return None
+        self.reads += 1
+        return self.frames[self.reads % len(self.frames)]
+
+    def getFov(self):
+        return self.fov
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+
+class StandInCameraMotor(StandInDevice):
+    # Turns its position sensor at the set velocity when step() is called
+    def __init__(self):
+        super().__init__()
+        self.velocity = 0.0
+        self.sensor = StandInDevice(0.0)
+
+    def setVelocity(self, velocity):
+        self.velocity = velocity
+
+    def setPosition(self, position):
+        pass
+
+    def getPositionSensor(self):
+        return self.sensor
+
+    def step(self, dt):
+        self.sensor.value += self.velocity * dt
+
+
+class StandInWheelMotor(StandInDevice):
+    # Velocity-controlled wheel motor; the set velocity is read back by the test
+    def __init__(self):
+        super().__init__(0.0)
+
+    def setPosition(self, position):
+        pass
+
+    def setVelocity(self, velocity):
+        self.value = velocity
+
+    def getVelocity(self):
+        return self.value
+
+
+class StandInRobot:
+    def __init__(self, world, timestep=32):
+        self.world = world
+        self.timestep = timestep
+        self.time = 0.0
+        # Factors the encoders over-report each wheel's travel by, to simulate slip
+        self.encoder_scale = (1.0, 1.0)
+        self.devices = {
+            "display": StandInDisplay(),
+            "LDS-01": StandInLidar(world),
+            "inertial unit": StandInIMU(world),
+            "left wheel sensor": StandInDevice(0.0),
+            "right wheel sensor": StandInDevice(0.0),
+        }
+
+    def getBasicTimeStep(self):
+        return self.timestep
+
+    def getDevice(self, name):
+        return self.devices[name]
+
+    def getTime(self):
+        return self.time
+
+    def drive(self, d, dth, wheel_radius=0.033, wheel_base=0.160):
+        # Move the robot by one timestep and advance the encoders to match
+        self.time += self.timestep / 1000.0
+        self.world.x += d * math.cos(self.world.th + 0.5 * dth)
+        self.world.y += d * math.sin(self.world.th + 0.5 * dth)
+        self.world.th = math.atan2(math.sin(self.world.th + dth), math.cos(self.world.th + dth))
+        self.devices["left wheel sensor"].value += self.encoder_scale[0] * (d - 0.5 * dth * wheel_base) / wheel_radius
+        self.devices["right wheel sensor"].value += self.encoder_scale[1] * (d + 0.5 * dth * wheel_base) / wheel_radius
+
+
+def map_pose(world):
+    # True pose in Mapping's frame, which mirrors the world across the x axis
+    return world.x, -world.y, -world.th
+
+
+def build_mapped_robot(loops=2):
+    # Drive a square loop with straight moves and turns in place, so odometry is exact
+    # and the map is a clean reference to match against
+    import mapping
+    world = SyntheticWorld()
+    robot = StandInRobot(world)
+    mapper = mapping.Mapping(robot)
+    mapper.USE_SCAN_MATCHING = False
+    for _ in range(4 * loops):
+        for _ in range(50):
+            robot.drive(0.01, 0.0)
+            mapper.update()
+        for _ in range(10):
+            robot.drive(0.0, math.pi / 20)
+            mapper.update()
+    mapper.USE_SCAN_MATCHING = True
+    return world, robot, mapper
+
+
+def synthetic_frames(count, width=640, height=480, seed=0):
+    # Camera-like BGRA frames: a shaded floor and walls, grey clutter, a few
+    # red survivors with lighting gradients, and sensor noise
+    import cv2
+    rng = np.random.default_rng(seed)
+    rows = np.linspace(0.0, 1.0, height)[:, None, None]
+    frames = []
+    for _ in range(count):
+        wall = rng.uniform(90, 200, 3)
+        floor = rng.uniform(60, 140, 3)
+        horizon = int(height * rng.uniform(0.35, 0.55))
+        image = np.where(np.arange(height)[:, None, None] < horizon, wall, floor * (0.7 + 0.3 * rows))
+        image = np.broadcast_to(image, (height, width, 3)).copy()
+        for _ in range(rng.integers(3, 8)):
+            x, y = rng.integers(0, width), rng.integers(horizon - 40, height)
+            cv2.rectangle(image, (int(x), int(y)), (int(x + rng.integers(20, 120)), int(y + rng.integers(20, 120))),
+                          rng.uniform(40, 220, 3).tolist(), -1)
+        for _ in range(rng.integers(0, 4)):
+            centre = (int(rng.integers(40, width - 40)), int(rng.integers(horizon, height - 20)))
+            axes = (int(rng.integers(15, 60)), int(rng.integers(25, 90)))
+            shade = rng.uniform(0.6, 1.0)
+            cv2.ellipse(image, centre, axes, 0.0, 0.0, 360.0,
+                        (rng.uniform(10, 50) * shade, rng.uniform(10, 50) * shade, rng.uniform(160, 255) * shade), -1)
+        image += rng.normal(0.0, 6.0, image.shape)
+        bgra = np.empty((height, width, 4), dtype=np.uint8)
+        bgra[..., :3] = np.clip(image, 0, 255)
+        bgra[..., 3] = 255
+        frames.append(bgra.tobytes())
+    return frames
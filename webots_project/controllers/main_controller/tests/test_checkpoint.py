@@ -0,0 +1,127 @@
+import copy
+import math
+import numpy as np
+import checkpoint
+import distance_field
+import frontier
+import mapping
+import planner
+import scheduler
+import stand_ins
+from survivor_registry import SurvivorRegistry
+
+
+class StandInNavigation:
+    def __init__(self, planner):
+        self.planner = planner
+        self.goal = None
+
+
+class StandInDetector:
+    def __init__(self, explorer):
+        self.registry = SurvivorRegistry()
+        self.registry_cursor = None
+        self.scheduler = scheduler.VisitScheduler()
+        self.explorer = explorer
+        self.visiting = False
+
+
+def controller_modules(robot):
+    # The mapper with the listeners main_controller attaches to it
+    mapper = mapping.Mapping(robot)
+    field = distance_field.DistanceField(mapper)
+    grid_planner = planner.GridPlanner(field)
+    explorer = frontier.FrontierTracker(mapper, grid_planner.path_costs)
+    return mapper, StandInDetector(explorer), StandInNavigation(grid_planner)
+
+
+def restarted(robot):
+    # The same robot in the same world, as a restarted controller finds it
+    robot_b = stand_ins.StandInRobot(copy.deepcopy(robot.world))
+    robot_b.time = robot.time
+    robot_b.encoder_scale = robot.encoder_scale
+    for name in ("left wheel sensor", "right wheel sensor"):
+        robot_b.devices[name].value = robot.devices[name].value
+    return robot_b
+
+
+def drive(robot, mapper, steps, turn=0.0):
+    for _ in range(steps):
+        robot.drive(0.01, turn)
+        mapper.update()
+
+
+def same_layer(a, b):
+    ax0, ay0, ax1, ay1 = a.bounds()
+    bx0, by0, bx1, by1 = b.bounds()
+    x0, y0, x1, y1 = min(ax0, bx0), min(ay0, by0), max(ax1, bx1), max(ay1, by1)
+    return np.array_equal(a.window(x0, y0, x1, y1), b.window(x0, y0, x1, y1))
+
+
+def assert_same_state(a, b, field=True):
+    (mapper_a, detector_a, nav_a), (mapper_b, detector_b, nav_b) = a, b
+    layers = [(getattr(*checkpoint.get_layer(mapper_a, name)), getattr(*checkpoint.get_layer(mapper_b, name)), name)
+              for name in checkpoint.MAP_LAYERS]
+    if field:
+        layers += [(getattr(nav_a.planner.field, name), getattr(nav_b.planner.field, name), name)
+                   for name in checkpoint.FIELD_LAYERS]
+    for layer_a, layer_b, name in layers:
+        assert same_layer(layer_a, layer_b), name
+    assert mapper_a.known_cells == mapper_b.known_cells
+    assert mapper_a.estimator.pose() == mapper_b.estimator.pose()
+    assert detector_a.explorer.cells == detector_b.explorer.cells
+    assert detector_a.explorer.cluster() == detector_b.explorer.cluster()
+
+
+def test_restored_controller_keeps_updating_bit_identically(tmp_path):
+    world = stand_ins.SyntheticWorld()
+    robot = stand_ins.StandInRobot(world)
+    robot.encoder_scale = (1.02, 0.99)
+    original = controller_modules(robot)
+    mapper = original[0]
+    for turn in (0.0, math.pi / 40, 0.0, -math.pi / 60):
+        drive(robot, mapper, 60, turn)
+
+    path = str(tmp_path / "controller.ckpt")
+    checkpoint.write(path, *checkpoint.capture(mapper, *original[1:], mapper.estimator))
+
+    robot_b = restarted(robot)
+    restored = controller_modules(robot_b)
+    mapper_b = restored[0]
+    checkpoint.restore(*checkpoint.read(path), mapper_b, *restored[1:], mapper_b.estimator)
+    assert_same_state(original, restored)
+
+    # Both carry on into unexplored parts of the room
+    for turn in (math.pi / 30, 0.0, -math.pi / 30, 0.0):
+        drive(robot, mapper, 50, turn)
+        drive(robot_b, mapper_b, 50, turn)
+        assert_same_state(original, restored)
+    goal = (-2.2, -2.2)
+    start = mapper.estimator.pose()[:2]
+    assert original[2].planner.plan(start, goal) == restored[2].planner.plan(start, goal)
+
+
+def test_checkpoints_without_the_distance_field_are_replayed(tmp_path):
+    world = stand_ins.SyntheticWorld()
+    robot = stand_ins.StandInRobot(world)
+    original = controller_modules(robot)
+    mapper = original[0]
+    drive(robot, mapper, 100, math.pi / 50)
+
+    state, arrays = checkpoint.capture(mapper, *original[1:], mapper.estimator)
+    for name in list(arrays):
+        if name.startswith(("distance_field.", "frontier.")):
+            del arrays[name]
+    path = str(tmp_path / "controller.ckpt")
+    checkpoint.write(path, state, arrays)
+
+    restored = controller_modules(restarted(robot))
+    checkpoint.restore(*checkpoint.read(path), restored[0], *restored[1:], restored[0].estimator)
+    # The distance field is built again from the restored obstacles, so it can
+    # differ slightly from the original, which was repaired step by step
+    assert_same_state(original, restored, field=False)
+    field = restored[2].planner.field
+    assert same_layer(field.occupied, original[2].planner.field.occupied)
+    rebuilt = distance_field.DistanceField(restored[0])
+    for name in checkpoint.FIELD_LAYERS:
+        assert same_layer(getattr(rebuilt, name), getattr(field, name)), name
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from debug_viewer import FrameRing
+
+WIDTH, HEIGHT = 32, 24
+
+
+def publish(ring, i):
+    # Frame, mask and box all carry the frame number, so a torn read shows up
+    image = np.full((HEIGHT, WIDTH, 4), i % 256, dtype=np.uint8).tobytes()
+    ring.publish(image, np.full((HEIGHT // 2, WIDTH // 2), i % 256, dtype=np.uint8), [(i, i, i, i)])
+
+
+def consistent(latest):
+    seq, frame, mask, boxes = latest
+    return (frame == seq % 256).all() and (mask == seq % 256).all() and boxes.tolist() == [[seq] * 4]
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing(WIDTH, HEIGHT, slots=4)
+    yield ring
+    ring.close()
+
+
+def test_latest_is_the_newest_complete_frame(ring):
+    assert ring.latest() is None
+    for i in range(10):
+        publish(ring, i)
+    latest = ring.latest()
+    assert latest[0] == 9 and consistent(latest)
+    assert latest[2].shape == (HEIGHT // 2, WIDTH // 2)
+    assert ring.latest(after=9) is None
+    assert ring.latest(after=7)[0] == 9
+
+    # Frame 10 half written over frame 6 leaves the newer frames readable
+    ring.sequence[10 % ring.slots] = -1
+    latest = ring.latest()
+    assert latest[0] == 9 and consistent(latest)
+
+
+def read_while_publishing(ring, frames):
+    # latest(), with the frames published while it copies the newest slot's frame
+    slot = (int(ring.header[4]) - 1) % ring.slots
+    view = ring.frames[slot]
+
+    class Interrupted:
+        def copy(self):
+            copied = view.copy()
+            ring.frames[slot] = view
+            for i in frames:
+                publish(ring, i)
+            return copied
+
+    ring.frames[slot] = Interrupted()
+    try:
+        return ring.latest()
+    finally:
+        ring.frames[slot] = view
+
+
+def test_frame_overwritten_while_read_is_not_returned(ring):
+    for i in range(6):
+        publish(ring, i)
+    # The writer laps the ring during the read: frame 5's slot now holds frame 9,
+    # and every older frame is gone too
+    assert read_while_publishing(ring, range(6, 10)) is None
+    latest = ring.latest()
+    assert latest[0] == 9 and consistent(latest)
+
+    # Frames published into the other slots during the read leave it intact
+    latest = read_while_publishing(ring, range(10, 13))
+    assert latest[0] == 9 and consistent(latest)
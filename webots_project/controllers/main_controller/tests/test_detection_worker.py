@@ -0,0 +1,91 @@
+import detection
+import sensors
+import stand_ins
+from detection_worker import DetectionWorker, FrameCapture
+
+
+class LateWorker(DetectionWorker):
+    # Worker whose thread always finishes the frame in hand just after the
+    # control loop's results() has returned: the interleaving that used to end
+    # a scan with its last frames uncollected
+    def __init__(self, analyse):
+        super().__init__(analyse, threaded=False)
+        self.held = None
+
+    def submit(self, image, time_s, camera_angle, pose):
+        capture = FrameCapture(self.submitted, image, time_s, camera_angle, pose)
+        self.submitted += 1
+        with self.lock:
+            self.held = capture
+            self.active = True
+        return capture.seq
+
+    def results(self):
+        done = super().results()
+        if self.held is not None:
+            capture, self.held = self.held, None
+            self.finish(capture)
+        return done
+
+
+class StandInNav:
+    x = y = theta = 0.0
+    goalreached = False
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def reset(self, new_goal=None):
+        pass
+
+
+def test_frame_finished_after_results_keeps_the_worker_busy():
+    worker = LateWorker(lambda image: ([0.1], [1.0], 0.5))
+    worker.submit(b"", 0.0, 0.0, (0.0, 0.0, 0.0))
+    assert worker.results() == []
+    assert not worker.idle()
+    assert [c.seq for c in worker.results()] == [0]
+    assert worker.idle()
+
+
+def test_wait_returns_the_analysed_frames():
+    worker = DetectionWorker(lambda image: ([0.1], [1.0], 0.5))
+    try:
+        for seq in range(3):
+            worker.submit(b"", seq * 0.032, 0.0, (0.0, 0.0, 0.0))
+        done = worker.wait(timeout=5.0)
+        assert done and done[-1].seq == 2
+        assert worker.idle()
+    finally:
+        worker.close()
+
+
+def test_scan_completes_only_after_every_frame_is_processed():
+    world = stand_ins.SyntheticWorld()
+    robot = stand_ins.StandInRobot(world)
+    camera = stand_ins.StandInCamera(stand_ins.synthetic_frames(4))
+    motor = stand_ins.StandInCameraMotor()
+    robot.devices.update({"rgb_camera": camera, "camera_motor": motor})
+    snapshot = sensors.SensorSnapshot(robot, robot.timestep)
+    detector = detection.Detection(robot, snapshot, threaded=False)
+    detector.nav = StandInNav()
+    detector.worker = LateWorker(detector.analyse_frame)
+
+    processed = []
+    process_contours = detector.process_contours
+    detector.process_contours = lambda capture: (processed.append(capture.seq), process_contours(capture))
+
+    for _ in range(2000):
+        robot.time += robot.timestep / 1000.0
+        motor.step(robot.timestep / 1000.0)
+        snapshot.read()
+        # Frames submitted before the step that finishes the scan are the scan's
+        submitted = detector.worker.submitted
+        detector.detect()
+        if detector.scan_done:
+            break
+    assert detector.scan_done
+    assert processed == list(range(submitted))
@@ -0,0 +1,53 @@
+import math
+import numpy as np
+import distance_field
+import mapping
+import stand_ins
+
+
+def brute_force(field, obstacles, x0, y0, x1, y1):
+    # Distance in cells from every window cell to the nearest obstacle, capped
+    xs, ys = np.meshgrid(np.arange(x0, x1), np.arange(y0, y1), indexing="ij")
+    best = np.full(xs.shape, field.max_cells)
+    for ox, oy in obstacles:
+        best = np.minimum(best, np.hypot(xs - ox, ys - oy))
+    return best
+
+
+def test_incremental_field_matches_brute_force_through_adds_and_removals():
+    rng = np.random.default_rng(0)
+    mapper = mapping.Mapping(stand_ins.StandInRobot(stand_ins.SyntheticWorld()))
+    field = distance_field.DistanceField(mapper)
+    c = mapper.MAP_W // 2
+    obstacles = set()
+    for _ in range(40):
+        # Toggle a few cells: free ones become obstacles, obstacles become free
+        cells = sorted(set(zip(rng.integers(c - 40, c + 40, 6).tolist(), rng.integers(c - 40, c + 40, 6).tolist())))
+        cx = np.array([x for x, _ in cells])
+        cy = np.array([y for _, y in cells])
+        values = np.array([-2.0 if cell in obstacles else 2.0 for cell in cells])
+        obstacles ^= set(cells)
+        mapper.flipped_cells = []
+        mapper.set_cells(cx, cy, values)
+        field.on_cells_flipped(mapper.flipped_cells)
+
+        x0, y0, x1, y1 = c - 55, c - 55, c + 55, c + 55
+        expected = brute_force(field, obstacles, x0, y0, x1, y1)
+        assert np.allclose(field.distance.window(x0, y0, x1, y1), expected, atol=1e-5)
+
+
+def test_field_kept_up_while_mapping_matches_one_built_from_scratch():
+    world = stand_ins.SyntheticWorld()
+    robot = stand_ins.StandInRobot(world)
+    mapper = mapping.Mapping(robot)
+    field = distance_field.DistanceField(mapper)
+    for _ in range(4):
+        for _ in range(50):
+            robot.drive(0.01, 0.0)
+            mapper.update()
+        for _ in range(10):
+            robot.drive(0.0, math.pi / 20)
+            mapper.update()
+    rebuilt = distance_field.DistanceField(mapper)
+    bounds = mapper.grid.bounds()
+    assert np.array_equal(field.distance.window(*bounds), rebuilt.distance.window(*bounds))
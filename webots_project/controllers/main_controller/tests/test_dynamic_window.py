@@ -0,0 +1,65 @@
+import math
+import numpy as np
+from navigation import DynamicWindow
+
+
+class ScanSensors:
+    # The parts of sensors.SensorSnapshot the dynamic window reads
+    def __init__(self, points=()):
+        self.beam_angles = np.linspace(-math.pi, math.pi, 360, endpoint=False)
+        self.ranges = np.full(360, np.inf, dtype=np.float32)
+        for x, y in points:
+            # Beam angles are clockwise in the robot frame
+            i = int(np.argmin(np.abs((self.beam_angles + math.atan2(y, x) + math.pi) % (2 * math.pi) - math.pi)))
+            self.ranges[i] = min(self.ranges[i], math.hypot(x, y))
+        self.valid = np.isfinite(self.ranges)
+
+
+def wall(x0, y0, x1, y1, n=60):
+    return [(x0 + (x1 - x0) * k / n, y0 + (y1 - y0) * k / n) for k in range(n + 1)]
+
+
+def test_chosen_velocities_stay_inside_the_acceleration_window():
+    rng = np.random.default_rng(0)
+    for points in ((), wall(0.6, -0.5, 0.6, 0.5), wall(0.3, 0.15, 1.0, 0.15) + wall(0.3, -0.15, 1.0, -0.15)):
+        dwa = DynamicWindow(ScanSensors(points), 6.28, 32)
+        for _ in range(50):
+            v_now = rng.uniform(0.0, dwa.v_max)
+            w_now = rng.uniform(-dwa.w_max, dwa.w_max)
+            best = dwa.plan(*rng.uniform(-2.0, 2.0, 2), v_now, w_now)
+            if best is None:
+                continue
+            v, w = best
+            reach_v = dwa.accel * dwa.window_time
+            reach_w = dwa.angular_accel * dwa.window_time
+            assert max(0.0, v_now - reach_v) - 1e-9 <= v <= min(dwa.v_max, v_now + reach_v) + 1e-9
+            assert max(-dwa.w_max, w_now - reach_w) - 1e-9 <= w <= min(dwa.w_max, w_now + reach_w) + 1e-9
+            assert abs(v) + 0.5 * 0.160 * abs(w) <= dwa.v_max + 1e-9
+
+
+def test_chosen_arc_keeps_clear_of_the_scan():
+    # Posts and walls around the way to the target: the arc driven keeps the
+    # robot's radius and safety margin away from every scan point
+    rng = np.random.default_rng(1)
+    layouts = [wall(0.4, -0.3, 0.4, 0.3), [(0.35, 0.0), (0.3, 0.05), (0.3, -0.05)],
+               wall(0.25, 0.12, 1.0, 0.12) + [(0.45, 0.0)], wall(0.2, -0.2, 0.6, 0.4)]
+    for points in layouts:
+        points = np.array(points)
+        dwa = DynamicWindow(ScanSensors(points), 6.28, 32)
+        for _ in range(40):
+            best = dwa.plan(rng.uniform(0.5, 2.0), rng.uniform(-0.5, 0.5), rng.uniform(0.0, dwa.v_max), 0.0)
+            if best is None:
+                continue
+            x, y, _ = dwa.rollout(np.array([best[0]]), np.array([best[1]]))
+            gap = np.hypot(x[0][:, None] - points[None, :, 0], y[0][:, None] - points[None, :, 1]).min()
+            # Scan points and arc points snap to the local grid, a cell diagonal at most
+            assert gap > dwa.robot_radius + dwa.safety_margin - 1.5 * dwa.grid_resolution
+
+
+def test_every_arc_blocked_returns_none():
+    # Scan points all round the robot, closer than its radius plus the margin
+    ring = [(0.12 * math.cos(a), 0.12 * math.sin(a)) for a in np.linspace(-math.pi, math.pi, 90, endpoint=False)]
+    dwa = DynamicWindow(ScanSensors(ring), 6.28, 32)
+    assert dwa.plan(1.0, 0.0, 0.05, 0.0) is None
+    assert dwa.candidates > 0 and dwa.admissible == 0
+
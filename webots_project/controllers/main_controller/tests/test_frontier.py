@@ -0,0 +1,49 @@
+import math
+import numpy as np
+import frontier
+import mapping
+import stand_ins
+from tiled_grid import pack_cells, unpack_cells
+
+
+def rescan(mapper, tracker):
+    # Frontier cells found by checking every free cell
+    cx, cy = mapper.grid.find(lambda v: v < -mapper.KNOWN_THRESH)
+    found = tracker.is_frontier(cx, cy)
+    return set(pack_cells(cx[found], cy[found]).tolist())
+
+
+def mapped_room():
+    world = stand_ins.SyntheticWorld()
+    robot = stand_ins.StandInRobot(world)
+    mapper = mapping.Mapping(robot)
+    tracker = frontier.FrontierTracker(mapper)
+    for _ in range(4):
+        for _ in range(50):
+            robot.drive(0.01, 0.0)
+            mapper.update()
+        for _ in range(10):
+            robot.drive(0.0, math.pi / 20)
+            mapper.update()
+    return mapper, tracker
+
+
+def test_incremental_frontier_matches_rescan():
+    mapper, tracker = mapped_room()
+    assert tracker.cells
+    assert tracker.cells == rescan(mapper, tracker)
+
+
+def test_unknown_cells_becoming_weakly_occupied_end_the_frontier():
+    # Raise the unknown neighbours of every frontier cell to between KNOWN_THRESH
+    # and OCC_THRESH: they stop being unknown without becoming obstacles
+    mapper, tracker = mapped_room()
+    cx, cy = unpack_cells(np.fromiter(tracker.cells, dtype=np.int64))
+    keys = np.unique(np.concatenate([pack_cells(cx + dx, cy + dy) for dx, dy in frontier.NEIGHBOURS_4]))
+    nx, ny = unpack_cells(keys)
+    unknown = mapper.cell_state(mapper.grid[nx, ny]) == 0
+    level = 0.5 * (mapper.KNOWN_THRESH + mapper.OCC_THRESH)
+    mapper.set_cells(nx[unknown], ny[unknown], np.full(int(unknown.sum()), level, dtype=np.float32))
+    tracker.on_cells_changed(mapper.changed_cells)
+    mapper.changed_cells = []
+    assert tracker.cells == rescan(mapper, tracker)
@@ -0,0 +1,270 @@
+import numpy as np
+import cv2
+import mapping
+import stand_ins
+from tiled_grid import pack_cells
+
+
+def build_mapper():
+    world = stand_ins.SyntheticWorld()
+    robot = stand_ins.StandInRobot(world)
+    return world, mapping.Mapping(robot)
+
+
+def integrate_beam_by_beam(m, free_x, free_y, hit_x, hit_y, free_ray):
+    # The per-beam, per-cell loop Mapping.update used before integrate_rays, over
+    # the same ray cells (beam b: its free cells in order, then its hit)
+    for b in range(len(hit_x)):
+        cells = list(zip(free_x[free_ray == b], free_y[free_ray == b])) + [(hit_x[b], hit_y[b])]
+        for j, (cx, cy) in enumerate(cells):
+            v = float(m.grid.value(cx, cy))
+            at = (np.array([cx]), np.array([cy]))
+            if j < len(cells) - 1:
+                if v < 4.0:
+                    m.grid[at] = m.range(v + m.L_FREE, m.LOG_ODDS_MIN, m.LOG_ODDS_MAX)
+            else:
+                hits = min(int(m.occ_hits.value(cx, cy)) + 1, 65535)
+                m.occ_hits[at] = hits
+                if hits >= m.OCC_CONFIRM:
+                    m.grid[at] = m.range(v + m.L_OCC, m.LOG_ODDS_MIN, m.LOG_ODDS_MAX)
+
+
+def test_integrate_rays_matches_beam_by_beam_loop():
+    world, vectorized = build_mapper()
+    _, reference = build_mapper()
+    rng = np.random.default_rng(0)
+    # Start from a map with evidence on both sides of the 4.0 protection and the clip limits
+    x0, y0 = vectorized.MAP_W // 2 - 40, vectorized.MAP_H // 2 - 40
+    start = rng.uniform(-8.0, 8.0, (80, 80)).astype(np.float32)
+    for m in (vectorized, reference):
+        m.grid.set_window(x0, y0, start)
+    for scan in range(60):
+        # Few poses, so endpoints repeat and pass OCC_CONFIRM
+        world.x, world.y, world.th = [(0.0, 0.0, 0.0), (0.4, -0.3, 1.0), (-0.5, 0.6, 2.5)][scan % 3]
+        ranges = (world.ranges(world.th + vectorized.beam_angles.astype(np.float64), vectorized.lidar_max)
+                  + rng.normal(0.0, 0.02, vectorized.lidar_res)).astype(np.float32)
+        ranges = np.clip(ranges, vectorized.lidar_min, vectorized.lidar_max)
+        for m in (vectorized, reference):
+            m.x, m.y, m.th = stand_ins.map_pose(world)
+        robot_mx, robot_my = vectorized.world_to_map(vectorized.x, vectorized.y)
+        rays = vectorized.cast_rays(ranges, robot_mx, robot_my)
+        vectorized.integrate_rays(*rays)
+        integrate_beam_by_beam(reference, *rays)
+
+    bx0, by0, bx1, by1 = reference.grid.bounds()
+    np.testing.assert_allclose(vectorized.grid.window(bx0, by0, bx1, by1),
+                               reference.grid.window(bx0, by0, bx1, by1), atol=1e-4)
+    np.testing.assert_array_equal(vectorized.occ_hits.window(bx0, by0, bx1, by1),
+                                  reference.occ_hits.window(bx0, by0, bx1, by1))
+
+
+class Geometry:
+    # Just the attributes RayTemplates reads from Mapping
+    def __init__(self, lidar_max, resolution):
+        self.lidar_max = lidar_max
+        self.RESOLUTION = resolution
+
+
+def test_ray_templates_follow_trace_ray_up_to_half_cell_ties():
+    _, m = build_mapper()
+    templates = m.ray_templates
+    r = templates.radius
+    for dx in range(-r, r + 1):
+        for dy in range(-r, r + 1):
+            off_x, off_y, steps = templates.lookup(np.array([dx]), np.array([dy]))
+            n = int(steps[0])
+            traced = m.trace_ray(0, 0, dx, dy)
+            for k, ((tx, ty), ox, oy) in enumerate(zip(traced, off_x[0, :n], off_y[0, :n])):
+                # Only points exactly half-way between two cells may differ
+                for t, o, d in ((tx, ox, dx), (ty, oy, dy)):
+                    if t != o:
+                        assert 2 * (k * abs(d) % n) == n
+
+
+def test_ray_template_cache_from_other_parameters_is_rebuilt(tmp_path):
+    geometry = Geometry(3.5, 10)
+    built = mapping.RayTemplates(geometry, str(tmp_path))
+    assert built.source == "built"
+    assert mapping.RayTemplates(geometry, str(tmp_path)).source == "cache"
+    # Same radius, so the same table shape, from a different resolution and range
+    assert mapping.RayTemplates(Geometry(1.75, 20), str(tmp_path)).source == "built"
+
+
+def test_ray_template_offsets_widen_past_int8(tmp_path):
+    templates = mapping.RayTemplates(Geometry(6.5, 20), str(tmp_path))
+    assert templates.radius > 127
+    assert templates.dtype == np.int16
+    r = templates.radius
+    off_x, off_y, steps = templates.lookup(np.array([r, -r]), np.array([-r, 3]))
+    assert off_x[0, steps[0] - 1] == r - 1 and off_y[0, steps[0] - 1] == -(r - 1)
+    assert off_x[1, steps[1] - 1] == -(r - 1)
+
+
+def full_map_decay(m):
+    # The decay Mapping.update ran before decay candidates: masks over every allocated cell
+    m.decay_candidates = []
+    weak_x, weak_y = m.grid.find(lambda g: (g > 0.1) & (g < 2.0))
+    m.set_cells(weak_x, weak_y, m.grid[weak_x, weak_y] * 0.98)
+    medium_x, medium_y = m.grid.find(lambda g: (g >= 2.0) & (g < 4.0))
+    m.set_cells(medium_x, medium_y, m.grid[medium_x, medium_y] * 0.995)
+    m.decay_candidates = []
+
+
+def test_decay_of_candidates_matches_full_map_decay():
+    (_, m), (_, ref) = build_mapper(), build_mapper()
+    ref.decay = lambda: full_map_decay(ref)
+    for step in range(240):
+        for mapper in (m, ref):
+            if step % 60 < 50:
+                mapper.robot.drive(0.01, 0.0)
+            else:
+                mapper.robot.drive(0.0, np.pi / 20)
+            mapper.update()
+        if step % 20 == 19:
+            cx, cy = ref.grid.find(lambda g: g != 0)
+            assert np.array_equal(m.grid[cx, cy], ref.grid[cx, cy])
+            assert m.grid.find(lambda g: g != 0)[0].size == cx.size
+            assert m.known_cells == ref.known_cells
+            banded = (ref.grid[cx, cy] > 0.1) & (ref.grid[cx, cy] < 4.0)
+            assert banded.any()
+
+
+def brute_force_match(matcher, ranges, x, y, th):
+    # Every (dx, dy, dtheta) in the matcher's window scored on the likelihood field
+    m = matcher.mapping
+    points = m.get_scan_points(ranges, x, y, th)
+    n_rot = int(np.ceil(matcher.angular_window / matcher.angular_resolution))
+    w = int(round(matcher.linear_window * m.RESOLUTION))
+    shift_x, shift_y = [s.ravel() for s in np.meshgrid(np.arange(-w, w + 1), np.arange(-w, w + 1), indexing="ij")]
+    best = (matcher.min_score * len(points), None)
+    ties = 0
+    for r in range(-n_rot, n_rot + 1):
+        dth = r * matcher.angular_resolution
+        c, s = np.cos(dth), np.sin(dth)
+        px = x + (points[:, 0] - x) * c - (points[:, 1] - y) * s
+        py = y + (points[:, 0] - x) * s + (points[:, 1] - y) * c
+        cx = np.rint(px * m.RESOLUTION).astype(np.int64) + m.MAP_W // 2
+        cy = np.rint(py * m.RESOLUTION).astype(np.int64) + m.MAP_H // 2
+        scores = m.likelihood.field[cx[None, :] + shift_x[:, None], cy[None, :] + shift_y[:, None]].sum(axis=1)
+        k = int(np.argmax(scores))
+        if scores[k] > best[0] + 1e-6:
+            best = (float(scores[k]), (x + shift_x[k] / m.RESOLUTION, y + shift_y[k] / m.RESOLUTION, th + dth))
+            ties = 0
+        ties += int(np.sum(np.abs(scores - best[0]) <= 1e-6))
+    if best[1] is None:
+        return (x, y, th, 0.0), 1
+    return best[1] + (best[0] / len(points),), ties
+
+
+def test_correlative_matcher_finds_the_brute_force_best_pose():
+    world, robot, m = stand_ins.build_mapped_robot(loops=1)
+    matcher = m.correlative_matcher
+    rng = np.random.default_rng(4)
+    matched = 0
+    for _ in range(12):
+        # A scan from somewhere in the room, matched from a guess up to the
+        # window's size away from the true pose, or well outside it
+        world.x, world.y, world.th = rng.uniform(-0.6, 0.6), rng.uniform(-0.6, 0.6), rng.uniform(-np.pi, np.pi)
+        m.sensors.read()
+        ranges = m.sensors.clipped
+        true_x, true_y, true_th = stand_ins.map_pose(world)
+        spread = 1.5 if rng.random() < 0.25 else 0.4
+        guess = (true_x + rng.uniform(-spread, spread), true_y + rng.uniform(-spread, spread),
+                 true_th + rng.uniform(-0.3, 0.3))
+        pose = matcher.match(ranges, *guess)
+        expected, ties = brute_force_match(matcher, ranges, *guess)
+        assert np.isclose(pose[3], expected[3], rtol=1e-6)
+        if ties == 1:
+            assert np.allclose(pose[:3], expected[:3])
+        matched += expected[3] > 0.0
+        # Branch and bound scores a fraction of the candidates the brute force does
+        rotations = 2 * int(np.ceil(matcher.angular_window / matcher.angular_resolution)) + 1
+        shifts = (2 * int(round(matcher.linear_window * m.RESOLUTION)) + 1) ** 2
+        assert matcher.nodes_scored < rotations * shifts / 4
+    assert 0 < matched < 12
+
+
+def rebuilt_likelihood(m, x0, y0, x1, y1):
+    # Distance and likelihood over [x0, x1) x [y0, y1) from one distance
+    # transform of the whole map, as LikelihoodField would give if rebuilt
+    field = m.likelihood
+    pad = field.max_cells + 1
+    free = m.grid.window(x0 - pad, y0 - pad, x1 + pad, y1 + pad) <= m.OCC_THRESH
+    dist = cv2.distanceTransform(free.astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    dist = np.minimum(dist[pad:-pad, pad:-pad], field.max_cells)
+    metres = dist / m.RESOLUTION
+    likelihood = np.exp(-metres * metres / (2.0 * field.sigma * field.sigma))
+    likelihood[dist >= field.max_cells] = 0.0
+    return dist, likelihood
+
+
+def test_likelihood_field_updates_match_a_full_rebuild():
+    # Obstacles appear and disappear at random, alone and in clumps, across block
+    # borders and next to each other; only the blocks holding flips are refreshed
+    _, m = build_mapper()
+    rng = np.random.default_rng(5)
+    x0, y0 = m.MAP_W // 2 - 50, m.MAP_H // 2 - 50
+    for step in range(40):
+        n = int(rng.integers(1, 30))
+        cx = rng.integers(x0, x0 + 100, n)
+        cy = rng.integers(y0, y0 + 100, n)
+        if step % 3 == 0:
+            # A clump: a few cells around one spot
+            cx = cx[0] + rng.integers(-2, 3, n)
+            cy = cy[0] + rng.integers(-2, 3, n)
+        _, first = np.unique(cx * 100000 + cy, return_index=True)
+        cx, cy = cx[first], cy[first]
+        values = np.where(rng.random(len(cx)) < 0.6, 3.0, -3.0).astype(np.float32)
+        m.set_cells(cx, cy, values)
+        m.likelihood.update(m.flipped_cells)
+        m.flipped_cells = []
+
+        if step % 10 == 9:
+            # Everything the field can reach, and a margin of untouched cells around it
+            reach = 2 * m.likelihood.max_cells
+            bx0, by0, bx1, by1 = x0 - reach, y0 - reach, x0 + 100 + reach, y0 + 100 + reach
+            dist, likelihood = rebuilt_likelihood(m, bx0, by0, bx1, by1)
+            assert np.array_equal(m.likelihood.dist.window(bx0, by0, bx1, by1), dist)
+            assert np.array_equal(m.likelihood.field.window(bx0, by0, bx1, by1), likelihood.astype(np.float32))
+
+
+def reported(cells):
+    if not cells:
+        return set()
+    return set(pack_cells(np.concatenate([c[0] for c in cells]), np.concatenate([c[1] for c in cells])).tolist())
+
+
+def test_derived_layers_and_change_lists_follow_the_grid():
+    # A run with scan matching and slipping encoders, checked against values
+    # recomputed from the grid before and after every update
+    _, m = build_mapper()
+    m.robot.encoder_scale = (1.02, 0.99)
+    lists = {}
+    m.flip_listeners.append(lambda cells: lists.__setitem__("flipped", list(cells)))
+    m.change_listeners.append(lambda cells: lists.__setitem__("changed", list(cells)))
+    x0, y0, x1, y1 = 40, 40, 170, 170          # The room and everything the lidar reaches from it
+    for step in range(300):
+        if step % 60 < 50:
+            m.robot.drive(0.01, 0.0)
+        else:
+            m.robot.drive(0.0, np.pi / 20)
+        before = m.grid.window(x0, y0, x1, y1)
+        lists.clear()
+        m.update()
+        bx0, by0, bx1, by1 = m.grid.bounds()
+        assert x0 <= bx0 and y0 <= by0 and bx1 <= x1 and by1 <= y1
+        after = m.grid.window(x0, y0, x1, y1)
+
+        # Every cell that ends the update on the other side of OCC_THRESH, or in
+        # another cell_state, is reported. A cell that crosses and comes back in
+        # the same update may be reported too; listeners read the grid anyway
+        for name, moved in (("flipped", (before > m.OCC_THRESH) != (after > m.OCC_THRESH)),
+                            ("changed", m.cell_state(before) != m.cell_state(after))):
+            i, j = np.nonzero(moved)
+            assert set(pack_cells(i + x0, j + y0).tolist()) <= reported(lists.get(name))
+        assert m.flipped_cells == [] and m.changed_cells == []
+
+        if step % 50 == 49:
+            assert m.known_cells == np.count_nonzero(np.abs(after) > m.KNOWN_THRESH)
+            assert np.array_equal(m.prob.window(x0, y0, x1, y1), 1.0 / (1.0 + np.exp(-after)))
+    assert m.known_cells > 2000
@@ -0,0 +1,41 @@
+import navigation
+import sensors
+import stand_ins
+import state_estimator
+
+
+class CountingPlanner:
+    # Plans a straight path to the goal and counts the calls
+    def __init__(self):
+        self.calls = 0
+
+    def plan(self, start, goal):
+        self.calls += 1
+        return [goal]
+
+
+class StandInDetector:
+    def reset_scan(self):
+        pass
+
+
+def test_switch_to_follow_path_plans_once_per_step():
+    world = stand_ins.SyntheticWorld()
+    robot = stand_ins.StandInRobot(world)
+    robot.devices["left wheel motor"] = stand_ins.StandInWheelMotor()
+    robot.devices["right wheel motor"] = stand_ins.StandInWheelMotor()
+    snapshot = sensors.SensorSnapshot(robot, robot.timestep, camera=False)
+    estimator = state_estimator.PoseEstimator(snapshot)
+    nav = navigation.Navigation(robot, robot.timestep, snapshot, estimator)
+    nav.detect = StandInDetector()
+    nav.planner = CountingPlanner()
+    nav.goal = (0.6, 0.0)
+    nav.compute_m_line()
+
+    for step in range(1, 4):
+        snapshot.read()
+        estimator.step()
+        nav.move()
+        assert nav.state == "FOLLOW_PATH"
+        assert nav.planner.calls == step
+        assert robot.devices["left wheel motor"].value > 0.0
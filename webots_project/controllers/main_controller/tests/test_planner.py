@@ -0,0 +1,51 @@
+import math
+import numpy as np
+import distance_field
+import planner
+import stand_ins
+
+
+def flip(mapper, cx, cy, value):
+    mapper.set_cells(cx, cy, np.full(len(cx), value, dtype=np.float32))
+    for listener in mapper.flip_listeners:
+        listener(mapper.flipped_cells)
+    mapper.flipped_cells = []
+
+
+def test_repaired_paths_cost_the_same_as_fresh_plans():
+    # Obstacles appear ahead of the robot and some of them go again; after every
+    # change the repaired search must agree with a planner starting from scratch
+    _, _, mapper = stand_ins.build_mapped_robot(loops=1)
+    field = distance_field.DistanceField(mapper)
+    grid_planner = planner.GridPlanner(field)
+    rng = np.random.default_rng(0)
+    start, goal = (-2.3, -2.3), (2.3, 2.3)
+    path = grid_planner.plan(start, goal)
+    assert path
+    placed = []
+    repaired = 0
+    for round_ in range(10):
+        start = path[0] if math.hypot(path[0][0] - start[0], path[0][1] - start[1]) < 0.5 else start
+        if round_ % 3 == 2 and placed:
+            cx, cy = placed.pop(rng.integers(len(placed)))
+            flip(mapper, cx, cy, -2.0)
+        else:
+            wx, wy = path[min(1, len(path) - 1)]
+            mx, my = grid_planner.to_cell(wx, wy)
+            cx, cy = np.meshgrid(np.arange(mx - 1, mx + 2), np.arange(my - 1, my + 2), indexing="ij")
+            placed.append((cx.ravel(), cy.ravel()))
+            flip(mapper, *placed[-1], 5.0)
+
+        path = grid_planner.plan(start, goal)
+        repaired += grid_planner.repaired
+        fresh = planner.GridPlanner(field)
+        fresh_path = fresh.plan(start, goal)
+        field.listeners.remove(fresh.on_distance_changed)
+        assert (path is None) == (fresh_path is None)
+        if path is None:
+            break
+        assert grid_planner.g[grid_planner.start] == fresh.g[fresh.start]
+        # No waypoint lies within the inflation radius of an obstacle
+        radius = grid_planner.inflation_cells / grid_planner.resolution
+        assert all(field.clearance(x, y) > radius for x, y in path[:-1])
+    assert repaired > 0
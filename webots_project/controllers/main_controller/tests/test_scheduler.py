@@ -0,0 +1,78 @@
+import itertools
+import math
+import numpy as np
+import scheduler
+
+
+def scheduled(points, robot=(0.0, 0.0)):
+    # Survivors revealed one at a time, each inserted into the current order
+    sched = scheduler.VisitScheduler()
+    sched.set_robot(robot)
+    for p in points:
+        sched.add([p])
+    return sched
+
+
+def resolved(sched):
+    # The same survivors and costs, ordered from scratch
+    fresh = scheduler.VisitScheduler()
+    fresh.points = list(sched.points)
+    fresh.cost = sched.cost.copy()
+    fresh.robot_cost = sched.robot_cost.copy()
+    fresh.solve()
+    return fresh
+
+
+def or_opt_candidates(order):
+    # Every order one Or-opt move away, built the slow way
+    for length in (1, 2, 3):
+        for i in range(len(order) - length + 1):
+            segment = order[i:i + length]
+            rest = order[:i] + order[i + length:]
+            for k in range(len(rest) + 1):
+                for seg in (segment, segment[::-1]):
+                    yield rest[:k] + seg + rest[k:]
+
+
+def test_or_opt_moves_never_lengthen_the_tour():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        sched = scheduler.VisitScheduler(merge_distance=0.0)
+        sched.set_robot(tuple(rng.uniform(-3.0, 3.0, 2)))
+        sched.add([tuple(p) for p in rng.uniform(-3.0, 3.0, (int(rng.integers(2, 12)), 2))])
+        sched.order = list(rng.permutation(len(sched)))
+        for length in (1, 2, 3):
+            for i in range(len(sched) - length + 1):
+                before = sched.tour_cost()
+                moved = sched.move_segment(i, length)
+                after = sched.tour_cost()
+                assert after < before - 1e-9 if moved else after == before
+                assert sorted(sched.order) == list(range(len(sched)))
+
+        # Once improve() stops, no 2-opt or Or-opt move found by rebuilding
+        # the order and costing it in full is any shorter
+        sched.improve()
+        best = sched.tour_cost()
+        order = sched.order
+        for candidate in or_opt_candidates(order):
+            assert sched.tour_cost(candidate) > best - 1e-9
+        for i, j in itertools.combinations(range(len(order)), 2):
+            assert sched.tour_cost(order[:i] + order[i:j + 1][::-1] + order[j + 1:]) > best - 1e-9
+
+
+def test_incremental_insertion_matches_solving_again():
+    rng = np.random.default_rng(1)
+    # Up to three survivors, both find the shortest order
+    for _ in range(200):
+        sched = scheduled([tuple(p) for p in rng.uniform(-3.0, 3.0, (int(rng.integers(1, 4)), 2))])
+        fresh = resolved(sched)
+        shortest = min(sched.tour_cost(list(o)) for o in itertools.permutations(range(len(sched))))
+        assert math.isclose(sched.tour_cost(), shortest, abs_tol=1e-9)
+        assert math.isclose(fresh.tour_cost(), shortest, abs_tol=1e-9)
+
+    # Beyond that neither is always the shortest, but on average they are the same length
+    ratios = []
+    for _ in range(200):
+        sched = scheduled([tuple(p) for p in rng.uniform(-3.0, 3.0, (int(rng.integers(4, 8)), 2))])
+        ratios.append(sched.tour_cost() / resolved(sched).tour_cost())
+    assert abs(np.mean(ratios) - 1.0) < 0.01
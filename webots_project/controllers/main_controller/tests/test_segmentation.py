@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+import segmentation
+import stand_ins
+
+
+def hsv_mask(image, width, height):
+    # The BGRA -> BGR -> HSV + inRange pipeline the table replaces
+    arr = np.frombuffer(image, np.uint8).reshape((height, width, 4))
+    hsv = cv2.cvtColor(cv2.cvtColor(arr, cv2.COLOR_BGRA2BGR), cv2.COLOR_BGR2HSV)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for lower, upper in segmentation.WARM_BANDS:
+        mask |= cv2.inRange(hsv, np.array(lower), np.array(upper))
+    return mask
+
+
+def test_table_mask_matches_hsv_thresholds():
+    width, height = 640, 480
+    segmenter = segmentation.WarmSegmenter(width, height)
+    for image in stand_ins.synthetic_frames(8, width, height):
+        np.testing.assert_array_equal(segmenter.segment(image), hsv_mask(image, width, height))
+
+
+def test_table_covers_every_colour():
+    # Every colour, one pixel each, against the HSV thresholds
+    colours = np.arange(1 << 24, dtype=np.uint32) | np.uint32(0xFF000000)
+    image = colours.tobytes()
+    side = 1 << 12
+    segmenter = segmentation.WarmSegmenter(side, side)
+    np.testing.assert_array_equal(segmenter.segment(image), hsv_mask(image, side, side))
+
+
+def test_cache_from_other_bands_is_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.setattr(segmentation, "_table", None)
+    np.savez(tmp_path / "warm_table.npz", bands=np.zeros((2, 2, 3), dtype=np.int64),
+             table=np.zeros(1 << 24, dtype=np.uint8))
+    table = segmentation.warm_table(str(tmp_path))
+    assert table.any()
+    with np.load(tmp_path / "warm_table.npz") as cached:
+        np.testing.assert_array_equal(cached["bands"], np.array(segmentation.WARM_BANDS))
@@ -0,0 +1,126 @@
+import math
+import numpy as np
+import sensors
+import stand_ins
+import state_estimator
+
+
+def build_estimator(world):
+    robot = stand_ins.StandInRobot(world)
+    snapshot = sensors.SensorSnapshot(robot, robot.timestep, camera=False)
+    return robot, snapshot, state_estimator.PoseEstimator(snapshot)
+
+
+def step(snapshot, estimator):
+    snapshot.read()
+    estimator.step()
+
+
+def test_nan_encoders_on_the_first_step_leave_the_pose_finite():
+    # Webots reports NaN for position sensors until their first sample
+    world = stand_ins.SyntheticWorld()
+    world.th = 0.5
+    robot = stand_ins.StandInRobot(world)
+    robot.devices["left wheel sensor"].value = math.nan
+    robot.devices["right wheel sensor"].value = math.nan
+    snapshot = sensors.SensorSnapshot(robot, robot.timestep, camera=False)
+    estimator = state_estimator.PoseEstimator(snapshot)
+    step(snapshot, estimator)
+    assert estimator.pose()[:2] == (0.0, 0.0)
+    assert math.isclose(estimator.theta, 0.5, abs_tol=1e-3)
+
+    # The first real readings are taken as the starting point, not as motion
+    robot.devices["left wheel sensor"].value = 12.0
+    robot.devices["right wheel sensor"].value = 12.0
+    step(snapshot, estimator)
+    assert estimator.pose()[:2] == (0.0, 0.0)
+    for _ in range(20):
+        robot.drive(0.01, 0.0)
+        step(snapshot, estimator)
+    assert np.all(np.isfinite(estimator.covariance()))
+    assert math.isclose(estimator.x, world.x, abs_tol=1e-3)
+    assert math.isclose(estimator.y, world.y, abs_tol=1e-3)
+
+    # A dropped reading later on costs that step's motion, not the pose
+    pose = estimator.pose()
+    robot.devices["left wheel sensor"].value = math.nan
+    step(snapshot, estimator)
+    assert np.allclose(estimator.pose()[:2], pose[:2], atol=1e-6)
+
+
+def test_imu_heading_pulls_the_estimate_towards_the_yaw():
+    world = stand_ins.SyntheticWorld()
+    world.th = -2.0
+    robot, snapshot, estimator = build_estimator(world)
+    step(snapshot, estimator)
+    # The start heading is unknown, so the first yaw reading is taken almost as is
+    assert math.isclose(estimator.theta, -2.0, abs_tol=1e-3)
+
+    # Encoders over-report the left wheel, so they see a turn the IMU does not
+    robot.encoder_scale = (1.1, 1.0)
+    error = []
+    for _ in range(100):
+        robot.drive(0.01, 0.0)
+        step(snapshot, estimator)
+        error.append(abs(state_estimator.wrap_angle(estimator.theta - world.th)))
+    # The error levels off at a fraction of what the encoders alone add up to
+    turn = 100 * 0.1 * 0.01 / 0.160
+    assert max(error) < 0.2 * turn
+    assert error[-1] - error[-20] < 0.01 * turn
+    sigma_th = math.sqrt(estimator.covariance()[2, 2])
+    assert sigma_th < math.radians(2.0)
+
+    # An estimate knocked off the yaw is pulled back, by less than the full
+    # innovation in one step and further with every step
+    estimator.state[2] = state_estimator.wrap_angle(world.th + 0.3)
+    estimator.P[2, 2] = 0.05 ** 2
+    offsets = []
+    for _ in range(5):
+        step(snapshot, estimator)
+        offsets.append(state_estimator.wrap_angle(estimator.theta - world.th))
+    assert 0.0 < offsets[0] < 0.3
+    assert all(b < a for a, b in zip(offsets, offsets[1:]))
+
+    # Without a yaw reading nothing pulls it
+    theta = estimator.theta
+    robot.devices["inertial unit"].getRollPitchYaw = lambda: [0.0, 0.0, math.nan]
+    step(snapshot, estimator)
+    assert estimator.theta == theta
+
+
+def test_stuck_detection_fires_when_wheels_turn_against_a_wall():
+    # Pressed against the room's east wall: the wheels turn, the scan stays put
+    world = stand_ins.SyntheticWorld()
+    world.x = 2.92
+    robot, snapshot, estimator = build_estimator(world)
+    step(snapshot, estimator)
+    wheel_turn = 0.01 / 0.033
+    states = []
+    for _ in range(10):
+        robot.devices["left wheel sensor"].value += wheel_turn
+        robot.devices["right wheel sensor"].value += wheel_turn
+        step(snapshot, estimator)
+        states.append(estimator.stuck)
+    assert states[:estimator.STUCK_THRESHOLD] == [False] * estimator.STUCK_THRESHOLD
+    assert states[-1]
+    # Once stuck, the encoder travel is not added to the pose
+    x = estimator.x
+    robot.devices["left wheel sensor"].value += wheel_turn
+    robot.devices["right wheel sensor"].value += wheel_turn
+    step(snapshot, estimator)
+    assert estimator.x == x
+
+    # Driving away clears it again
+    for _ in range(2 * estimator.STUCK_THRESHOLD):
+        robot.drive(-0.01, 0.0)
+        step(snapshot, estimator)
+    assert not estimator.stuck
+
+
+def test_driving_in_the_open_is_never_stuck():
+    world = stand_ins.SyntheticWorld()
+    robot, snapshot, estimator = build_estimator(world)
+    for i in range(300):
+        robot.drive(0.01 if i % 60 < 50 else 0.0, 0.0 if i % 60 < 50 else math.pi / 20)
+        step(snapshot, estimator)
+        assert estimator.stuck_counter == 0
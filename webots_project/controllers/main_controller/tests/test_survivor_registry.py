@@ -0,0 +1,148 @@
+import math
+import numpy as np
+import checkpoint
+import mapping
+import navigation
+import scheduler
+import sensors
+import stand_ins
+import state_estimator
+from survivor_registry import SurvivorRegistry
+
+
+def test_sightings_within_the_merge_radius_are_one_survivor():
+    registry = SurvivorRegistry(merge_radius=0.5)
+    first = registry.observe(1.0, 2.0, 0.8)
+    again = registry.observe(1.3, 2.0, 0.4)
+    other = registry.observe(1.6, 2.0, 0.8)
+    assert again is first and other is not first
+    assert len(registry) == 2
+    # Confidence-weighted mean position, independent evidence for the confidence
+    assert math.isclose(first.x, (1.0 * 0.8 + 1.3 * 0.4) / 1.2)
+    assert math.isclose(first.confidence, 1.0 - 0.2 * 0.6)
+    assert first.observations == 2
+
+
+def test_near_matches_a_linear_search():
+    rng = np.random.default_rng(0)
+    registry = SurvivorRegistry(merge_radius=0.3)
+    for x, y in rng.uniform(-5.0, 5.0, (300, 2)):
+        registry.observe(x, y)
+    for x, y, radius in zip(*rng.uniform(-5.0, 5.0, (2, 100)), rng.uniform(0.1, 2.0, 100)):
+        expected = sorted((math.hypot(s.x - x, s.y - y), s.id) for s in registry
+                          if math.hypot(s.x - x, s.y - y) < radius)
+        assert [s.id for s in registry.near(x, y, radius)] == [i for _, i in expected]
+        nearest = registry.nearest(x, y, radius)
+        assert (nearest.id if nearest else None) == (expected[0][1] if expected else None)
+
+
+def test_change_feed_resets_after_load():
+    registry = SurvivorRegistry()
+    cursor = registry.cursor()
+    a = registry.observe(0.0, 0.0)
+    registry.observe(0.1, 0.0)
+    b = registry.observe(3.0, 0.0)
+    registry.mark_visited(b.id)
+    cursor, events = registry.changes(cursor)
+    # One entry per survivor changed, in the order of their latest change
+    assert [(kind, s.id) for kind, s in events] == [("added", a.id), ("added", b.id), ("visited", b.id)]
+    assert registry.changes(cursor)[1] == []
+    registry.observe(0.0, 0.1)
+    cursor, events = registry.changes(cursor)
+    assert [(kind, s.id) for kind, s in events] == [("updated", a.id)]
+
+    rows = registry.state()
+    registry.load(rows)
+    _, events = registry.changes(cursor)
+    assert events[0] == ("reset", None)
+    assert [(kind, s.id) for kind, s in events[1:]] == [("added", a.id), ("added", b.id), ("visited", b.id)]
+    assert registry.state() == rows
+    assert registry.observe(10.0, 10.0).id == b.id + 1
+
+
+def test_change_feed_stays_bounded_and_complete_for_every_reader():
+    # Readers polling at different rates each end up with every survivor's
+    # current state, and with every survivor seen as added exactly once
+    rng = np.random.default_rng(3)
+    registry = SurvivorRegistry()
+    readers = [{"cursor": None, "every": every, "seen": {}, "added": []} for every in (1, 7, 50)]
+    for step in range(2000):
+        registry.observe(*rng.uniform(-3.0, 3.0, 2), rng.uniform(0.3, 0.9))
+        if rng.random() < 0.05:
+            registry.mark_visited(int(rng.integers(len(registry))))
+        for reader in readers:
+            if step % reader["every"] == 0:
+                reader["cursor"], events = registry.changes(reader["cursor"])
+                for kind, s in events:
+                    reader["seen"][s.id] = (s.x, s.y, s.visited)
+                    if kind == "added":
+                        reader["added"].append(s.id)
+    assert len(registry.latest) == len(registry) < 2000
+    for reader in readers:
+        reader["cursor"], events = registry.changes(reader["cursor"])
+        for kind, s in events:
+            reader["seen"][s.id] = (s.x, s.y, s.visited)
+            if kind == "added":
+                reader["added"].append(s.id)
+        assert reader["seen"] == {s.id: (s.x, s.y, s.visited) for s in registry}
+        assert sorted(reader["added"]) == sorted(s.id for s in registry)
+
+
+class StandInDetector:
+    def __init__(self):
+        self.registry = SurvivorRegistry()
+        self.registry_cursor = None
+        self.scheduler = scheduler.VisitScheduler()
+        self.explorer = None
+        self.visiting = False
+
+    def reset_scan(self):
+        pass
+
+
+def controller_modules(world):
+    robot = stand_ins.StandInRobot(world)
+    robot.devices["left wheel motor"] = stand_ins.StandInWheelMotor()
+    robot.devices["right wheel motor"] = stand_ins.StandInWheelMotor()
+    snapshot = sensors.SensorSnapshot(robot, robot.timestep, camera=False)
+    estimator = state_estimator.PoseEstimator(snapshot)
+    nav = navigation.Navigation(robot, robot.timestep, snapshot, estimator)
+    mapper = mapping.Mapping(robot, snapshot, estimator)
+    detector = StandInDetector()
+    nav.detect = detector
+    return mapper, detector, nav, estimator
+
+
+def test_checkpoint_keeps_visiting_after_the_survivor_moves(tmp_path):
+    world = stand_ins.SyntheticWorld()
+    mapper, detector, nav, estimator = controller_modules(world)
+    human = detector.registry.observe(1.0, 2.0)
+    nav.goal = detector.registry.mark_visited(human.id).position
+    nav.compute_m_line()
+    detector.visiting = True
+    # A later sighting moves the survivor well away from the goal it was visited at
+    detector.registry.observe(1.4, 2.0)
+    assert math.hypot(human.x - nav.goal[0], human.y - nav.goal[1]) > 0.05
+
+    path = str(tmp_path / "controller.ckpt")
+    checkpoint.write(path, *checkpoint.capture(mapper, detector, nav, estimator))
+    mapper, detector, nav, estimator = controller_modules(world)
+    checkpoint.restore(*checkpoint.read(path), mapper, detector, nav, estimator)
+    assert detector.visiting
+    assert detector.registry.survivors[human.id].visited
+
+
+def test_checkpoint_keeps_a_frontier_goal_at_a_visited_survivor(tmp_path):
+    # Exploring towards a frontier that happens to be where a human was visited
+    world = stand_ins.SyntheticWorld()
+    mapper, detector, nav, estimator = controller_modules(world)
+    human = detector.registry.observe(1.0, 2.0)
+    detector.registry.mark_visited(human.id)
+    nav.goal = (1.0, 2.0)
+    nav.compute_m_line()
+
+    path = str(tmp_path / "controller.ckpt")
+    checkpoint.write(path, *checkpoint.capture(mapper, detector, nav, estimator))
+    mapper, detector, nav, estimator = controller_modules(world)
+    checkpoint.restore(*checkpoint.read(path), mapper, detector, nav, estimator)
+    assert not detector.visiting
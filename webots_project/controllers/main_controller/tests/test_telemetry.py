@@ -0,0 +1,42 @@
+import threading
+import telemetry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sources_under_a_limited_topic_have_their_own_budget(capsys):
+    clock = Clock()
+    logger = telemetry.TelemetryLogger(rate_limits={"controller.error": 2.0}, clock=clock)
+    for _ in range(5):
+        logger.log(telemetry.ERROR, "controller.error.mapping", "map update error", {})
+    logger.log(telemetry.ERROR, "controller.error.detection", "detection error", {})
+    out = capsys.readouterr().out
+    assert out.count("map update error") == 1
+    assert out.count("detection error") == 1
+
+    clock.now = 1.0
+    logger.log(telemetry.ERROR, "controller.error.mapping", "map update error", {})
+    assert "suppressed=4" in capsys.readouterr().out
+
+
+def test_rate_limit_counts_are_exact_across_threads():
+    logger = telemetry.TelemetryLogger(rate_limits={"busy": 1.0}, console_level=telemetry.ERROR + 1,
+                                       clock=lambda: 0.0)
+
+    def produce():
+        for _ in range(5000):
+            logger.log(telemetry.INFO, "busy", "record", {})
+
+    threads = [threading.Thread(target=produce) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # One record got through, every other one is counted as suppressed
+    assert logger.suppressed["busy"] == 4 * 5000 - 1
@@ -0,0 +1,67 @@
+import numpy as np
+from tiled_grid import TiledGrid, pack_cells, unpack_cells
+
+
+def test_grid_matches_a_dense_array_across_negative_coordinates():
+    # Random writes over a region straddling the origin, checked against a dense
+    # array holding the same cells
+    rng = np.random.default_rng(0)
+    grid = TiledGrid(np.float32, -1.0, tile_bits=3)
+    x0, y0 = -37, -21
+    dense = np.full((90, 70), -1.0, dtype=np.float32)
+    for _ in range(20):
+        cx = rng.integers(x0, x0 + 90, 40)
+        cy = rng.integers(y0, y0 + 70, 40)
+        values = rng.uniform(0.0, 5.0, 40).astype(np.float32)
+        # Later duplicates win, as they do for a NumPy scatter
+        grid[cx, cy] = values
+        dense[cx - x0, cy - y0] = values
+    assert np.array_equal(grid.window(x0, y0, x0 + 90, y0 + 70), dense)
+    for cx, cy in zip(rng.integers(x0, x0 + 90, 50), rng.integers(y0, y0 + 70, 50)):
+        assert grid.value(int(cx), int(cy)) == dense[cx - x0, cy - y0]
+
+    # Only tiles holding a write are allocated, and bounds() covers all of them
+    written = np.argwhere(dense != -1.0) + (x0, y0)
+    tiles = set(map(tuple, (written >> 3).tolist()))
+    assert set(grid.tiles) == tiles
+    bx0, by0, bx1, by1 = grid.bounds()
+    assert bx0 <= written[:, 0].min() and written[:, 0].max() < bx1
+    assert by0 <= written[:, 1].min() and written[:, 1].max() < by1
+    assert grid.nbytes == len(tiles) * 8 * 8 * 4
+
+    # find() returns every allocated cell the predicate holds for
+    fx, fy = grid.find(lambda v: v > 2.5)
+    expected = np.argwhere(dense > 2.5) + (x0, y0)
+    assert sorted(zip(fx.tolist(), fy.tolist())) == sorted(map(tuple, expected.tolist()))
+
+
+def test_reads_outside_allocated_tiles_allocate_nothing():
+    grid = TiledGrid(np.uint8, 7)
+    assert grid.window(-100, -100, -90, -90).tolist() == [[7] * 10] * 10
+    assert grid.value(10 ** 6, -10 ** 6) == 7
+    assert grid.tile_count == 0 and grid.find(lambda v: v == 7)[0].size == 0
+    grid[np.array([5]), np.array([-5])] = 1
+    assert grid.tile_count == 1
+    assert grid[np.array([5, 10 ** 6]), np.array([-5, 10 ** 6])].tolist() == [1, 7]
+
+
+def test_set_window_and_snapshot_round_trip():
+    rng = np.random.default_rng(1)
+    grid = TiledGrid(np.int16, 0)
+    block = rng.integers(-100, 100, (70, 45)).astype(np.int16)
+    grid.set_window(-40, 13, block)
+    assert np.array_equal(grid.window(-40, 13, 30, 58), block)
+    pool, slot_tiles = grid.snapshot()
+    copy = TiledGrid.from_arrays(pool, slot_tiles, 0)
+    assert copy.tiles == grid.tiles
+    assert np.array_equal(copy.window(-50, 0, 40, 70), grid.window(-50, 0, 40, 70))
+
+
+def test_pack_cells_round_trips():
+    rng = np.random.default_rng(2)
+    cx = rng.integers(-(1 << 29), 1 << 29, 1000)
+    cy = rng.integers(-(1 << 29), 1 << 29, 1000)
+    x, y = unpack_cells(pack_cells(cx, cy))
+    assert np.array_equal(x, cx) and np.array_equal(y, cy)
+    # Distinct cells, distinct keys
+    assert len(np.unique(pack_cells(cx, cy))) == len(set(zip(cx.tolist(), cy.tolist())))
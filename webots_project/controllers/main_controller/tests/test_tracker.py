@@ -0,0 +1,50 @@
+import itertools
+import math
+import numpy as np
+import tracker
+
+
+def brute_force(cost, limit):
+    # Most pairs under limit, then the lowest total cost, over every assignment
+    n_rows, n_cols = cost.shape
+    best = (0, 0.0)
+    if n_rows <= n_cols:
+        choices = (zip(range(n_rows), cols) for cols in itertools.permutations(range(n_cols), n_rows))
+    else:
+        choices = (zip(rows, range(n_cols)) for rows in itertools.permutations(range(n_rows), n_cols))
+    for pairs in choices:
+        used = [cost[r, c] for r, c in pairs if cost[r, c] < limit]
+        best = max(best, (len(used), -sum(used)))
+    return best[0], -best[1]
+
+
+def test_assign_matches_brute_force_on_small_matrices():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        n_rows, n_cols = rng.integers(0, 6, 2)
+        cost = rng.uniform(0.0, 1.0, (n_rows, n_cols))
+        limit = rng.uniform(0.2, 1.1)
+        rows, cols = tracker.assign(cost, limit)
+        assert len(set(rows.tolist())) == len(rows) and len(set(cols.tolist())) == len(cols)
+        assert np.all(cost[rows, cols] < limit)
+        pairs, total = brute_force(cost, limit)
+        assert len(rows) == pairs
+        assert math.isclose(cost[rows, cols].sum(), total, abs_tol=1e-9)
+
+
+def test_tracker_reports_each_survivor_once_in_a_scan():
+    rng = np.random.default_rng(1)
+    width, h_fov, rate, dt = 640, 1.047, 0.5, 0.032
+    bearings = np.array([-2.9, -2.0, -1.1, -0.95, 0.0, 0.8, 1.9, 2.7])
+    track = tracker.BearingTracker(h_fov, width)
+    reports = []
+    for step in range(int(2 * math.pi / rate / dt) + 1):
+        camera = tracker.wrap(step * rate * dt + math.pi)
+        off = tracker.wrap(bearings - camera)
+        seen = np.abs(off) < 0.5 * h_fov - 0.03
+        offsets = off[seen] + rng.normal(0.0, 2 * h_fov / width, int(seen.sum()))
+        reports += track.update(step * dt, camera, offsets, np.full(len(offsets), 1.5))
+    assert len(reports) == len(bearings)
+    error = np.abs(tracker.wrap(np.array([a for a, _ in reports])[None, :] - bearings[:, None]))
+    assert np.all(error.min(axis=1) < 0.02)
+    assert np.allclose([d for _, d in reports], 1.5)
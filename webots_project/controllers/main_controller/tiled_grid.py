@@ -0,0 +1,164 @@
+# tiled_grid.py
+# Sparse, unbounded 2D grid made of fixed-size tiles allocated on first write
+
+import numpy as np
+
+# Cell coordinates are packed into one int64 key for np.unique and hashing
+KEY_OFFSET = 1 << 30
+
+
+def pack_cells(cx, cy):
+    return (np.asarray(cx, dtype=np.int64) + KEY_OFFSET) * (2 * KEY_OFFSET) + (np.asarray(cy, dtype=np.int64) + KEY_OFFSET)
+
+
+def unpack_cells(keys):
+    cx, cy = np.divmod(keys, 2 * KEY_OFFSET)
+    return cx - KEY_OFFSET, cy - KEY_OFFSET
+
+
+class TiledGrid:
+    # Cells are addressed by integer map indices, which may be negative or grow
+    # without bound. Tiles of size x size cells live in a pool and are found
+    # through a dict keyed by tile coordinates; reads of cells in tiles that were
+    # never written return the default value without allocating anything.
+    # Indexing with [cx, cy] gathers/scatters like a NumPy array with index arrays.
+    def __init__(self, dtype, default=0, tile_bits=5):
+        self.dtype = np.dtype(dtype)
+        self.default = default
+        self.bits = tile_bits
+        self.size = 1 << tile_bits
+        self.mask = self.size - 1
+
+        self.tiles = {}                                         # (tx, ty) -> pool slot
+        # Slot 0 is a shared read-only tile of default values
+        self.pool = np.full((8, self.size, self.size), default, dtype=self.dtype)
+        self.slot_tiles = np.zeros((8, 2), dtype=np.int64)      # pool slot -> (tx, ty)
+
+        # Dense slot lookup over the bounding box of allocated tiles, for vectorized gathers
+        self.table = np.zeros((0, 0), dtype=np.int64)
+        self.table_x0 = 0
+        self.table_y0 = 0
+
+    @classmethod
+    def from_arrays(cls, pool, slot_tiles, default=0, tile_bits=5):
+        # Wrap arrays produced by snapshot() without copying them (they may be memmaps)
+        grid = cls(pool.dtype, default, tile_bits)
+        grid.pool = pool
+        grid.slot_tiles = slot_tiles
+        for slot in range(1, len(slot_tiles)):
+            grid.tiles[(int(slot_tiles[slot, 0]), int(slot_tiles[slot, 1]))] = slot
+        if grid.tiles:
+            grid.rebuild_table()
+        return grid
+
+    def snapshot(self):
+        # Copies of the used part of the pool (slot 0 included) and of the slot coordinates
+        n = len(self.tiles) + 1
+        return self.pool[:n].copy(), self.slot_tiles[:n].copy()
+
+    @property
+    def tile_count(self):
+        return len(self.tiles)
+
+    @property
+    def nbytes(self):
+        # Memory held by allocated tiles
+        return len(self.tiles) * self.size * self.size * self.dtype.itemsize
+
+    @property
+    def shape(self):
+        # Extent in cells of the area covered by allocated tiles
+        if not self.tiles:
+            return (0, 0)
+        t = self.slot_tiles[1:len(self.tiles) + 1]
+        return tuple(int(v) for v in (t.max(axis=0) - t.min(axis=0) + 1) * self.size)
+
+    def bounds(self):
+        # (x0, y0, x1, y1) cell range covered by allocated tiles
+        if not self.tiles:
+            return (0, 0, 0, 0)
+        t = self.slot_tiles[1:len(self.tiles) + 1]
+        lo = t.min(axis=0) * self.size
+        hi = (t.max(axis=0) + 1) * self.size
+        return int(lo[0]), int(lo[1]), int(hi[0]), int(hi[1])
+
+    def slots(self, tx, ty):
+        # Pool slot of every tile coordinate, 0 where the tile is not allocated.
+        # The table's border is always empty, so clipping maps outside tiles to 0
+        if self.table.size == 0:
+            return np.zeros(np.shape(tx), dtype=np.int64)
+        ix = np.maximum(np.minimum(tx - self.table_x0, self.table.shape[0] - 1), 0)
+        iy = np.maximum(np.minimum(ty - self.table_y0, self.table.shape[1] - 1), 0)
+        return self.table[ix, iy]
+
+    def allocate(self, tx, ty):
+        # Allocate the given (not yet allocated) tiles
+        new_tx, new_ty = unpack_cells(np.unique(pack_cells(tx, ty)))
+        for i in range(len(new_tx)):
+            slot = len(self.tiles) + 1
+            if slot >= len(self.pool):
+                grow = len(self.pool)
+                self.pool = np.concatenate((self.pool, np.full((grow, self.size, self.size), self.default, dtype=self.dtype)))
+                self.slot_tiles = np.concatenate((self.slot_tiles, np.zeros((grow, 2), dtype=np.int64)))
+            self.tiles[(int(new_tx[i]), int(new_ty[i]))] = slot
+            self.slot_tiles[slot] = (new_tx[i], new_ty[i])
+        self.rebuild_table()
+
+    def rebuild_table(self):
+        # Regrow the lookup table with some margin so it is not rebuilt for every new tile
+        t = self.slot_tiles[1:len(self.tiles) + 1]
+        lo = t.min(axis=0)
+        hi = t.max(axis=0)
+        x_end = self.table_x0 + self.table.shape[0] - 1
+        y_end = self.table_y0 + self.table.shape[1] - 1
+        if self.table.size and lo[0] > self.table_x0 and lo[1] > self.table_y0 and hi[0] < x_end and hi[1] < y_end:
+            self.table[t[:, 0] - self.table_x0, t[:, 1] - self.table_y0] = np.arange(1, len(t) + 1)
+            return
+        margin = 4
+        self.table_x0 = int(lo[0]) - margin
+        self.table_y0 = int(lo[1]) - margin
+        self.table = np.zeros((int(hi[0] - lo[0]) + 1 + 2 * margin, int(hi[1] - lo[1]) + 1 + 2 * margin), dtype=np.int64)
+        self.table[t[:, 0] - self.table_x0, t[:, 1] - self.table_y0] = np.arange(1, len(t) + 1)
+
+    def cells(self, key):
+        cx = np.asarray(key[0], dtype=np.int64)
+        cy = np.asarray(key[1], dtype=np.int64)
+        if cx.shape != cy.shape:
+            cx, cy = np.broadcast_arrays(cx, cy)
+        return cx, cy
+
+    def __getitem__(self, key):
+        cx, cy = self.cells(key)
+        slots = self.slots(cx >> self.bits, cy >> self.bits)
+        return self.pool[slots, cx & self.mask, cy & self.mask]
+
+    def __setitem__(self, key, values):
+        cx, cy = self.cells(key)
+        tx = cx >> self.bits
+        ty = cy >> self.bits
+        slots = self.slots(tx, ty)
+        missing = slots == 0
+        if np.any(missing):
+            self.allocate(tx[missing], ty[missing])
+            slots = self.slots(tx, ty)
+        self.pool[slots, cx & self.mask, cy & self.mask] = values
+
+    def value(self, cx, cy):
+        # Single cell read through the tile dict, cheaper than indexing for one cell
+        slot = self.tiles.get((cx >> self.bits, cy >> self.bits), 0)
+        return self.pool[slot, cx & self.mask, cy & self.mask]
+
+    def window(self, x0, y0, x1, y1):
+        # Dense copy of cells [x0, x1) x [y0, y1)
+        return self[np.arange(x0, x1)[:, None], np.arange(y0, y1)[None, :]]
+
+    def set_window(self, x0, y0, values):
+        w, h = values.shape
+        self[np.arange(x0, x0 + w)[:, None], np.arange(y0, y0 + h)[None, :]] = values
+
+    def find(self, predicate):
+        # Cell indices of all allocated cells where predicate(values) is true
+        n = len(self.tiles)
+        slot, lx, ly = np.nonzero(predicate(self.pool[1:n + 1]))
+        tiles = self.slot_tiles[slot + 1]
+        return tiles[:, 0] * self.size + lx, tiles[:, 1] * self.size + ly
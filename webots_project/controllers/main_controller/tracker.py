@@ -0,0 +1,199 @@
+# tracker.py
+# Tracks of survivors seen by the rotating camera, in bearing space
+#
+# Each track holds a bearing in the robot frame (camera angle plus the pixel
+# offset's angle) and its rate of change. A survivor that stands still while
+# the robot is paused keeps its bearing as the camera turns, so the camera
+# motor's motion drops out of the prediction instead of showing up as image
+# motion; the camera rate, measured from the camera angle, only widens the gate
+# by half a frame of rotation, since the image and the angle reading are not
+# taken at quite the same instant. Every frame the contours are assigned to
+# the tracks in one globally optimal assignment (Hungarian method) over the
+# bearing errors, leaving out pairs further apart than the gate; matched
+# tracks are corrected with an alpha-beta filter. Unmatched contours
+# start new tracks, tracks that should be in view but go unmatched for
+# max_misses frames are dropped, and so are tracks unseen for max_age seconds.
+#
+# Tracks live in one structured array, rows 0..count-1, removed by moving the
+# last row into the gap. A track that was close to the image centre for
+# `samples` frames reports its averaged bearing and distance once.
+
+import math
+import numpy as np
+
+TRACK_DTYPE = np.dtype([
+    ("id", np.int64),
+    ("bearing", np.float64),        # Robot frame, radians
+    ("rate", np.float64),           # Bearing change, rad/s
+    ("distance", np.float64),       # Smoothed ground distance, metres
+    ("last_seen", np.float64),
+    ("hits", np.int32),
+    ("misses", np.int32),
+    ("samples", np.int32),          # Centred frames collected
+    ("sin_sum", np.float64),        # Sums of the centred bearings and distances
+    ("cos_sum", np.float64),
+    ("distance_sum", np.float64),
+    ("reported", np.bool_),
+])
+
+
+def wrap(a):
+    return (a + np.pi) % (2 * np.pi) - np.pi
+
+
+def assign(cost, limit):
+    # Minimum-cost assignment of rows to columns (Hungarian method with
+    # potentials, O(n^2 m)); pairs costing limit or more are never used.
+    # Returns (rows, cols) of the matched pairs.
+    n_rows, n_cols = cost.shape
+    if n_rows == 0 or n_cols == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    transposed = n_rows > n_cols
+    c = cost.T if transposed else cost
+    n, m = c.shape
+    # Gated pairs cost more than any full assignment of allowed pairs, so
+    # they are used only when a row has nothing else, and then dropped
+    big = limit * (n + 1)
+    c = np.where(c < limit, c, big)
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.int64)       # Row (1-based) matched to each column
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            reduced = c[i0 - 1] - u[i0] - v[1:]
+            free = ~used[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    keep = c[rows, cols] < limit
+    rows, cols = rows[keep], cols[keep]
+    return (cols, rows) if transposed else (rows, cols)
+
+
+class BearingTracker:
+    def __init__(self, h_fov, image_width, gate=0.1, alpha=0.6, beta=0.2, max_misses=5, max_age=5.0,
+                 min_distance=0.25, centre_pixels=40, samples=6, capacity=16):
+        self.h_fov = h_fov
+        self.pixel_angle = h_fov / image_width
+        self.gate = gate                    # Largest bearing error of a match, radians
+        self.alpha = alpha                  # Alpha-beta filter gains
+        self.beta = beta
+        self.max_misses = max_misses        # Frames a track may go unmatched while in view
+        self.max_age = max_age              # Seconds a track may go unseen at all
+        self.min_distance = min_distance    # Closer contours do not start tracks
+        self.centre_angle = centre_pixels * self.pixel_angle
+        self.samples = samples
+
+        self.table = np.zeros(capacity, dtype=TRACK_DTYPE)
+        self.count = 0
+        self.next_id = 0
+        self.time = None
+        self.camera_angle = None
+        self.camera_rate = 0.0
+
+    @property
+    def tracks(self):
+        return self.table[:self.count]
+
+    def clear(self):
+        self.count = 0
+        self.time = None
+        self.camera_angle = None
+        self.camera_rate = 0.0
+
+    def remove(self, rows):
+        # Drop rows, filling each gap with the current last row
+        for r in sorted(rows, reverse=True):
+            self.count -= 1
+            if r != self.count:
+                self.table[r] = self.table[self.count]
+
+    def add(self, bearing, distance, t):
+        if self.count == len(self.table):
+            self.table = np.concatenate((self.table, np.zeros(len(self.table), dtype=TRACK_DTYPE)))
+        r = self.count
+        self.table[r] = np.zeros((), dtype=TRACK_DTYPE)
+        for name, value in (("id", self.next_id), ("bearing", bearing), ("distance", distance),
+                            ("last_seen", t), ("hits", 1)):
+            self.table[name][r] = value
+        self.next_id += 1
+        self.count += 1
+
+    def update(self, t, camera_angle, offsets, distances):
+        # One frame: offsets are the contours' angles to the left of the image
+        # centre (counter-clockwise, like the camera motor), distances their
+        # ground distances.
+        # Returns (bearing, distance) of tracks that finished their centred samples.
+        offsets = np.asarray(offsets, dtype=np.float64)
+        distances = np.asarray(distances, dtype=np.float64)
+        dt = 0.0 if self.time is None else t - self.time
+        if dt > 0:
+            self.camera_rate = wrap(camera_angle - self.camera_angle) / dt
+        self.time = t
+        self.camera_angle = camera_angle
+
+        tracks = self.tracks
+        predicted = wrap(tracks["bearing"] + tracks["rate"] * dt)
+        bearings = wrap(camera_angle + offsets)
+        cost = np.abs(wrap(bearings[None, :] - predicted[:, None]))
+        rows, cols = assign(cost, self.gate + 0.5 * abs(self.camera_rate) * dt)
+
+        # Matched tracks: alpha-beta correction
+        residual = wrap(bearings[cols] - predicted[rows])
+        tracks["bearing"][rows] = wrap(predicted[rows] + self.alpha * residual)
+        if dt > 0:
+            tracks["rate"][rows] += self.beta * residual / dt
+        tracks["distance"][rows] += self.alpha * (distances[cols] - tracks["distance"][rows])
+        tracks["last_seen"][rows] = t
+        tracks["hits"][rows] += 1
+        tracks["misses"][rows] = 0
+
+        # Centred in the image: collect samples, report a track once it has enough
+        finished = []
+        centred = (np.abs(offsets[cols]) <= self.centre_angle) & ~tracks["reported"][rows]
+        r, k = rows[centred], cols[centred]
+        tracks["samples"][r] += 1
+        tracks["sin_sum"][r] += np.sin(bearings[k])
+        tracks["cos_sum"][r] += np.cos(bearings[k])
+        tracks["distance_sum"][r] += distances[k]
+        for i in r[tracks["samples"][r] >= self.samples]:
+            finished.append((math.atan2(tracks["sin_sum"][i], tracks["cos_sum"][i]),
+                             tracks["distance_sum"][i] / tracks["samples"][i]))
+            tracks["reported"][i] = True
+
+        # Unmatched tracks that should be in view miss a frame
+        unmatched = np.ones(self.count, dtype=bool)
+        unmatched[rows] = False
+        in_view = np.abs(wrap(predicted - camera_angle)) < 0.5 * self.h_fov
+        tracks["misses"][unmatched & in_view] += 1
+        expired = np.nonzero((tracks["misses"] > self.max_misses) | (t - tracks["last_seen"] > self.max_age))[0]
+
+        # Unmatched contours far enough away start tracks
+        new = np.ones(len(offsets), dtype=bool)
+        new[cols] = False
+        self.remove(expired.tolist())
+        for k in np.nonzero(new & (distances > self.min_distance))[0]:
+            self.add(bearings[k], distances[k], t)
+        return finished